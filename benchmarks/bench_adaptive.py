@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import contextlib
+from argparse import ArgumentParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine import AIMDController, DownloadEngine, DownloadJob, Metrics
+from standin import StandinServer
+
+FILES = 300
+SIZE = 1000 * 1000
+RATE = 1000 * 1000
+FIXED = 4
+MAXIMUM = 32
+CAPACITY = 8
+
+
+def main():
+    args = parse_args()
+    scenarios = {
+        # Every connection is capped, so more of them means more throughput
+        'fast CDN': {'rate': args.rate},
+        # The server answers 503 beyond a number of downloads at once
+        'overloaded': {'rate': args.rate, 'capacity': args.capacity},
+    }
+    for name, server_kwargs in scenarios.items():
+        with StandinServer(latency=0.05, **server_kwargs) as server:
+            for label, per_host, controller in (
+                (f'fixed {args.fixed} per host', args.fixed, None),
+                (f'fixed {args.maximum} per host', args.maximum, None),
+                (f'adaptive up to {args.maximum}', args.maximum, AIMDController(maximum=args.maximum, interval=1)),
+            ):
+                requests = server.requests
+                elapsed, metrics = bench(server, args.files, args.size, per_host, controller)
+                limits = f' ended at {controller.limits()}' if controller else ''
+                print(
+                    f'{name:11} {label:22} {metrics.bytes / elapsed / 1e6:7.1f} MB/s '
+                    f'{metrics.failed:4} failed {server.requests - requests:5} requests{limits}'
+                )
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog='bench_adaptive',
+        description='Compares a fixed number of downloads per host with adaptive concurrency against a local stand-in server',
+    )
+    parser.add_argument('-n', '--files', default=FILES, type=int, help=f'Number of files to download. Defaults to {FILES}')
+    parser.add_argument('-s', '--size', default=SIZE, type=int, help=f'Size of every file in bytes. Defaults to {SIZE}')
+    parser.add_argument('-r', '--rate', default=RATE, type=float, help=f'Bandwidth of every connection in bytes/s. Defaults to {RATE}')
+    parser.add_argument('-c', '--capacity', default=CAPACITY, type=int, help=f'Downloads the server of the overloaded scenario takes at once. Defaults to {CAPACITY}')
+    parser.add_argument('-f', '--fixed', default=FIXED, type=int, help=f'Downloads per host of the fixed run. Defaults to {FIXED}')
+    parser.add_argument('-m', '--maximum', default=MAXIMUM, type=int, help=f'Most downloads per host of the adaptive run. Defaults to {MAXIMUM}')
+    return parser.parse_args()
+
+
+def bench(server:StandinServer, files:int, size:int, per_host:int, controller) -> tuple:
+    metrics = Metrics()
+
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            async with DownloadEngine(concurrency=per_host, per_host=per_host, controller=controller, metrics=metrics, retry=10) as engine:
+                for i in range(files):
+                    await engine.submit(DownloadJob(server.url(f'/payload/{i}.bin?size={size}'), os.path.join(directory, f'{i}.bin')))
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(run())
+    return time.perf_counter() - start, metrics
+
+
+if __name__ == '__main__':
+    main()
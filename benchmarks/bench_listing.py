@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import contextlib
+from argparse import ArgumentParser
+from urllib.parse import quote
+from scrapy.http import HtmlResponse, XmlResponse
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+import fixtures
+from bench_suite import load_spiders
+
+ROWS = 30000
+GAMES = 2000
+SECONDS = 3.0
+BASE_URL = 'http://127.0.0.1'
+
+
+def main():
+    args = parse_args()
+    modules = load_spiders(('myrient', 'archive', 'vgmusic'))
+    for label, old, new, response_class, url, body in cases(modules, args):
+        print(f'{label} ({len(body) / (1 << 20):.1f} MiB page)')
+        old_items = list(old(response_class(url=url, body=body, encoding='utf-8')))
+        new_items = list(new(response_class(url=url, body=body, encoding='utf-8')))
+        if old_items != new_items:
+            print(f'  MISMATCH: {len(old_items)} entries before, {len(new_items)} after')
+            continue
+        old_rate = bench(old, response_class, url, body, args.seconds)
+        new_rate = bench(new, response_class, url, body, args.seconds)
+        print(f'  xpath per row: {old_rate:8.2f} pages/s {old_rate * len(old_items):10.0f} rows/s')
+        print(f'  single pass:   {new_rate:8.2f} pages/s {new_rate * len(new_items):10.0f} rows/s')
+        print(f'  speedup: {new_rate / old_rate:.1f}x')
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog='bench_listing',
+        description='Compares the old per-row XPath listing parsers with the single pass parsers on large listing pages',
+    )
+    parser.add_argument('-r', '--rows', default=ROWS, type=int, help=f'Rows in the generated myrient and archive listings. Defaults to {ROWS}')
+    parser.add_argument('-g', '--games', default=GAMES, type=int, help=f'Games in the generated vgmusic system page. Defaults to {GAMES}')
+    parser.add_argument('-t', '--seconds', default=SECONDS, type=float, help=f'Seconds to parse each page for. Defaults to {SECONDS}')
+    parser.add_argument('--myrient', help='A recorded myrient listing to use instead of the generated one')
+    parser.add_argument('--archive', help='A recorded archive.org directory listing to use instead of the generated one')
+    parser.add_argument('--archive-xml', help='A recorded archive.org _files.xml to use instead of the generated one')
+    parser.add_argument('--vgmusic', help='A recorded vgmusic system page to use instead of the generated one')
+    return parser.parse_args()
+
+
+def recorded(path:str, generated:bytes) -> bytes:
+    if not path:
+        return generated
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def cases(modules:dict, args) -> list:
+    """
+    Returns (label, old parser, new parser, response class, url, body) for
+    every listing, each parser taking a response and returning its entries.
+    """
+    cases = []
+    if 'myrient' in modules:
+        spider = modules['myrient'].myrientScraper()
+        body = recorded(args.myrient, fixtures.myrient_pages(args.rows)[fixtures.MYRIENT_PATH][0])
+        cases.append(('myrient listing', old_myrient, spider.parse, HtmlResponse, BASE_URL + fixtures.MYRIENT_PATH, body))
+    if 'archive' in modules:
+        spider = modules['archive'].archiveDLSpider()
+        parse_size = modules['archive'].parse_size
+        pages = fixtures.archive_pages(args.rows)
+        url = BASE_URL + fixtures.ARCHIVE_PATH
+        xml_path = f'{fixtures.ARCHIVE_PATH}/{fixtures.ARCHIVE_IDENTIFIER}_files.xml'
+        cases.append(('archive listing', lambda r, spider=spider: old_archive(spider, parse_size, r), lambda r, spider=spider: map(dict, spider.parse(r)), HtmlResponse, url, recorded(args.archive, pages[fixtures.ARCHIVE_PATH][0])))
+        cases.append(('archive files.xml', lambda r, spider=spider: old_files_xml(spider, r, url), lambda r, spider=spider: map(dict, spider.parse_files_xml(r, url)), XmlResponse, BASE_URL + xml_path, recorded(args.archive_xml, pages[xml_path][0])))
+    if 'vgmusic' in modules:
+        spider = modules['vgmusic'].vgmusicDL()
+        path = '/vgmusic/music/console/maker0/system0/'
+        body = recorded(args.vgmusic, fixtures.vgmusic_pages(BASE_URL, 1, 1, args.games, 10)[path][0])
+        cases.append(('vgmusic system', old_vgmusic, lambda r, spider=spider: system_links(spider.parse_system('Console Systems', 'Maker 0', 'System 0', r)), HtmlResponse, BASE_URL + path, body))
+    return cases
+
+
+def bench(parser, response_class, url:str, body:bytes, seconds:float) -> float:
+    pages = 0
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        while (spent := time.perf_counter() - start) < seconds:
+            # A new response every time so the parsed tree is not cached
+            for _ in parser(response_class(url=url, body=body, encoding='utf-8')):
+                pass
+            pages += 1
+    return pages / spent
+
+
+def system_links(data:dict) -> list:
+    return [(game, title, link) for game, titles in data['games'].items() for title, link in titles.items()]
+
+
+# The parsers as they were before the single pass rewrite, kept as the
+# reference the new ones are checked and timed against
+
+def old_myrient(response):
+    links = response.xpath('//table[@id="list"]/tbody/tr/td[contains(@class, "link")]/a')
+    for link in links:
+        name = link.xpath('text()').get()
+        url = link.xpath('@href').get()
+        if url != '../':
+            yield {
+                'name': name,
+                'url': response.urljoin(url)
+            }
+
+
+def old_archive(spider, parse_size, response):
+    rows = response.xpath('//table[@class="directory-listing-table"]/tbody/tr')
+    for row in rows:
+        name = row.xpath('td[1]/a/text()').get()
+        if name and spider.reg.match(name):
+            yield {
+                'name': name,
+                'url': response.url + "/" + row.xpath('td[1]/a/@href').get(),
+                'directory': response.url.rsplit('/')[-1],
+                'size': parse_size(row.xpath('td[last()]/text()').get())
+            }
+
+
+def old_files_xml(spider, response, url):
+    for f in response.xpath('//file'):
+        name = f.attrib.get('name', '')
+        if spider.reg.match(name):
+            yield {
+                'name': name,
+                'url': url + "/" + quote(name),
+                'directory': url.rsplit('/')[-1],
+                'size': int(f.xpath('size/text()').get() or 0),
+                'checksums': {name: value for name in ('md5', 'sha1', 'crc32') if (value := f.xpath(name + '/text()').get())}
+            }
+
+
+def old_vgmusic(response):
+    rows = response.xpath('//table/tr')
+    game = ''
+    links = []
+    for row in rows:
+        if 'class' in row.attrib and row.attrib['class'] == 'header':
+            game = row.xpath('td/a/text()').get()
+        elif row.xpath('td/a').get():
+            links.append((game, row.xpath('td/a/text()').get(), response.url + row.xpath('td/a/@href').get()))
+    return links
+
+
+if __name__ == '__main__':
+    main()
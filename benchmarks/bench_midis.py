@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import tempfile
+import contextlib
+from argparse import ArgumentParser
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine import DownloadJob, run_jobs
+from standin import StandinServer
+
+FILES = 400
+SIZE = 16 * 1024
+LATENCY = 0.05
+CONCURRENCY = 16
+PER_HOST = 16
+
+
+def main():
+    args = parse_args()
+    with StandinServer(size=args.size, latency=args.latency) as server:
+        urls = [server.url(f'/payload/{i}.mid') for i in range(args.files)]
+        serial = bench_serial(urls)
+        print(f'serial (old Pool.apply path): {args.files / serial:8.1f} files/s  {serial:6.2f}s')
+        engine = bench_engine(urls, args.concurrency, args.per_host)
+        print(f'engine ({args.concurrency} concurrent, {args.per_host} per host): {args.files / engine:8.1f} files/s  {engine:6.2f}s')
+        print(f'speedup: {serial / engine:.1f}x')
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog='bench_midis',
+        description='Compares the old one-at-a-time MIDI download loop with the shared download engine against a local stand-in server',
+    )
+    parser.add_argument('-n', '--files', default=FILES, type=int, help=f'Number of files to download. Defaults to {FILES}')
+    parser.add_argument('-s', '--size', default=SIZE, type=int, help=f'Size of every file in bytes. Defaults to {SIZE}')
+    parser.add_argument('-l', '--latency', default=LATENCY, type=float, help=f'Server latency per request in seconds. Defaults to {LATENCY}')
+    parser.add_argument('-i', '--concurrency', default=CONCURRENCY, type=int, help=f'Engine concurrency. Defaults to {CONCURRENCY}')
+    parser.add_argument('-p', '--per-host', default=PER_HOST, type=int, help=f'Engine per host limit. Defaults to {PER_HOST}')
+    return parser.parse_args()
+
+
+def bench_serial(urls) -> float:
+    with tempfile.TemporaryDirectory() as dl_dir:
+        start = time.perf_counter()
+        for url in urls:
+            path = os.path.join(dl_dir, url.rsplit('/', 1)[1])
+            r = requests.get(url, allow_redirects=True, timeout=5, stream=True)
+            with open(path + '.part', 'wb') as f:
+                for chunk in r.iter_content(chunk_size=1024):
+                    f.write(chunk)
+            os.rename(path + '.part', path)
+        return time.perf_counter() - start
+
+
+def bench_engine(urls, concurrency:int, per_host:int) -> float:
+    with tempfile.TemporaryDirectory() as dl_dir:
+        jobs = [DownloadJob(url, os.path.join(dl_dir, url.rsplit('/', 1)[1])) for url in urls]
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            run_jobs(jobs, concurrency=concurrency, per_host=per_host)
+        return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import heapq
+import random
+from argparse import ArgumentParser
+from xml.etree import ElementTree
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'ia-cluster-dl'))
+from archive import largest_first
+
+NODES = 7
+BANDWIDTH = 50 * 1024 * 1024
+SEED = 42
+
+
+def main():
+    args = parse_args()
+    jobs = []
+    for listing in args.listings:
+        jobs.extend(load_listing(listing))
+    if not jobs:
+        jobs = synthetic_collection(random.Random(args.seed))
+    bandwidths = [float(b) * 1024 * 1024 for b in args.bandwidths.split(',')] if args.bandwidths else [BANDWIDTH] * args.nodes
+    total = sum(job['size'] for job in jobs)
+    print(f'{len(jobs)} files, {total / (1 << 30):.1f} GiB over {len(bandwidths)} nodes')
+    print(f'lower bound (aggregate bandwidth): {format_time(total / sum(bandwidths))}')
+    for name, makespan in [
+        ('round robin by count', round_robin(jobs, bandwidths)),
+        ('pull, listing order', pull(jobs, bandwidths)),
+        ('pull, largest first', pull(largest_first(jobs), bandwidths)),
+    ]:
+        print(f'{name:24} {format_time(makespan)}')
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog='bench_placement',
+        description='Simulates the makespan of the ia-cluster-dl job placement strategies over recorded collection listings',
+    )
+    parser.add_argument(
+        'listings',
+        nargs='*',
+        help='Recorded <identifier>_files.xml files or json feeds of fileItems. A synthetic mixed collection is used when omitted'
+    )
+    parser.add_argument('-n', '--nodes', default=NODES, type=int, help=f'Number of dl-server nodes. Defaults to {NODES}')
+    parser.add_argument('-b', '--bandwidths', help='Comma separated MiB/s for every node, overrides --nodes')
+    parser.add_argument('-s', '--seed', default=SEED, type=int, help=f'Seed for the synthetic collection. Defaults to {SEED}')
+    return parser.parse_args()
+
+
+def load_listing(path:str) -> list:
+    if path.endswith('.xml'):
+        root = ElementTree.parse(path).getroot()
+        return [
+            {'name': f.get('name'), 'size': int(f.findtext('size') or 0)}
+            for f in root.iter('file') if f.get('name', '').endswith('.zip')
+        ]
+    with open(path, 'rb') as infile:
+        return [{'name': item['name'], 'size': item.get('size') or 0} for item in json.load(infile)]
+
+
+def synthetic_collection(rng:random.Random) -> list:
+    """
+    A mix shaped like the default start_urls: a few hundred Dreamcast and
+    PSP images of up to several GB next to thousands of small Game Boy zips.
+    """
+    jobs = []
+    for i in range(400):
+        jobs.append({'name': f'disc{i}.zip', 'size': int(min(rng.lognormvariate(20.5, 0.8), 4.5 * (1 << 30)))})
+    for i in range(3000):
+        jobs.append({'name': f'cart{i}.zip', 'size': int(rng.lognormvariate(13.5, 1.2))})
+    rng.shuffle(jobs)
+    return jobs
+
+
+def round_robin(jobs:list, bandwidths:list) -> float:
+    loads = [0] * len(bandwidths)
+    for index, job in enumerate(jobs):
+        loads[index % len(bandwidths)] += job['size']
+    return max(load / bandwidth for load, bandwidth in zip(loads, bandwidths))
+
+
+def pull(jobs:list, bandwidths:list) -> float:
+    """
+    Every node takes the next job in the queue whenever it runs out of work.
+    """
+    free_at = [(0.0, node) for node in range(len(bandwidths))]
+    heapq.heapify(free_at)
+    makespan = 0.0
+    for job in jobs:
+        time, node = heapq.heappop(free_at)
+        time += job['size'] / bandwidths[node]
+        makespan = max(makespan, time)
+        heapq.heappush(free_at, (time, node))
+    return makespan
+
+
+def format_time(seconds:float) -> str:
+    return f'{seconds / 3600:7.2f} h'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import contextlib
+from argparse import ArgumentParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine import CircuitBreaker, DownloadEngine, DownloadJob, Metrics, RetryPolicy
+from standin import StandinServer
+
+FILES = 200
+ERROR = 0.3
+RETRY = 3
+
+
+def main():
+    args = parse_args()
+    policies = (
+        # The engine before retries were classified and spaced out
+        ('immediate retries', lambda: {
+            'policy': RetryPolicy(base_delay=0, max_retry_after=0),
+            'breaker': CircuitBreaker(threshold=sys.maxsize),
+            'dead_letter_passes': 0
+        }),
+        ('backoff and breaker', lambda: {
+            'policy': RetryPolicy(base_delay=0.1),
+            'breaker': CircuitBreaker(cooldown=2)
+        }),
+    )
+    with StandinServer(error=args.error) as server:
+        for label, kwargs in policies:
+            requests = server.requests
+            elapsed, metrics = bench([server.url(f'/payload/{i}.bin') for i in range(args.files)], args.retry, **kwargs())
+            print(
+                f'flaky mirror  {label:20} {elapsed:6.1f}s {metrics.failed:4} failed '
+                f'{server.requests - requests:5} requests'
+            )
+    # Behind a proxy that answers 502 for every request
+    with StandinServer(error=1, error_status=502) as server:
+        for label, kwargs in policies:
+            requests = server.requests
+            elapsed, metrics = bench([server.url(f'/payload/{i}.bin') for i in range(args.files)], args.retry, **kwargs())
+            print(
+                f'dead mirror   {label:20} {elapsed:6.1f}s {metrics.failed:4} failed '
+                f'{server.requests - requests:5} requests'
+            )
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog='bench_retry',
+        description='Compares immediate retries with backoff and circuit breaking against a flaky and a dead stand-in mirror',
+    )
+    parser.add_argument('-n', '--files', default=FILES, type=int, help=f'Number of files to download. Defaults to {FILES}')
+    parser.add_argument('-e', '--error', default=ERROR, type=float, help=f'Probability of the flaky mirror answering 503. Defaults to {ERROR}')
+    parser.add_argument('-r', '--retry', default=RETRY, type=int, help=f'Attempts per file. Defaults to {RETRY}')
+    return parser.parse_args()
+
+
+def bench(urls:list, retry:int, **kwargs) -> tuple:
+    metrics = Metrics()
+
+    async def run():
+        with tempfile.TemporaryDirectory() as directory:
+            async with DownloadEngine(metrics=metrics, retry=retry, **kwargs) as engine:
+                for i, url in enumerate(urls):
+                    await engine.submit(DownloadJob(url, os.path.join(directory, f'{i}.bin')))
+
+    start = time.perf_counter()
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(run())
+    return time.perf_counter() - start, metrics
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+import importlib.util
+import contextlib
+import subprocess
+from argparse import ArgumentParser
+
+ROOT = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..')
+sys.path.append(ROOT)
+from dlengine import DownloadJob, DownloadEngine
+from standin import StandinServer, load_pages
+import fixtures
+
+SPIDERS = ('myrient', 'archive', 'vgmusic', 'synthesiamaniac', 'omniatlas')
+SECTIONS = ('parse', 'download', 'crawl')
+PARSE_TIME = 1.0
+CONCURRENCY = 16
+PAGE_LATENCY = 0.02
+LATENCY = 0.01
+MiB = 1024 * 1024
+# How each downloader drives the engine, with a typical file for its site
+DOWNLOADS = {
+    'myrient': {'files': 8, 'size': 32 * MiB, 'engine': {'concurrency': 16, 'per_host': 16, 'skip_existing': False}},
+    'archive': {'files': 2, 'size': 128 * MiB, 'engine': {'segments': 8, 'segment_threshold': 64 * MiB}},
+    'vgmusic': {'files': 400, 'size': 16 * 1024, 'engine': {'concurrency': 16, 'per_host': 4}},
+    'synthesiamaniac': {'files': 400, 'size': 16 * 1024, 'engine': {'concurrency': 16, 'per_host': 4}},
+    'omniatlas': {'files': 100, 'size': 512 * 1024, 'engine': {'concurrency': 16, 'per_host': 16}},
+}
+
+
+def main():
+    args = parse_args()
+    spiders = args.spiders.split(',') if args.spiders else SPIDERS
+    sections = args.sections.split(',') if args.sections else SECTIONS
+    modules = load_spiders(spiders)
+    results = []
+    with StandinServer(latency=args.latency, rate=args.rate, error=args.error, drop=args.drop, page_latency=args.page_latency) as server:
+        server.pages = fixtures.site(server.base_url, args.scale)
+        if args.pages:
+            server.pages.update(load_pages(args.pages))
+        if 'parse' in sections:
+            for name, module in modules.items():
+                results.append(bench_parse(name, module, server, args.parse_time))
+        if 'download' in sections:
+            for name in spiders:
+                results.append(bench_download(name, server, args.scale))
+        if 'crawl' in sections and modules:
+            results.extend(bench_crawls(modules, server, args.concurrency))
+    if args.output:
+        record(args.output, results)
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog='bench_suite',
+        description='Measures parse, crawl and download throughput of every downloader against a local stand-in server instead of the live sites',
+    )
+    parser.add_argument('--spiders', help=f'Comma separated spiders to measure. Defaults to {",".join(SPIDERS)}')
+    parser.add_argument('--sections', help=f'Comma separated sections to run. Defaults to {",".join(SECTIONS)}')
+    parser.add_argument('--scale', default=1, type=int, help='Multiplies the size of the fixture sites and the number of files downloaded. Defaults to 1')
+    parser.add_argument('--pages', help='A directory of recorded pages, saved under their url paths, served in place of the generated fixtures')
+    parser.add_argument('--parse-time', default=PARSE_TIME, type=float, help=f'Seconds to spend parsing each page. Defaults to {PARSE_TIME}')
+    parser.add_argument('-c', '--concurrency', default=CONCURRENCY, type=int, help=f'CONCURRENT_REQUESTS of the crawls. Defaults to {CONCURRENCY}')
+    parser.add_argument('--page-latency', default=PAGE_LATENCY, type=float, help=f'Server latency per page in seconds. Defaults to {PAGE_LATENCY}')
+    parser.add_argument('-l', '--latency', default=LATENCY, type=float, help=f'Server latency per download in seconds. Defaults to {LATENCY}')
+    parser.add_argument('--rate', default=0, type=float, help='Bandwidth cap of every download in bytes/s. Defaults to none')
+    parser.add_argument('--error', default=0, type=float, help='Probability of a download answering 503. Defaults to 0')
+    parser.add_argument('--drop', default=0, type=float, help='Probability of a download being cut off half way. Defaults to 0')
+    parser.add_argument('-o', '--output', help='Append the results as json lines to this file, to track them across commits')
+    return parser.parse_args()
+
+
+def load_module(name:str, path:str):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_spiders(names) -> dict:
+    """
+    Imports the module holding each spider, skipping those whose
+    dependencies are not installed.
+    """
+    paths = {
+        'myrient': 'myrient/run.py',
+        'archive': 'ia-cluster-dl/archive.py',
+        'vgmusic': 'vgmusic/run.py',
+        'synthesiamaniac': 'sythensia-maniac/run.py',
+        'omniatlas': 'omniatlas/spider.py',
+    }
+    modules = {}
+    for name in names:
+        path = os.path.join(ROOT, paths[name])
+        sys.path.insert(0, os.path.dirname(path))
+        try:
+            modules[name] = load_module(f'bench_{name}', path)
+        except ImportError as e:
+            print(f'Skipping {name}: {e}')
+        finally:
+            sys.path.remove(os.path.dirname(path))
+    return modules
+
+
+def parse_cases(name:str, module, base_url:str) -> list:
+    """
+    Returns (label, url, callback) for every page a spider parses. The
+    callback takes a response and returns the number of entries found.
+    """
+    if name == 'myrient':
+        spider = module.myrientScraper()
+        return [('listing', base_url + fixtures.MYRIENT_PATH, lambda r: count(spider.parse(r)))]
+    if name == 'archive':
+        spider = module.archiveDLSpider()
+        url = base_url + fixtures.ARCHIVE_PATH
+        return [
+            ('files.xml', f'{url}/{fixtures.ARCHIVE_IDENTIFIER}_files.xml', lambda r: count(spider.parse_files_xml(r, url))),
+            ('listing', url, lambda r: count(spider.parse(r))),
+        ]
+    if name == 'vgmusic':
+        spider = module.vgmusicDL()
+        system = base_url + '/vgmusic/music/console/maker0/system0/'
+        return [
+            ('sitemap', base_url + fixtures.VGMUSIC_SITEMAP, lambda r: count(spider.parse_sitemap(r))),
+            ('system', system, lambda r: sum(len(game) for game in spider.parse_system('Console Systems', 'Maker 0', 'System 0', r)['games'].values())),
+        ]
+    if name == 'synthesiamaniac':
+        spider = module.synthesiamaniacDL()
+        return [('downloads', fixtures.synthesia_urls(base_url)[0], lambda r: sum(len(section['urls']) for section in spider.parse(r)))]
+    if name == 'omniatlas':
+        return [('frame', fixtures.omniatlas_urls(base_url)[0], lambda r: int(bool(module.AtlasSpider.parse_frame(r).get('image'))))]
+    return []
+
+
+def count(results) -> int:
+    return sum(1 for _ in results or ())
+
+
+def bench_parse(name:str, module, server:StandinServer, seconds:float) -> dict:
+    from scrapy.http import HtmlResponse, XmlResponse
+    result = {'section': 'parse', 'spider': name, 'pages': 0, 'items': 0, 'bytes': 0}
+    elapsed = 0.0
+    for label, url, callback in parse_cases(name, module, server.base_url):
+        body, content_type = server.pages[url[len(server.base_url):]]
+        response_class = XmlResponse if content_type.endswith('xml') else HtmlResponse
+        pages = items = 0
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            while (spent := time.perf_counter() - start) < seconds:
+                # A new response every time so the parsed tree is not cached
+                items += callback(response_class(url=url, body=body, encoding='utf-8'))
+                pages += 1
+        print(f'parse    {name:16} {label:10} {pages / spent:10.1f} pages/s {items / spent:12.0f} items/s  ({len(body) / 1024:.0f} KiB page)')
+        result['pages'] += pages
+        result['items'] += items
+        result['bytes'] += pages * len(body)
+        elapsed += spent
+    result['seconds'] = elapsed
+    result['pages_per_second'] = result['pages'] / elapsed if elapsed else 0
+    result['items_per_second'] = result['items'] / elapsed if elapsed else 0
+    return result
+
+
+def bench_download(name:str, server:StandinServer, scale:int) -> dict:
+    config = DOWNLOADS[name]
+    files = config['files'] * scale
+    urls = [server.url(f'/payload/{name}-{i}.bin?size={config["size"]}') for i in range(files)]
+    with tempfile.TemporaryDirectory() as dl_dir:
+        jobs = [DownloadJob(url, os.path.join(dl_dir, f'{i}.bin')) for i, url in enumerate(urls)]
+
+        async def run():
+            async with DownloadEngine(**config['engine']) as engine:
+                for job in jobs:
+                    await engine.submit(job)
+            return engine.metrics
+
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            metrics = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+    mb = metrics.bytes / 1e6
+    print(
+        f'download {name:16} {files:5d} x {config["size"] / 1024:8.0f} KiB {mb / elapsed:10.1f} MB/s '
+        f'{files / elapsed:8.1f} files/s  {metrics.failed} failed, {metrics.retries} retries'
+    )
+    return {
+        'section': 'download', 'spider': name, 'files': files, 'bytes': metrics.bytes, 'seconds': elapsed,
+        'mb_per_second': mb / elapsed, 'files_per_second': files / elapsed,
+        'failed': metrics.failed, 'retries': metrics.retries
+    }
+
+
+def crawl_setup(name:str, module, base_url:str):
+    """
+    Points a spider at the stand-in and returns its class and crawl
+    arguments.
+    """
+    if name == 'myrient':
+        return module.myrientScraper, {'start_urls': [base_url + fixtures.MYRIENT_PATH]}
+    if name == 'archive':
+        return module.archiveDLSpider, {'start_urls': [base_url + fixtures.ARCHIVE_PATH], 'allowed_domains': []}
+    if name == 'vgmusic':
+        module.SITEMAP = base_url + fixtures.VGMUSIC_SITEMAP
+        return module.vgmusicDL, {}
+    if name == 'synthesiamaniac':
+        module.DL_URLS = fixtures.synthesia_urls(base_url)
+        return module.synthesiamaniacDL, {}
+    if name == 'omniatlas':
+        return module.AtlasSpider, {'start_urls': fixtures.omniatlas_urls(base_url), 'sitemap_urls': [base_url + '/sitemap.xml']}
+
+
+def bench_crawls(modules:dict, server:StandinServer, concurrency:int) -> list:
+    """
+    Runs every crawl one after another on a single reactor, which can only
+    be started once per process.
+    """
+    from scrapy.utils.reactor import install_reactor
+    install_reactor('twisted.internet.asyncioreactor.AsyncioSelectorReactor')
+    from twisted.internet import reactor, defer
+    from scrapy.crawler import CrawlerRunner
+    runner = CrawlerRunner({
+        'LOG_LEVEL': 'ERROR',
+        'TELNETCONSOLE_ENABLED': False,
+        'ROBOTSTXT_OBEY': False,
+        'CONCURRENT_REQUESTS': concurrency,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': concurrency,
+        'DISCOVER': True,
+    })
+    results = []
+
+    @defer.inlineCallbacks
+    def crawl_all():
+        try:
+            for name, module in modules.items():
+                spider_class, kwargs = crawl_setup(name, module, server.base_url)
+                crawler = runner.create_crawler(spider_class)
+                start = time.perf_counter()
+                yield runner.crawl(crawler, **kwargs)
+                elapsed = time.perf_counter() - start
+                stats = crawler.stats.get_stats()
+                pages = stats.get('response_received_count', 0)
+                items = stats.get('item_scraped_count', 0)
+                print(f'crawl    {name:16} {pages:5d} pages {pages / elapsed:10.1f} pages/s {items / elapsed:12.0f} items/s')
+                results.append({
+                    'section': 'crawl', 'spider': name, 'pages': pages, 'items': items, 'seconds': elapsed,
+                    'pages_per_second': pages / elapsed, 'items_per_second': items / elapsed
+                })
+        finally:
+            reactor.stop()
+
+    reactor.callWhenRunning(crawl_all)
+    reactor.run()
+    return results
+
+
+def record(path:str, results:list):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    with open(path, 'a') as f:
+        for result in results:
+            f.write(json.dumps({'time': time.time(), 'commit': commit, **result}) + '\n')
+
+
+if __name__ == '__main__':
+    main()
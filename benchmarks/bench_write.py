@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import time
+import asyncio
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+from argparse import ArgumentParser
+import aiohttp
+import requests
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine import DownloadJob, DownloadEngine
+from dlengine.engine import Digests
+from standin import StandinServer
+
+SIZE = 1024 * 1024 * 1024
+OLD_CHUNK_SIZE = 64 * 1024
+
+
+def main():
+    args = parse_args()
+    paths = {
+        'requests iter_content(1024), no hashing': bench_requests,
+        'engine before (64 KiB chunks, sha1)': bench_engine_before,
+        'engine (buffered writer, sha1)': bench_engine,
+    }
+    with standin_process() as base_url, tempfile.TemporaryDirectory(dir=args.dir) as directory:
+        url = f'{base_url}/payload/bench.bin?size={args.size}'
+        for label, bench in paths.items():
+            if args.skip_requests and bench is bench_requests:
+                continue
+            path = os.path.join(directory, 'bench.bin')
+            cpu = process_time()
+            start = time.perf_counter()
+            bench(url, path)
+            elapsed = time.perf_counter() - start
+            cpu = process_time() - cpu
+            if os.path.getsize(path) != args.size:
+                print(f'{label}: wrote {os.path.getsize(path)} of {args.size} bytes')
+            gigabytes = args.size / (1 << 30)
+            print(f'{label:42} {cpu / gigabytes:6.2f} CPU s/GB {args.size / elapsed / 1e6:8.1f} MB/s')
+            os.remove(path)
+
+
+def parse_args():
+    parser = ArgumentParser(
+        prog='bench_write',
+        description='Measures the CPU time spent per GB downloaded by the old write loops and the download engine against a local stand-in server',
+    )
+    parser.add_argument('-s', '--size', default=SIZE, type=int, help=f'Size of the downloaded file in bytes. Defaults to {SIZE}')
+    parser.add_argument('-d', '--dir', help='Directory to write into, e.g. on the NAS. If omitted will default to the system temp directory')
+    parser.add_argument('--skip-requests', action='store_true', help='Skip the 1 KiB requests loop, which takes minutes for large sizes')
+    return parser.parse_args()
+
+
+def serve(queue:multiprocessing.Queue, stop):
+    with StandinServer(latency=0) as server:
+        queue.put(server.base_url)
+        stop.wait()
+
+
+@contextlib.contextmanager
+def standin_process():
+    """
+    Runs the stand-in server in a child process, so that the CPU time of
+    this one, including the engine's threads, is the cost of downloading.
+    """
+    queue = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    process = multiprocessing.Process(target=serve, args=(queue, stop), daemon=True)
+    process.start()
+    try:
+        yield queue.get()
+    finally:
+        stop.set()
+        process.join()
+
+
+def process_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def bench_requests(url:str, path:str):
+    with requests.get(url, stream=True) as response:
+        with open(path, 'wb') as f:
+            for chunk in response.iter_content(chunk_size=1024):
+                f.write(chunk)
+
+
+def bench_engine_before(url:str, path:str):
+    """
+    The engine's write loop before the buffered writer.
+    """
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            async with session.get(url) as response:
+                digests = Digests()
+                with open(path, 'wb') as f:
+                    async for chunk in response.content.iter_chunked(OLD_CHUNK_SIZE):
+                        f.write(chunk)
+                        digests.update(chunk)
+    asyncio.run(run())
+
+
+def bench_engine(url:str, path:str):
+    async def run():
+        async with DownloadEngine(skip_existing=False) as engine:
+            await engine.submit(DownloadJob(url, path))
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""
+Fixture pages for every spider, shaped like the markup each parse method
+reads. They are generated so their size can be scaled; pages recorded from
+the live sites can be layered over them with standin.load_pages.
+"""
+
+import hashlib
+import zlib
+from html import escape
+
+MYRIENT_PATH = '/myrient/files/'
+ARCHIVE_IDENTIFIER = 'bench-collection'
+ARCHIVE_PATH = '/download/' + ARCHIVE_IDENTIFIER
+VGMUSIC_SITEMAP = '/vgmusic/information/sitemap.php'
+SYNTHESIA_PATH = '/synthesiamaniac/downloads/'
+OMNIATLAS_REGIONS = ('europe', 'east-asia', 'arctic', 'australasia')
+OMNIATLAS_TIMELINE = 3
+HTML = 'text/html'
+XML = 'text/xml'
+
+
+def site(base_url:str, scale:int = 1) -> dict:
+    """
+    Returns every fixture page keyed by url path, as (body, content type).
+    Absolute links in them point at `base_url`.
+    """
+    pages = {}
+    pages.update(myrient_pages(2000 * scale))
+    pages.update(archive_pages(2000 * scale))
+    pages.update(vgmusic_pages(base_url, 4, 5 * scale, 40, 10))
+    pages.update(synthesia_pages(9, 20 * scale, 15))
+    pages.update(omniatlas_pages(base_url, 100 * scale))
+    return pages
+
+
+def page(body:str, content_type:str = HTML) -> tuple:
+    return body.encode('utf-8'), content_type
+
+
+def myrient_pages(files:int) -> dict:
+    rows = ['<tr><td class="link"><a href="../">Parent directory/</a></td><td class="size">-</td><td class="date">-</td></tr>']
+    for i in range(files):
+        name = f'Game {i:05d} (USA) (Rev {i % 3}).zip'
+        rows.append(
+            f'<tr><td class="link"><a href="{escape(name)}" title="{escape(name)}">{escape(name)}</a></td>'
+            f'<td class="size">{(i % 900) + 1}.{i % 10} MiB</td><td class="date">2024-01-{(i % 28) + 1:02d} 00:00</td></tr>'
+        )
+    body = (
+        '<html><head><title>Index of /files/</title></head><body><h1>Index of /files/</h1>'
+        '<table id="list"><thead><tr><th>File Name</th><th>File Size</th><th>Date</th></tr></thead>'
+        f'<tbody>{"".join(rows)}</tbody></table></body></html>'
+    )
+    return {MYRIENT_PATH: page(body)}
+
+
+def archive_pages(files:int) -> dict:
+    entries = []
+    rows = ['<tr><td><a href="../">Go to parent directory</a></td><td></td><td>-</td></tr>']
+    for i in range(files):
+        name = f'Game {i:05d} (Europe).zip'
+        size = (i % 700 + 1) * 1024 * 1024 + i
+        digest = name.encode('utf-8')
+        entries.append(
+            f'<file name="{escape(name)}" source="original"><mtime>1465776000</mtime><size>{size}</size>'
+            f'<md5>{hashlib.md5(digest).hexdigest()}</md5><crc32>{zlib.crc32(digest):08x}</crc32>'
+            f'<sha1>{hashlib.sha1(digest).hexdigest()}</sha1><format>ZIP</format></file>'
+        )
+        entries.append(f'<file name="{escape(name)}.torrent" source="metadata"><size>{i + 100}</size><format>Archive BitTorrent</format></file>')
+        rows.append(f'<tr><td><a href="{escape(name)}">{escape(name)}</a></td><td>13-Jun-2016 02:00</td><td>{size / (1 << 20):.1f}M</td></tr>')
+    xml = f'<?xml version="1.0" encoding="UTF-8"?><files>{"".join(entries)}</files>'
+    listing = (
+        f'<html><body><table class="directory-listing-table"><thead><tr><th>Name</th><th>Last modified</th><th>Size</th></tr></thead>'
+        f'<tbody>{"".join(rows)}</tbody></table></body></html>'
+    )
+    return {
+        ARCHIVE_PATH: page(listing),
+        f'{ARCHIVE_PATH}/{ARCHIVE_IDENTIFIER}_files.xml': page(xml, XML)
+    }
+
+
+def vgmusic_pages(base_url:str, manufacturers:int, systems:int, games:int, midis:int) -> dict:
+    """
+    The vgmusic sitemap lists console systems by manufacturer, computer
+    systems and other genres in alternating header and link rows of a table
+    titled Music, and each system page groups its MIDIs under game header
+    rows.
+    """
+    pages = {}
+    system_paths = []
+
+    def system(path):
+        system_paths.append(path)
+        return base_url + path
+
+    consoles = []
+    for m in range(manufacturers):
+        links = ' '.join(f'<a href="{system(f"/vgmusic/music/console/maker{m}/system{s}/")}">System {m}-{s}</a>' for s in range(systems))
+        consoles.append(f'<li>Maker {m}:{links}</li>')
+    computers = ''.join(f'<li><a href="{system(f"/vgmusic/music/computer/computer{c}/")}">Computer {c}</a></li>' for c in range(systems))
+    others = ''.join(f'<li><a href="{system(f"/vgmusic/music/other/genre{g}/")}">Genre {g}</a></li>' for g in range(systems))
+    sitemap = (
+        '<html><body><table><tr><td><span>Information</span></td></tr></table>'
+        '<table><tr><td><span>Music</span></td></tr>'
+        f'<tr><td><span>Console Systems</span></td></tr><tr><td><ul>{"".join(consoles)}</ul></td></tr>'
+        f'<tr><td><span>Computer Systems</span></td></tr><tr><td><ul>{computers}</ul></td></tr>'
+        f'<tr><td><span>Other</span></td></tr><tr><td><ul>{others}</ul></td></tr>'
+        '</table></body></html>'
+    )
+    pages[VGMUSIC_SITEMAP] = page(sitemap)
+    rows = []
+    for g in range(games):
+        rows.append(f'<tr class="header"><td colspan="4"><a name="game{g}">Game {g}</a></td></tr>')
+        for i in range(midis):
+            rows.append(f'<tr><td><a href="game{g}_{i}.mid">Track {i}</a></td><td>{(i + 1) * 1024} bytes</td><td>Sequencer</td><td>comments</td></tr>')
+    system_page = page(f'<html><body><table>{"".join(rows)}</table></body></html>')
+    for path in system_paths:
+        pages[path] = system_page
+    return pages
+
+
+def synthesia_pages(count:int, sections:int, midis:int) -> dict:
+    pages = {}
+    for p in range(count):
+        items = []
+        for s in range(sections):
+            rows = ''.join(
+                f'<tr><td class="midi-name">Song {s}-{i}</td><td class="midi-download"><a href="/wp-content/uploads/midi/page{p}/song{s}_{i}.mid">Download</a></td></tr>'
+                for i in range(midis)
+            )
+            items.append(
+                f'<div class="wp-block-pb-accordion-item c-accordion__item"><h4>Section {s}</h4>'
+                f'<div class="c-accordion__content"><table>{rows}</table></div></div>'
+            )
+        body = f'<html><body><div class="entry-content czr-wp-the-content">{"".join(items)}</div></body></html>'
+        pages[f'{SYNTHESIA_PATH}page{p}/'] = page(body)
+    return pages
+
+
+def synthesia_urls(base_url:str, count:int = 9) -> list:
+    return [f'{base_url}{SYNTHESIA_PATH}page{p}/' for p in range(count)]
+
+
+def omniatlas_frame_path(region:str, frame:int) -> str:
+    return f'/maps/{region}/{1000 + frame:04d}0101/'
+
+
+def omniatlas_pages(base_url:str, frames:int) -> dict:
+    """
+    Frame pages follow the nesting the AtlasSpider xpaths walk: the region
+    in the third block of the first section, the title, image and
+    description in the second, the next frame as the fourth button and a
+    timeline of the neighbouring frames.
+    """
+    pages = {}
+    urls = []
+    for region in OMNIATLAS_REGIONS:
+        for frame in range(frames):
+            path = omniatlas_frame_path(region, frame)
+            urls.append(path)
+            timeline = ''.join(
+                f'<a href="{omniatlas_frame_path(region, other)}">{1000 + other}</a>'
+                for other in range(max(frame - OMNIATLAS_TIMELINE, 0), min(frame + OMNIATLAS_TIMELINE, frames - 1) + 1)
+            )
+            previous = omniatlas_frame_path(region, frame - 1) if frame else '#'
+            following = omniatlas_frame_path(region, frame + 1) if frame + 1 < frames else None
+            next_button = f'<a class="btn" href="{following}">Next</a>' if following else '<span class="btn">Next</span>'
+            body = (
+                '<html><body><main><div><div><div class="sidebar"></div><div><div>'
+                '<section><div><div><h3><a>1 January</a></h3></div><div><h3><a>Era</a></h3></div>'
+                f'<div><h3><a>{region.replace("-", " ").title()}</a></h3></div></div></section>'
+                f'<section><div class="nav"><a class="btn" href="/maps/">Maps</a><a class="btn" href="{previous}">Prev</a>'
+                f'<a class="btn" href="#">Share</a>{next_button}</div>'
+                f'<h2><a>Frame {frame} of {region}</a></h2><div><div><div></div><div>'
+                f'<a href="/payload/{region}-{frame}.png?size=524288">Image</a></div></div>'
+                f'<p>What happened in frame {frame}, with <a>a link</a> in it.</p></div></section>'
+                f'<div class="timeline">{timeline}</div>'
+                '</div></div></div></div></main></body></html>'
+            )
+            pages[path] = page(body)
+    sitemap = ''.join(f'<url><loc>{base_url}{path}</loc></url>' for path in urls)
+    pages['/sitemap.xml'] = page(f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">{sitemap}</urlset>', XML)
+    return pages
+
+
+def omniatlas_urls(base_url:str) -> list:
+    return [base_url + omniatlas_frame_path(region, 0) for region in OMNIATLAS_REGIONS]
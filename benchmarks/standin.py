@@ -0,0 +1,254 @@
+import asyncio
+import os
+import random
+import threading
+from email.utils import formatdate
+from typing import Optional
+from aiohttp import web
+
+PAYLOAD_SIZE = 16 * 1024
+LATENCY = 0.05
+BLOCK_SIZE = 1024 * 1024
+WRITE_SIZE = 64 * 1024
+LAST_MODIFIED = formatdate(0, usegmt=True)
+SEED = 42
+
+
+class StandinServer:
+    """
+    Local HTTP server standing in for the sites the downloaders talk to.
+
+    GET /payload/<name> answers with pseudo random bytes. Query parameters
+    override the server defaults per request:
+        size     body length in bytes
+        latency  seconds before the response starts
+        rate     bandwidth cap of the response in bytes/s, 0 for none
+        error    probability of answering `error_status` instead
+        drop     probability of cutting the connection half way through
+    With a `capacity`, payloads beyond that many at once are answered 503
+    like an overloaded server would.
+    Payloads advertise byte ranges with a strong ETag and honour Range and
+    If-Range, so resumed and segmented downloads can be measured too.
+
+    Every other path is looked up in `pages`, a dict of path to (body,
+    content type), served after `page_latency` seconds. The server runs on
+    its own event loop in a background thread so that blocking clients and
+    Scrapy crawls can be benchmarked against it as well.
+    """
+
+    def __init__(
+        self,
+        host:str = '127.0.0.1',
+        port:int = 0,
+        size:int = PAYLOAD_SIZE,
+        latency:float = LATENCY,
+        rate:float = 0,
+        error:float = 0,
+        drop:float = 0,
+        error_status:int = 503,
+        capacity:int = 0,
+        pages:Optional[dict] = None,
+        page_latency:float = 0,
+        seed:int = SEED
+    ):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.latency = latency
+        self.rate = rate
+        self.error = error
+        self.drop = drop
+        self.error_status = error_status
+        self.capacity = capacity
+        self.active = 0
+        self.pages = pages or {}
+        self.page_latency = page_latency
+        self.random = random.Random(seed)
+        self.block = random.Random(seed).randbytes(BLOCK_SIZE)
+        self.requests = 0
+        self.errors = 0
+        self.drops = 0
+        self.loop = None
+        self.runner = None
+        self.thread = None
+
+
+    def __enter__(self):
+        self.start()
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+    @property
+    def base_url(self) -> str:
+        return f'http://{self.host}:{self.port}'
+
+
+    def url(self, path:str) -> str:
+        return self.base_url + '/' + path.lstrip('/')
+
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/payload/{name}', self.payload)
+        app.router.add_get('/{path:.*}', self.page)
+        return app
+
+
+    def body(self, offset:int, length:int) -> bytes:
+        """
+        Returns `length` bytes of the payload starting at `offset`. Every
+        payload is the same endless cycle of one random block, so any range
+        of it can be produced without holding the whole file.
+        """
+        start = offset % BLOCK_SIZE
+        if start + length <= BLOCK_SIZE:
+            return self.block[start:start + length]
+        chunks = [self.block[start:]]
+        remaining = length - len(chunks[0])
+        while remaining > 0:
+            chunks.append(self.block[:min(remaining, BLOCK_SIZE)])
+            remaining -= len(chunks[-1])
+        return b''.join(chunks)
+
+
+    async def payload(self, request:web.Request) -> web.StreamResponse:
+        self.requests += 1
+        query = request.query
+        size = int(query.get('size', self.size))
+        latency = float(query.get('latency', self.latency))
+        rate = float(query.get('rate', self.rate))
+        if latency:
+            await asyncio.sleep(latency)
+        if self.random.random() < float(query.get('error', self.error)):
+            self.errors += 1
+            return web.Response(status=self.error_status, headers={'Retry-After': '1'} if self.error_status == 503 else None)
+        if self.capacity and self.active >= self.capacity:
+            self.errors += 1
+            return web.Response(status=503, headers={'Retry-After': '1'})
+        self.active += 1
+        try:
+            return await self.send_payload(request, size, rate)
+        finally:
+            self.active -= 1
+
+
+    async def send_payload(self, request:web.Request, size:int, rate:float) -> web.StreamResponse:
+        query = request.query
+        etag = f'"{size:x}"'
+        headers = {'Accept-Ranges': 'bytes', 'ETag': etag, 'Last-Modified': LAST_MODIFIED}
+        start, end = 0, size - 1
+        status = 200
+        byte_range = parse_range(request.headers.get('Range'), size)
+        if byte_range and request.headers.get('If-Range', etag) == etag:
+            if byte_range == 'unsatisfiable':
+                return web.Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+            start, end = byte_range
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        length = end - start + 1
+        response = web.StreamResponse(status=status, headers=headers)
+        response.content_type = 'application/octet-stream'
+        response.content_length = length
+        await response.prepare(request)
+        if request.method == 'HEAD':
+            return response
+        drop_at = length // 2 if self.random.random() < float(query.get('drop', self.drop)) else None
+        offset = 0
+        try:
+            while offset < length:
+                chunk = self.body(start + offset, min(WRITE_SIZE, length - offset))
+                if drop_at is not None and offset + len(chunk) > drop_at:
+                    self.drops += 1
+                    await response.write(chunk[:drop_at - offset])
+                    request.transport.close()
+                    return response
+                await response.write(chunk)
+                offset += len(chunk)
+                if rate:
+                    await asyncio.sleep(len(chunk) / rate)
+            await response.write_eof()
+        except ConnectionError:
+            # The client went away, e.g. a segment it no longer needs
+            pass
+        return response
+
+
+    async def page(self, request:web.Request) -> web.Response:
+        self.requests += 1
+        path = request.path
+        page = self.pages.get(path) or self.pages.get(path.rstrip('/')) or self.pages.get(path + '/')
+        if self.page_latency:
+            await asyncio.sleep(self.page_latency)
+        if page is None:
+            return web.Response(status=404)
+        body, content_type = page
+        return web.Response(body=body, content_type=content_type, charset='utf-8')
+
+
+    def start(self):
+        ready = threading.Event()
+
+        def run():
+            self.loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self.loop)
+            self.runner = web.AppRunner(self.app(), access_log=None)
+            self.loop.run_until_complete(self.runner.setup())
+            site = web.TCPSite(self.runner, self.host, self.port)
+            self.loop.run_until_complete(site.start())
+            self.port = self.runner.addresses[0][1]
+            ready.set()
+            self.loop.run_forever()
+            self.loop.run_until_complete(self.runner.cleanup())
+            self.loop.close()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+
+def parse_range(value:Optional[str], size:int):
+    """
+    Parses a single `bytes=start-end` Range header into an inclusive
+    (start, end) pair. Returns None when there is no usable range and
+    'unsatisfiable' when it starts past the end of the payload.
+    """
+    if not value or not value.startswith('bytes=') or ',' in value:
+        return None
+    first, _, last = value[6:].partition('-')
+    try:
+        if not first:
+            start, end = max(size - int(last), 0), size - 1
+        else:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        return 'unsatisfiable'
+    return start, end
+
+
+def load_pages(root:str) -> dict:
+    """
+    Reads recorded pages saved under `root`, keyed by their url path. A file
+    named index.html stands for the directory url it sits in.
+    """
+    pages = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            url_path = '/' + os.path.relpath(path, root).replace(os.sep, '/')
+            if name == 'index.html':
+                url_path = url_path[:-len('index.html')]
+            content_type = 'text/xml' if name.endswith('.xml') else 'text/html'
+            with open(path, 'rb') as f:
+                pages[url_path] = (f.read(), content_type)
+    return pages
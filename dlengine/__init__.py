@@ -0,0 +1,7 @@
+from dlengine.concurrency import AIMDController
+from dlengine.engine import DownloadEngine, DownloadJob, run_jobs
+from dlengine.limits import RateLimiter
+from dlengine.manifest import Manifest
+from dlengine.metrics import Metrics, Reporter
+from dlengine.retry import CircuitBreaker, RetryPolicy
+from dlengine.store import ContentStore
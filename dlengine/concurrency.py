@@ -0,0 +1,264 @@
+import asyncio
+import time
+from collections import deque
+
+INITIAL = 2
+MINIMUM = 1
+MAXIMUM = 32
+INTERVAL = 3.0
+GAIN = 0.05
+LATENCY_FACTOR = 2.0
+DECREASE = 0.5
+PROBE_WINDOWS = 5
+CONGESTED = (429, 503)
+
+
+class HostState:
+    """
+    The adjustable connection limit of one host, with the measurements of
+    the current window that decide where it goes next.
+    """
+
+    def __init__(self, limit:int):
+        self.limit = limit
+        self.active = 0
+        self.waiters = deque()
+        self.saturated = False
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.latency_total = 0.0
+        self.latency_count = 0
+        self.base_latency = None
+        self.previous_rate = 0.0
+        self.previous_limit = limit
+        self.raised = False
+        self.slow_start = True
+        self.hold = 0
+        self.backed_off_at = None
+
+
+    async def acquire(self):
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        self.saturated = True
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+
+    def release(self):
+        self.active -= 1
+        self.wake()
+
+
+    def wake(self):
+        while self.waiters and self.active < self.limit:
+            future = self.waiters.popleft()
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+
+    def reset_window(self, now:float):
+        self.window_start = now
+        self.window_bytes = 0
+        self.latency_total = 0.0
+        self.latency_count = 0
+        self.saturated = self.active >= self.limit
+
+
+class AIMDController:
+    """
+    Adapts the number of requests in flight to each host between `minimum`
+    and `maximum`, starting from `initial`. Every `interval` seconds in
+    which a host had more work than connections, the limit is raised,
+    doubling at first and by one afterwards, as long as the throughput of
+    the last window beat the one before by `gain` and the time to the
+    response headers stayed within `latency_factor` of the best seen. A
+    raise that does not pay off is undone and the host is held there for
+    `probe_windows` windows before probing again. A 429 or 503 response or
+    a timeout cuts the limit by `decrease` at once, at most once a window.
+    """
+
+    def __init__(
+        self,
+        initial:int = INITIAL,
+        minimum:int = MINIMUM,
+        maximum:int = MAXIMUM,
+        interval:float = INTERVAL,
+        gain:float = GAIN,
+        latency_factor:float = LATENCY_FACTOR,
+        decrease:float = DECREASE,
+        probe_windows:int = PROBE_WINDOWS
+    ):
+        self.initial = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.interval = interval
+        self.gain = gain
+        self.latency_factor = latency_factor
+        self.decrease = decrease
+        self.probe_windows = probe_windows
+        self.hosts = {}
+
+
+    def state(self, host:str) -> HostState:
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(self.initial)
+        return state
+
+
+    def slot(self, host:str) -> 'Slot':
+        """
+        Returns an async context manager holding one of `host`'s
+        connections for the duration of a request.
+        """
+        return Slot(self, host)
+
+
+    def limits(self) -> dict:
+        return {host: state.limit for host, state in self.hosts.items()}
+
+
+    def set_limit(self, state:HostState, limit:int):
+        state.limit = max(self.minimum, min(limit, self.maximum))
+        state.wake()
+
+
+    def set_maximum(self, maximum:int):
+        self.maximum = max(maximum, 1)
+        self.minimum = min(self.minimum, self.maximum)
+        self.initial = min(self.initial, self.maximum)
+        for state in self.hosts.values():
+            self.set_limit(state, state.limit)
+
+
+    def responded(self, host:str, latency:float, status:int):
+        state = self.state(host)
+        if status in CONGESTED:
+            self.back_off(host, f'HTTP {status}')
+            return
+        state.latency_total += latency
+        state.latency_count += 1
+        if state.base_latency is None or latency < state.base_latency:
+            state.base_latency = latency
+
+
+    def transferred(self, host:str, size:int):
+        state = self.state(host)
+        state.window_bytes += size
+        now = time.monotonic()
+        if now - state.window_start >= self.interval:
+            self.adjust(host, state, now)
+
+
+    def back_off(self, host:str, reason:str):
+        state = self.state(host)
+        now = time.monotonic()
+        if state.backed_off_at is not None and now - state.backed_off_at < self.interval:
+            return
+        state.backed_off_at = now
+        limit = state.limit
+        self.set_limit(state, int(limit * self.decrease))
+        if state.limit != limit:
+            print(f"{reason} from {host}, lowering its concurrency from {limit} to {state.limit}")
+        state.slow_start = False
+        state.raised = False
+        state.hold = self.probe_windows
+        state.previous_rate = 0.0
+        state.reset_window(now)
+
+
+    def adjust(self, host:str, state:HostState, now:float):
+        rate = state.window_bytes / (now - state.window_start)
+        latency = state.latency_total / state.latency_count if state.latency_count else None
+        slow = latency is not None and state.base_latency is not None \
+            and latency > state.base_latency * self.latency_factor
+        improved = rate > state.previous_rate * (1 + self.gain)
+        limit = state.limit
+        if not state.saturated:
+            # Fewer requests than connections, so nothing to learn
+            pass
+        elif state.raised and (not improved or slow):
+            self.set_limit(state, state.previous_limit)
+            state.slow_start = False
+            state.raised = False
+            state.hold = self.probe_windows
+        else:
+            state.raised = False
+            if slow:
+                self.set_limit(state, limit - 1)
+            elif state.hold:
+                state.hold -= 1
+            elif limit < self.maximum:
+                state.previous_limit = limit
+                self.set_limit(state, limit * 2 if state.slow_start else limit + 1)
+                state.raised = True
+        if state.limit != limit:
+            print(f"Concurrency for {host}: {limit} -> {state.limit} ({rate / 1e6:.2f} MB/s)")
+        state.previous_rate = rate
+        state.reset_window(now)
+
+
+class Slot:
+    """
+    One request's hold on a host connection, reporting back to the
+    controller how it went.
+    """
+
+    def __init__(self, controller:AIMDController, host:str):
+        self.controller = controller
+        self.host = host
+        self.state = controller.state(host)
+        self.started = None
+
+
+    async def __aenter__(self):
+        await self.state.acquire()
+        self.started = time.monotonic()
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        self.state.release()
+        if exc_type is not None and issubclass(exc_type, asyncio.TimeoutError):
+            self.controller.back_off(self.host, 'Timeout')
+
+
+    def responded(self, status:int):
+        self.controller.responded(self.host, time.monotonic() - self.started, status)
+
+
+    def transferred(self, size:int):
+        self.controller.transferred(self.host, size)
+
+
+class NoSlot:
+    """
+    Stands in for a Slot when concurrency is not adapted.
+    """
+
+    async def __aenter__(self):
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        pass
+
+
+    def responded(self, status:int):
+        pass
+
+
+    def transferred(self, size:int):
+        pass
+
+
+NO_SLOT = NoSlot()
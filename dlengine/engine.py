@@ -0,0 +1,855 @@
+import asyncio
+import hashlib
+import json
+import os
+import zlib
+from dataclasses import dataclass
+from typing import Callable, Iterable, Optional
+from urllib.parse import urlsplit
+import aiohttp
+from dlengine.concurrency import NO_SLOT, AIMDController
+from dlengine.metrics import Metrics
+from dlengine.retry import CHANGED, CHECKSUM, SHORT_READ, UNAVAILABLE, CircuitBreaker, RetryPolicy, TransferError, classify, status_error
+from dlengine.writer import SYNC_BYTES, BufferPool, ChunkWriter, preallocate
+
+CONCURRENCY = 64
+PER_HOST = 8
+QUEUE_SIZE = 1024
+TIMEOUT = 30
+RETRY = 3
+SEGMENTS = 1
+SEGMENT_THRESHOLD = 64 * 1024 * 1024
+SEGMENT_SAVE_INTERVAL = 16 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+DEAD_LETTER_PASSES = 1
+
+
+class RemoteChanged(TransferError):
+
+    def __init__(self):
+        super().__init__(CHANGED, 'remote file changed')
+
+
+@dataclass(eq=False)
+class DownloadJob:
+    url: str
+    path: str
+    # Expected hex digests keyed by algorithm, e.g. {'md5': ..., 'crc32': ...}
+    checksums: Optional[dict] = None
+    # Filled in by the engine once the job has run
+    size: Optional[int] = None
+    sha1: Optional[str] = None
+    digests: Optional[dict] = None
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    error: Optional[str] = None
+    # One of the kinds in dlengine.retry, for the last failed attempt
+    error_kind: Optional[str] = None
+    # Progress while running: whether its body started coming in and the
+    # bytes on disk out of the expected length
+    started: bool = False
+    received: int = 0
+    length: Optional[int] = None
+
+
+class DownloadEngine:
+    """
+    Downloads jobs from a bounded queue using a fixed set of asyncio workers
+    that share one pooled keep-alive session. `concurrency` caps the total
+    number of open connections and `per_host` caps the connections to a
+    single host. When a `manifest` is given, jobs it records as done at
+    the same path are skipped and every outcome is written back to it.
+    When a ContentStore is given as `store`, content is saved once per
+    digest and linked into each job's path. Jobs carrying `checksums` are verified against the digests
+    computed while streaming and fetched again on a mismatch. With
+    `segments` above 1, files of at least
+    `segment_threshold` bytes are split into that many byte ranges which are
+    fetched in parallel into a preallocated file. Bodies are written through
+    large reused buffers, files of known length are preallocated, and data
+    is synced to disk every `sync_bytes` (0 to leave it to the OS). A
+    RateLimiter given as `limiter` paces requests and received bytes, per
+    host and overall. An AIMDController given as `controller` adapts the
+    number of requests in flight to each host to its throughput and
+    errors, with `per_host` as the ceiling. Failed attempts are retried up
+    to `retry` times as `policy` decides, after an exponential backoff with
+    jitter or the server's Retry-After, and `breaker` pauses hosts that keep
+    failing. Jobs that still fail with a retryable error are put aside and
+    retried in up to `dead_letter_passes` passes once the queue has drained.
+    Progress is counted in `metrics` and published by `reporter` while the
+    engine runs. `on_start` is called once a job's body starts coming in,
+    which may be well after a worker took it when it has to wait for its
+    host, and `on_done` once it finished. pause(), resume() and
+    set_concurrency() control a running engine and status() describes it,
+    for the status and control endpoints of a Reporter.
+    """
+
+    def __init__(
+        self,
+        concurrency:int = CONCURRENCY,
+        per_host:int = PER_HOST,
+        queue_size:int = QUEUE_SIZE,
+        retry:int = RETRY,
+        timeout:float = TIMEOUT,
+        headers:Optional[dict] = None,
+        skip_existing:bool = True,
+        segments:int = SEGMENTS,
+        segment_threshold:int = SEGMENT_THRESHOLD,
+        sync_bytes:int = SYNC_BYTES,
+        manifest = None,
+        store = None,
+        limiter = None,
+        controller = None,
+        policy:Optional[RetryPolicy] = None,
+        breaker:Optional[CircuitBreaker] = None,
+        dead_letter_passes:int = DEAD_LETTER_PASSES,
+        metrics:Optional[Metrics] = None,
+        reporter = None,
+        on_start:Optional[Callable[[DownloadJob], None]] = None,
+        on_done:Optional[Callable[[DownloadJob, bool], None]] = None
+    ):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.queue_size = queue_size
+        self.retry = retry
+        self.timeout = timeout
+        self.headers = headers
+        self.skip_existing = skip_existing
+        self.segments = segments
+        self.segment_threshold = segment_threshold
+        self.sync_bytes = sync_bytes
+        self.manifest = manifest
+        self.store = store
+        self.limiter = limiter
+        self.controller = controller
+        self.policy = policy or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self.dead_letter_passes = dead_letter_passes
+        self.dead_letters = []
+        self.fixed = controller is None
+        self.limit = concurrency
+        self.paused = False
+        self.changed = None
+        self.metrics = metrics or Metrics()
+        self.reporter = reporter
+        self.on_start = on_start
+        self.on_done = on_done
+        self.buffers = BufferPool()
+        self.session = None
+        self.queue = None
+        self.workers = []
+        self.running = {}
+        self.cancelled = set()
+
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.concurrency,
+            limit_per_host=self.per_host
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(
+                total=None,
+                sock_connect=self.timeout,
+                sock_read=self.timeout
+            )
+        )
+        self.queue = asyncio.Queue(self.queue_size)
+        self.changed = asyncio.Condition()
+        self.workers = [asyncio.create_task(self._worker(index)) for index in range(self.concurrency)]
+        if self.reporter:
+            await self.reporter.start(self.metrics, self)
+
+
+    async def submit(self, job:DownloadJob):
+        self.metrics.queued()
+        await self.queue.put(job)
+
+
+    async def join(self):
+        await self.queue.join()
+
+
+    async def close(self):
+        await self.join()
+        await self.retry_dead_letters()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+        await self.session.close()
+        if self.reporter:
+            await self.reporter.stop()
+
+
+    async def retry_dead_letters(self):
+        """
+        Runs the jobs put aside after exhausting their retries again, once
+        everything else is done and hosts have had time to recover.
+        """
+        while self.dead_letters and self.dead_letter_passes > 0:
+            self.dead_letter_passes -= 1
+            jobs, self.dead_letters = self.dead_letters, []
+            print(f"Retrying {len(jobs)} failed downloads")
+            self.metrics.taken_back(len(jobs))
+            await asyncio.gather(*(self.breaker.ready(host) for host in {urlsplit(job.url).hostname for job in jobs}))
+            for job in jobs:
+                await self.queue.put(job)
+            await self.join()
+
+
+    async def pause(self):
+        """
+        Stops starting jobs and reading from running transfers until
+        resume() is called. Connections are kept open, so the servers are
+        slowed down by TCP flow control and may eventually drop them, which
+        the transfers recover from like any other dropped connection.
+        """
+        async with self.changed:
+            self.paused = True
+
+
+    async def resume(self):
+        async with self.changed:
+            self.paused = False
+            self.changed.notify_all()
+
+
+    async def wait_resumed(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.paused)
+
+
+    async def set_concurrency(self, total:Optional[int] = None, per_host:Optional[int] = None):
+        """
+        Changes how many jobs run at once, up to `concurrency`, and how many
+        requests go to one host at once, up to `per_host`. Jobs above a
+        lowered limit are let finish. With an AIMDController the per host
+        number becomes its new maximum.
+        """
+        if total is not None:
+            async with self.changed:
+                self.limit = max(1, min(total, self.concurrency))
+                self.changed.notify_all()
+        if per_host is not None:
+            per_host = max(1, min(per_host, self.per_host))
+            if self.fixed:
+                # A controller that cannot move holds every host to the number
+                self.controller = AIMDController(initial=per_host, minimum=per_host, maximum=per_host)
+            else:
+                self.controller.set_maximum(per_host)
+
+
+    def status(self) -> dict:
+        return {
+            'queue_depth': self.queue.qsize() if self.queue else 0,
+            # Taken by a worker but held up by the host's slots, the
+            # breaker or the rate limiter
+            'waiting': sum(1 for job in self.running if not job.started),
+            'dead_letters': len(self.dead_letters),
+            'paused': self.paused,
+            'concurrency': self.limit,
+            'per_host': self.controller.limits() if self.controller else {},
+            'transfers': [
+                {'url': job.url, 'path': str(job.path), 'bytes': job.received, 'length': job.length}
+                for job in self.running if job.started
+            ]
+        }
+
+
+    def begin(self, job:DownloadJob):
+        if not job.started:
+            job.started = True
+            if self.on_start:
+                self.on_start(job)
+
+
+    def slot(self, host:str):
+        return self.controller.slot(host) if self.controller else NO_SLOT
+
+
+    def cancel(self, job:DownloadJob):
+        """
+        Stops `job` if it is running or skips it once it is dequeued. The
+        partial file is kept so the job can be resumed later.
+        """
+        if job in self.running:
+            self.running[job].cancel()
+        else:
+            self.cancelled.add(job)
+
+
+    async def _worker(self, index:int):
+        while True:
+            async with self.changed:
+                await self.changed.wait_for(lambda: index < self.limit and not self.paused)
+            job = await self.queue.get()
+            if job in self.cancelled:
+                self.cancelled.discard(job)
+                self.metrics.cancelled()
+                self.queue.task_done()
+                if self.on_done:
+                    self.on_done(job, False)
+                continue
+            task = asyncio.create_task(self.download(job, defer=True))
+            self.running[job] = task
+            try:
+                ok = await task
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling():
+                    raise
+                print("Cancelled: " + job.url)
+                ok = False
+            except Exception as e:
+                print(e)
+                ok = False
+            finally:
+                del self.running[job]
+                self.queue.task_done()
+            if ok is None:
+                # Put aside for a dead letter pass, reported once that ran
+                continue
+            if self.on_done:
+                self.on_done(job, ok)
+
+
+    async def download(self, job:DownloadJob, defer:bool = False) -> Optional[bool]:
+        """
+        Runs `job` and records the outcome. With `defer`, a job that failed
+        in a way worth retrying is put aside for a dead letter pass instead
+        and None is returned.
+        """
+        path = str(job.path)
+        # With a store, a link that went missing is restored from it rather
+        # than trusted to the manifest
+        if self.manifest and (completed := self.manifest.completed(job.url, path)) \
+                and (not self.store or os.path.exists(path)):
+            job.size, job.sha1 = completed
+            self.metrics.skip()
+            return True
+        self.metrics.started()
+        try:
+            ok = await self.transfer(job)
+        except BaseException:
+            self.metrics.finished(None)
+            raise
+        if ok:
+            # Left over from attempts before the one that worked
+            job.error = None
+            job.error_kind = None
+        if not ok and defer and self.dead_letter_passes > 0 and self.policy.should_retry(job.error_kind):
+            self.dead_letters.append(job)
+            self.metrics.put_aside()
+            return None
+        self.metrics.finished(ok)
+        if self.manifest:
+            self.manifest.record(job, ok)
+        return ok
+
+
+    async def transfer(self, job:DownloadJob) -> bool:
+        path = str(job.path)
+        if self.skip_existing and os.path.exists(path):
+            print(path + " already exists! Skipping!")
+            job.size = os.path.getsize(path)
+            return True
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        if self.store and (sha1 := self.store.lookup(job.url)):
+            self.store.link(sha1, path)
+            job.sha1 = sha1
+            job.size = os.path.getsize(path)
+            print("Linked from store: " + path)
+            return True
+        print("Downloading: " + job.url + " to " + path)
+        temp_path = path + '.part'
+        host = urlsplit(job.url).hostname
+        retry_after = None
+        for attempt in range(self.retry):
+            if attempt:
+                delay = self.policy.delay(attempt, job.error_kind, retry_after)
+                if delay:
+                    print(f"Retrying {job.url} in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+            if not await self.breaker.wait(host):
+                job.error_kind = UNAVAILABLE
+                job.error = f'{UNAVAILABLE}: {host} is paused after repeated failures'
+                print(f"{job.url}: {job.error}")
+                break
+            if attempt:
+                self.metrics.retried()
+            self.metrics.attempted()
+            try:
+                job.digests = None
+                ok = await self.fetch_segmented(job, temp_path)
+                if ok is None:
+                    ok = await self.fetch(job, temp_path)
+                if ok:
+                    if job.digests is None:
+                        job.digests = (await asyncio.to_thread(hash_file, temp_path, Digests(job.checksums))).hexdigests()
+                    job.sha1 = job.digests['sha1']
+                    if mismatch := checksum_mismatch(job):
+                        os.remove(temp_path)
+                        remove_validators(temp_path)
+                        raise TransferError(CHECKSUM, f'{mismatch} mismatch')
+                    job.size = os.path.getsize(temp_path)
+                    remove_validators(temp_path)
+                    if self.store:
+                        self.store.add(temp_path, job.sha1, job.url)
+                        self.store.link(job.sha1, path)
+                    else:
+                        os.replace(temp_path, path)
+                    print("Downloaded: " + path)
+                    return True
+            except (TransferError, aiohttp.ClientError, asyncio.TimeoutError, OSError) as e:
+                job.error_kind = classify(e)
+                job.error = f'{job.error_kind}: {str(e) or type(e).__name__}'
+                self.metrics.errored()
+                retry_after = getattr(e, 'retry_after', None)
+                print(f"{job.url}: {job.error}")
+                self.breaker.failed(host, job.error_kind, retry_after)
+                if job.error_kind == CHANGED and os.path.exists(temp_path):
+                    os.remove(temp_path)
+                    remove_validators(temp_path)
+                if not self.policy.should_retry(job.error_kind):
+                    break
+        print("Could not download: " + job.url)
+        return False
+
+
+    async def fetch(self, job:DownloadJob, temp_path:str) -> bool:
+        """
+        Streams the job's url into `temp_path`, hashing it on the way. If a
+        partial file from an earlier attempt exists along with the
+        validators of the response it came from, only the missing tail is
+        requested; If-Range makes the server send the full body instead when
+        the remote file has changed. A resumable body of known length is
+        preallocated and its progress recorded like a single segment, so a
+        later attempt continues it through fetch_segmented.
+        """
+        url = job.url
+        headers = {}
+        offset = 0
+        validators = load_validators(temp_path)
+        if validators and os.path.exists(temp_path):
+            offset = os.path.getsize(temp_path)
+            headers['Range'] = f'bytes={offset}-'
+            headers['If-Range'] = validators['validator']
+        host = urlsplit(url).hostname
+        if self.limiter:
+            await self.limiter.request(host)
+        async with self.slot(host) as slot, self.session.get(url, headers=headers, allow_redirects=True) as response:
+            slot.responded(response.status)
+            if response.status < 400:
+                self.breaker.succeeded(host)
+            job.etag = response.headers.get('ETag')
+            job.last_modified = response.headers.get('Last-Modified')
+            if response.status == 416 and offset:
+                if offset == validators.get('length'):
+                    return True
+                raise RemoteChanged()
+            length = None
+            state = None
+            if response.status == 206 and offset and content_range_start(response) == offset \
+                    and response_validator(response) == validators['validator']:
+                print(f"Resuming {url} from byte {offset}")
+                job.length = offset + response.content_length if response.content_length is not None else None
+                flags = os.O_WRONLY
+                digests = await asyncio.to_thread(hash_file, temp_path, Digests(job.checksums))
+            elif response.status == 206 and offset:
+                raise RemoteChanged()
+            elif response.status == 200:
+                if offset:
+                    print(f"Remote file changed or range not honoured, restarting {url}")
+                offset = 0
+                length = job.length = body_length(response)
+                state = save_validators(temp_path, response)
+                if state and length:
+                    state['segments'] = [[0, length - 1, 0]]
+                    save_state(temp_path, state)
+                flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+                digests = Digests(job.checksums)
+            else:
+                raise status_error(response)
+            self.begin(job)
+            fd = os.open(temp_path, flags, 0o666)
+            progress = {'unsaved': 0}
+            job.received = offset
+
+            def flushed(position:int, block:memoryview):
+                digests.update(block)
+                job.received += len(block)
+                self.metrics.transferred(len(block))
+                if state:
+                    state['segments'][0][2] += len(block)
+                    progress['unsaved'] += len(block)
+                    if progress['unsaved'] >= SEGMENT_SAVE_INTERVAL:
+                        save_state(temp_path, state)
+                        progress['unsaved'] = 0
+
+            writer = ChunkWriter(fd, self.buffers, offset, length, flushed, self.sync_bytes)
+            try:
+                if length:
+                    preallocate(fd, length)
+                async for chunk in response.content.iter_any():
+                    if self.paused:
+                        await self.wait_resumed()
+                    if self.limiter:
+                        await self.limiter.transfer(host, len(chunk))
+                    slot.transferred(len(chunk))
+                    await writer.write(chunk)
+            finally:
+                try:
+                    await writer.close()
+                    if length and writer.written < length:
+                        os.ftruncate(fd, writer.written)
+                finally:
+                    os.close(fd)
+                    if state:
+                        save_state(temp_path, state)
+        if length and writer.written < length:
+            raise TransferError(SHORT_READ, f'{writer.written} of {length} bytes')
+        job.digests = digests.hexdigests()
+        return True
+
+
+    async def fetch_segmented(self, job:DownloadJob, temp_path:str) -> Optional[bool]:
+        """
+        Downloads `url` as parallel byte ranges written in place into a
+        preallocated `temp_path`. Progress of every segment is kept next to
+        the partial file so that failed segments, or a later run, continue
+        where they stopped. Returns None when the file should be fetched as a
+        single stream instead. The file is hashed in order as it fills: bytes
+        landing at the hashed position are hashed as they arrive and those
+        written ahead of it are read back once, while still in the page
+        cache.
+        """
+        url = job.url
+        state = load_validators(temp_path)
+        if not (state and 'segments' in state and os.path.exists(temp_path)):
+            if self.segments <= 1:
+                return None
+            host = urlsplit(url).hostname
+            if self.limiter:
+                await self.limiter.request(host)
+            async with self.slot(host) as slot, self.session.head(url, allow_redirects=True) as response:
+                slot.responded(response.status)
+                if response.status < 400:
+                    self.breaker.succeeded(host)
+                job.etag = response.headers.get('ETag')
+                job.last_modified = response.headers.get('Last-Modified')
+                validator = response_validator(response)
+                length = response.content_length
+                if response.status != 200 or not validator or not length \
+                        or length < self.segment_threshold \
+                        or response.headers.get('Accept-Ranges', '').lower() != 'bytes':
+                    return None
+            state = {
+                'validator': validator,
+                'length': length,
+                'segments': split_ranges(length, self.segments)
+            }
+            fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+            try:
+                preallocate(fd, length)
+            finally:
+                os.close(fd)
+            save_state(temp_path, state)
+        print(f"Downloading {url} in {len(state['segments'])} segments")
+        job.length = state['length']
+        job.received = sum(segment[2] for segment in state['segments'])
+        fd = os.open(temp_path, os.O_RDWR)
+        frontier = Frontier(fd, state['segments'], Digests(job.checksums))
+        try:
+            results = await asyncio.gather(
+                *(self.fetch_segment(job, temp_path, fd, state, segment, frontier) for segment in state['segments']),
+                return_exceptions=True
+            )
+            if all(result is True for result in results):
+                await frontier.catch_up()
+                job.digests = frontier.digests.hexdigests()
+        finally:
+            os.close(fd)
+            save_state(temp_path, state)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+        return all(results)
+
+
+    async def fetch_segment(self, job:DownloadJob, temp_path:str, fd:int, state:dict, segment:list, frontier) -> bool:
+        url = job.url
+        start, end = segment[0], segment[1]
+        host = urlsplit(url).hostname
+        if start + segment[2] > end:
+            return True
+        kind = None
+        retry_after = None
+        for attempt in range(self.retry):
+            if attempt:
+                await asyncio.sleep(self.policy.delay(attempt, kind, retry_after))
+                if not await self.breaker.wait(host):
+                    raise TransferError(UNAVAILABLE, f'{host} is paused after repeated failures')
+                self.metrics.retried()
+            offset = start + segment[2]
+            headers = {'Range': f'bytes={offset}-{end}', 'If-Range': state['validator']}
+            try:
+                if self.limiter:
+                    await self.limiter.request(host)
+                async with self.slot(host) as slot, self.session.get(url, headers=headers, allow_redirects=True) as response:
+                    slot.responded(response.status)
+                    if response.status >= 400:
+                        raise status_error(response)
+                    self.breaker.succeeded(host)
+                    if response.status != 206 or content_range_start(response) != offset \
+                            or response_validator(response) != state['validator']:
+                        raise RemoteChanged()
+                    self.begin(job)
+                    progress = {'unsaved': 0}
+
+                    def flushed(position:int, block:memoryview):
+                        segment[2] += len(block)
+                        job.received += len(block)
+                        self.metrics.transferred(len(block))
+                        frontier.feed(position, block)
+                        progress['unsaved'] += len(block)
+
+                    writer = ChunkWriter(fd, self.buffers, offset, end + 1 - offset, flushed, self.sync_bytes)
+                    try:
+                        async for chunk in response.content.iter_any():
+                            if self.paused:
+                                await self.wait_resumed()
+                            if self.limiter:
+                                await self.limiter.transfer(host, len(chunk))
+                            slot.transferred(len(chunk))
+                            await writer.write(chunk[:end + 1 - offset - writer.written - writer.filled])
+                            if frontier.behind():
+                                await frontier.catch_up()
+                            if progress['unsaved'] >= SEGMENT_SAVE_INTERVAL:
+                                save_state(temp_path, state)
+                                progress['unsaved'] = 0
+                    finally:
+                        await writer.close()
+                if start + segment[2] <= end:
+                    raise TransferError(SHORT_READ, f'segment {start}-{end} stopped at byte {start + segment[2]}')
+                return True
+            except (TransferError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                kind = classify(e)
+                retry_after = getattr(e, 'retry_after', None)
+                print(f"Segment {start}-{end} of {url}: {e!r}")
+                if kind == CHANGED or not self.policy.should_retry(kind) or attempt == self.retry - 1:
+                    raise
+                self.breaker.failed(host, kind, retry_after)
+        return False
+
+
+class CRC32:
+    """
+    zlib.crc32 behind the update/hexdigest interface of hashlib.
+    """
+
+    def __init__(self):
+        self.value = 0
+
+
+    def update(self, data:bytes):
+        self.value = zlib.crc32(data, self.value)
+
+
+    def hexdigest(self) -> str:
+        return f'{self.value:08x}'
+
+
+HASHERS = {'md5': hashlib.md5, 'sha1': hashlib.sha1, 'crc32': CRC32}
+
+
+class Digests:
+    """
+    Computes SHA-1, plus every other algorithm named in `checksums` that is
+    in HASHERS, in a single pass over the data.
+    """
+
+    def __init__(self, checksums:Optional[dict] = None):
+        names = {'sha1'} | {name for name in checksums or () if name in HASHERS}
+        self.hashers = {name: HASHERS[name]() for name in names}
+
+
+    def update(self, data:bytes):
+        for hasher in self.hashers.values():
+            hasher.update(data)
+
+
+    def hexdigests(self) -> dict:
+        return {name: hasher.hexdigest() for name, hasher in self.hashers.items()}
+
+
+class Frontier:
+    """
+    Hashes a segmented download in file order while its segments are written
+    out of order. `position` is how far the file has been hashed.
+    """
+
+    def __init__(self, fd:int, segments:list, digests:Digests):
+        self.fd = fd
+        self.segments = segments
+        self.digests = digests
+        self.position = 0
+        self.reading = False
+
+
+    def available(self) -> int:
+        """
+        End of the data written contiguously from `position`.
+        """
+        for start, end, written in self.segments:
+            if start <= self.position <= end:
+                return start + written
+        return self.position
+
+
+    def behind(self) -> bool:
+        return not self.reading and self.available() > self.position
+
+
+    def feed(self, offset:int, chunk:bytes):
+        if offset == self.position and not self.reading:
+            self.digests.update(chunk)
+            self.position += len(chunk)
+
+
+    async def catch_up(self):
+        if self.reading:
+            return
+        self.reading = True
+        try:
+            while (available := self.available()) > self.position:
+                chunk = await asyncio.to_thread(os.pread, self.fd, min(available - self.position, READ_SIZE), self.position)
+                if not chunk:
+                    break
+                self.digests.update(chunk)
+                self.position += len(chunk)
+        finally:
+            self.reading = False
+
+
+def checksum_mismatch(job:DownloadJob) -> Optional[str]:
+    """
+    Returns the name of the first expected checksum the download does not
+    match, or None when every one that could be computed matches.
+    """
+    for name, expected in (job.checksums or {}).items():
+        actual = job.digests.get(name)
+        if actual and expected and actual != expected.lower():
+            return name
+    return None
+
+
+def hash_file(path:str, hasher=None):
+    """
+    Feeds the file at `path` into `hasher`, a new SHA-1 by default, and
+    returns it.
+    """
+    hasher = hasher or hashlib.sha1()
+    with open(path, 'rb') as f:
+        while chunk := f.read(READ_SIZE):
+            hasher.update(chunk)
+    return hasher
+
+
+def split_ranges(length:int, count:int) -> list:
+    """
+    Splits `length` bytes into `count` inclusive [start, end, written]
+    ranges.
+    """
+    size = -(-length // count)
+    return [[start, min(start + size, length) - 1, 0] for start in range(0, length, size)]
+
+
+def content_range_start(response) -> Optional[int]:
+    content_range = response.headers.get('Content-Range', '')
+    if content_range.startswith('bytes ') and '-' in content_range:
+        try:
+            return int(content_range[6:].split('-', 1)[0])
+        except ValueError:
+            return None
+    return None
+
+
+def body_length(response) -> Optional[int]:
+    """
+    Length of the body as it will be written, which is only known when it
+    is not transfer encoded.
+    """
+    if response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        return None
+    return response.content_length
+
+
+def response_validator(response) -> Optional[str]:
+    etag = response.headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return response.headers.get('Last-Modified')
+
+
+def validators_path(temp_path:str) -> str:
+    return temp_path + '.json'
+
+
+def save_validators(temp_path:str, response):
+    """
+    Records what is needed to safely resume `temp_path` later. Nothing is
+    saved when the server does not advertise byte ranges, gives no strong
+    validator or content encodes the body, whose ranges count encoded
+    bytes rather than the decoded ones on disk, so such downloads always
+    restart from scratch. Returns the saved state, or None.
+    """
+    validator = response_validator(response)
+    if response.headers.get('Accept-Ranges', '').lower() != 'bytes' or not validator \
+            or response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+        remove_validators(temp_path)
+        return None
+    state = {'validator': validator, 'length': response.content_length}
+    save_state(temp_path, state)
+    return state
+
+
+def save_state(temp_path:str, state:dict):
+    with open(validators_path(temp_path), 'w') as f:
+        json.dump(state, f)
+
+
+def load_validators(temp_path:str) -> Optional[dict]:
+    try:
+        with open(validators_path(temp_path), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def remove_validators(temp_path:str):
+    try:
+        os.remove(validators_path(temp_path))
+    except FileNotFoundError:
+        pass
+
+def run_jobs(jobs:Iterable[DownloadJob], **kwargs):
+    """
+    Runs every job in `jobs` through a DownloadEngine and blocks until they
+    are all finished. `jobs` may be a generator; it is consumed lazily as
+    the queue drains. Keyword arguments are passed to DownloadEngine.
+    """
+    async def run():
+        async with DownloadEngine(**kwargs) as engine:
+            for job in jobs:
+                await engine.submit(job)
+    asyncio.run(run())
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import time
+from typing import Optional
+
+BURST_SECONDS = 1.0
+RELOAD_INTERVAL = 5.0
+UNITS = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+RATES = ('bytes_per_second', 'requests_per_second', 'host_bytes_per_second', 'host_requests_per_second')
+
+
+class TokenBucket:
+    """
+    Hands out `rate` tokens per second, letting up to `burst_seconds` worth
+    build up while idle. A rate of 0 means no limit. Callers asking for more
+    than is available take the tokens anyway and sleep off the debt, so any
+    size of chunk gets through and concurrent callers are spaced out in the
+    order they came.
+    """
+
+    def __init__(self, rate:float = 0, burst_seconds:float = BURST_SECONDS):
+        self.rate = rate
+        self.burst_seconds = burst_seconds
+        self.tokens = rate * burst_seconds
+        self.updated = time.monotonic()
+
+
+    def refill(self):
+        now = time.monotonic()
+        if self.rate:
+            self.tokens = min(self.tokens + (now - self.updated) * self.rate, self.rate * self.burst_seconds)
+        self.updated = now
+
+
+    def set_rate(self, rate:float):
+        self.refill()
+        self.rate = rate
+        self.tokens = min(self.tokens, rate * self.burst_seconds) if rate else 0
+
+
+    def take(self, count:float) -> float:
+        """
+        Takes `count` tokens and returns the seconds to wait before using
+        them.
+        """
+        if not self.rate:
+            return 0.0
+        self.refill()
+        self.tokens -= count
+        return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+
+class RateLimiter:
+    """
+    Token buckets for bytes/s and requests/s, one pair for everything and
+    one pair per host, shared by all the workers of an engine. `limits` is a
+    dict like
+
+        {
+            "bytes_per_second": "40M",
+            "requests_per_second": 20,
+            "host_bytes_per_second": "10M",
+            "host_requests_per_second": 4,
+            "hosts": {"archive.org": {"bytes_per_second": "8M", "requests_per_second": 2}}
+        }
+
+    where every key is optional and 0 means no limit. Entries under "hosts"
+    apply to that host and its subdomains, so archive.org covers the
+    iaNNNNNN.us.archive.org servers downloads are redirected to, and replace
+    the host_* defaults for them. Rates may be given as numbers or with a
+    K, M or G suffix. When `path` is given the limits are read from that
+    JSON file and re-read whenever it changes, so they can be adjusted
+    while downloading; update() does the same from code.
+    """
+
+    def __init__(self, limits:Optional[dict] = None, path:Optional[str] = None):
+        self.bytes = TokenBucket()
+        self.requests = TokenBucket()
+        self.hosts = {}
+        self.keys = {}
+        self.limits = {}
+        self.file = LimitsFile(path) if path else None
+        if self.file:
+            self.file.changed()
+            limits = self.file.limits
+        self.update(limits or {})
+
+
+    def update(self, limits:dict):
+        self.limits = normalise_limits(limits)
+        self.keys = {}
+        self.bytes.set_rate(self.limits['bytes_per_second'])
+        self.requests.set_rate(self.limits['requests_per_second'])
+        for key, (bytes_bucket, requests_bucket) in self.hosts.items():
+            bytes_rate, requests_rate = self.host_rates(key)
+            bytes_bucket.set_rate(bytes_rate)
+            requests_bucket.set_rate(requests_rate)
+
+
+    def host_key(self, host:str) -> str:
+        """
+        The entry of "hosts" covering `host`, the longest one if several
+        do, or the host itself.
+        """
+        key = self.keys.get(host)
+        if key is None:
+            matches = [name for name in self.limits['hosts'] if host == name or host.endswith('.' + name)]
+            key = self.keys[host] = max(matches, key=len) if matches else host
+        return key
+
+
+    def host_rates(self, key:str) -> tuple:
+        rates = self.limits['hosts'].get(key, {})
+        return (
+            rates.get('bytes_per_second', self.limits['host_bytes_per_second']),
+            rates.get('requests_per_second', self.limits['host_requests_per_second'])
+        )
+
+
+    def buckets(self, host:str) -> tuple:
+        key = self.host_key(host or '')
+        if key not in self.hosts:
+            bytes_rate, requests_rate = self.host_rates(key)
+            self.hosts[key] = (TokenBucket(bytes_rate), TokenBucket(requests_rate))
+        return self.hosts[key]
+
+
+    async def request(self, host:str):
+        """
+        Waits until a request to `host` is allowed.
+        """
+        if self.file and self.file.changed():
+            print(f"Reloaded rate limits from {self.file.path}")
+            self.update(self.file.limits)
+        wait = max(self.requests.take(1), self.buckets(host)[1].take(1))
+        if wait:
+            await asyncio.sleep(wait)
+
+
+    async def transfer(self, host:str, size:int):
+        """
+        Accounts for `size` bytes received from `host`, waiting as long as
+        needed to keep to the byte rates. Reading no further in the meantime
+        lets TCP slow the sender down.
+        """
+        wait = max(self.bytes.take(size), self.buckets(host)[0].take(size))
+        if wait:
+            await asyncio.sleep(wait)
+
+
+class LimitsFile:
+    """
+    A JSON file of limits that is re-read when its modification time
+    changes, checked at most every `interval` seconds.
+    """
+
+    def __init__(self, path:str, interval:float = RELOAD_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.limits = {}
+        self.mtime = None
+        self.checked = None
+
+
+    def changed(self) -> bool:
+        now = time.monotonic()
+        if self.checked is not None and now - self.checked < self.interval:
+            return False
+        self.checked = now
+        try:
+            mtime = os.stat(self.path).st_mtime
+            if mtime == self.mtime:
+                return False
+            with open(self.path, 'r') as f:
+                limits = json.load(f)
+            self.mtime = mtime
+        except (OSError, ValueError) as e:
+            if self.mtime is None:
+                raise
+            print(f"Keeping the current rate limits, could not read {self.path}: {e!r}")
+            return False
+        self.limits = limits
+        return True
+
+
+def parse_rate(value) -> float:
+    if isinstance(value, str):
+        value = value.strip().lower().removesuffix('/s').removesuffix('b')
+        if value and value[-1] in UNITS:
+            return float(value[:-1]) * UNITS[value[-1]]
+    return float(value or 0)
+
+
+def normalise_limits(limits:dict) -> dict:
+    normalised = {name: parse_rate(limits.get(name)) for name in RATES}
+    normalised['hosts'] = {
+        host.lower(): {name: parse_rate(value) for name, value in rates.items() if name in RATES}
+        for host, rates in (limits.get('hosts') or {}).items()
+    }
+    return normalised
+
+
+def divide_limits(limits:dict, count:int) -> dict:
+    """
+    Splits cluster wide `limits` evenly between `count` nodes.
+    """
+    limits = normalise_limits(limits)
+    share = {name: limits[name] / count for name in RATES}
+    share['hosts'] = {
+        host: {name: value / count for name, value in rates.items()}
+        for host, rates in limits['hosts'].items()
+    }
+    return share
@@ -0,0 +1,47 @@
+from collections import namedtuple
+from typing import Callable, Iterator, List, Tuple
+from urllib.parse import urljoin
+from scrapy.utils.response import get_base_url
+
+# One table cell: the text of its link, or of the cell itself when it has
+# no link, the link's href and the cell's class attribute
+Cell = namedtuple('Cell', ('text', 'href', 'cls'))
+
+
+def listing_rows(response, container_xpath:str) -> Iterator[Tuple[str, List[Cell]]]:
+    """
+    Yields (row class, cells) for every <tr> directly under the elements
+    matched by `container_xpath`, usually a listing's <tbody>. Only that one
+    XPath is evaluated; the rows themselves are read with a single walk over
+    the lxml tree instead of several relative queries and re-serialisations
+    per row, which is what dominated parsing listings with tens of thousands
+    of rows.
+    """
+    for container in response.selector.root.xpath(container_xpath):
+        for tr in container.iterchildren('tr'):
+            cells = []
+            for td in tr.iterchildren('td'):
+                a = td.find('a')
+                if a is not None:
+                    cells.append(Cell(a.text, a.get('href'), td.get('class', '')))
+                else:
+                    cells.append(Cell(td.text, None, td.get('class', '')))
+            yield tr.get('class', ''), cells
+
+
+def href_joiner(response) -> Callable[[str], str]:
+    """
+    Returns a function resolving hrefs against the response the way
+    response.urljoin does. Plain relative names, which is every file in a
+    directory listing, are appended to the base directory directly rather
+    than going through a full urljoin for each of them.
+    """
+    base = get_base_url(response)
+    directory = base.split('#', 1)[0].split('?', 1)[0]
+    directory = directory[:directory.rfind('/') + 1]
+
+    def join(href:str) -> str:
+        if href and ':' not in href and href[0] not in './?#' and '/.' not in href:
+            return directory + href
+        return urljoin(base, href)
+    return join
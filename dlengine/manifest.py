@@ -0,0 +1,124 @@
+import sqlite3
+import time
+from typing import List, Optional
+from dlengine.engine import DownloadJob
+
+COMMIT_INTERVAL = 100
+
+
+class Manifest:
+    """
+    SQLite record of every download keyed by url, holding its status, size,
+    SHA-1 and the validators the server sent. Completed urls are found with
+    a primary key lookup instead of a stat of the target file, and failed
+    ones can be queued again without crawling.
+    """
+
+    def __init__(self, path:str, commit_interval:int = COMMIT_INTERVAL):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.uncommitted = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_table()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def create_table(self):
+        self.connection.executescript(
+            """
+                CREATE TABLE IF NOT EXISTS downloads (
+                    url TEXT PRIMARY KEY NOT NULL,
+                    path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    bytes INTEGER,
+                    sha1 TEXT,
+                    etag TEXT,
+                    last_modified TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS downloads_status ON downloads (status);
+            """
+        )
+        self.connection.commit()
+
+
+    def done(self, url:str, path:Optional[str] = None) -> bool:
+        return self.completed(url, path) is not None
+
+
+    def completed(self, url:str, path:Optional[str] = None) -> Optional[tuple]:
+        """
+        Returns (bytes, sha1) of `url` if it was downloaded, to `path` when
+        given, None otherwise. A url wanted at several paths is only done
+        for the one it was last saved to.
+        """
+        if path is None:
+            return self.connection.execute(
+                "SELECT bytes, sha1 FROM downloads WHERE url = ? AND status = 'done';",
+                (url,)
+            ).fetchone()
+        return self.connection.execute(
+            "SELECT bytes, sha1 FROM downloads WHERE url = ? AND path = ? AND status = 'done';",
+            (url, path)
+        ).fetchone()
+
+
+    def record(self, job:DownloadJob, ok:bool):
+        self.connection.execute(
+            """
+                INSERT INTO downloads (url, path, status, bytes, sha1, etag, last_modified, error, attempts, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    path = excluded.path,
+                    status = excluded.status,
+                    bytes = COALESCE(excluded.bytes, bytes),
+                    sha1 = COALESCE(excluded.sha1, sha1),
+                    etag = COALESCE(excluded.etag, etag),
+                    last_modified = COALESCE(excluded.last_modified, last_modified),
+                    error = excluded.error,
+                    attempts = attempts + 1,
+                    updated = excluded.updated;
+            """,
+            (
+                job.url,
+                str(job.path),
+                'done' if ok else 'failed',
+                job.size,
+                job.sha1,
+                job.etag,
+                job.last_modified,
+                None if ok else job.error,
+                time.time()
+            )
+        )
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_interval:
+            self.commit()
+
+
+    def failed(self) -> List[DownloadJob]:
+        rows = self.connection.execute(
+            "SELECT url, path FROM downloads WHERE status = 'failed' ORDER BY updated;"
+        )
+        return [DownloadJob(url, path) for url, path in rows]
+
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,378 @@
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Optional
+from aiohttp import web
+
+REPORT_INTERVAL = 5.0
+WINDOW = 30.0
+PREFIX = 'dlengine'
+
+
+class Metrics:
+    """
+    Counters a DownloadEngine updates as its jobs run. Nothing here walks
+    the jobs; every figure is kept up to date by the engine's own events, so
+    reading them costs the same with ten jobs or ten thousand. Rates are
+    measured over the last `window` seconds of samples.
+    """
+
+    def __init__(self, total_bytes:int = 0, window:float = WINDOW):
+        self.total_bytes = total_bytes
+        self.window = window
+        self.started_at = time.monotonic()
+        self.queued_files = 0
+        self.done = 0
+        self.failed = 0
+        self.skipped = 0
+        self.aborted = 0
+        self.bytes = 0
+        self.retries = 0
+        self.attempts = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.deferred = 0
+        self.samples = deque([(self.started_at, 0, 0, 0, 0)])
+
+
+    @property
+    def finished_files(self) -> int:
+        return self.done + self.failed + self.skipped + self.aborted
+
+
+    def queued(self):
+        self.queued_files += 1
+
+
+    def started(self):
+        self.in_flight += 1
+
+
+    def transferred(self, size:int):
+        self.bytes += size
+
+
+    def retried(self):
+        self.retries += 1
+
+
+    def attempted(self):
+        self.attempts += 1
+
+
+    def errored(self):
+        self.errors += 1
+
+
+    def skip(self):
+        self.skipped += 1
+
+
+    def cancelled(self):
+        self.aborted += 1
+
+
+    def put_aside(self):
+        """
+        Counts a failed job kept back for a later retry pass instead of
+        finishing.
+        """
+        self.in_flight -= 1
+        self.deferred += 1
+
+
+    def taken_back(self, count:int):
+        self.deferred -= count
+
+
+    def finished(self, ok:Optional[bool]):
+        """
+        Counts a job that has stopped running; `ok` is None when it was
+        cancelled or crashed rather than failed.
+        """
+        self.in_flight -= 1
+        if ok:
+            self.done += 1
+        elif ok is None:
+            self.aborted += 1
+        else:
+            self.failed += 1
+
+
+    def sample(self):
+        now = time.monotonic()
+        self.samples.append((now, self.bytes, self.finished_files, self.attempts, self.errors))
+        while len(self.samples) > 2 and self.samples[1][0] <= now - self.window:
+            self.samples.popleft()
+
+
+    def rates(self) -> tuple:
+        """
+        Returns (bytes/s, files/s) over the sampled window.
+        """
+        start, start_bytes, start_files = self.samples[0][:3]
+        elapsed = time.monotonic() - start
+        if elapsed <= 0:
+            return 0.0, 0.0
+        return (self.bytes - start_bytes) / elapsed, (self.finished_files - start_files) / elapsed
+
+
+    def error_rate(self) -> float:
+        """
+        Share of the attempts in the sampled window that failed.
+        """
+        attempts = self.attempts - self.samples[0][3]
+        return (self.errors - self.samples[0][4]) / attempts if attempts else 0.0
+
+
+    def eta(self) -> Optional[float]:
+        """
+        Seconds left at the current rate, by bytes when the total size is
+        known and by files otherwise. None when it cannot be estimated.
+        """
+        bytes_rate, files_rate = self.rates()
+        if self.total_bytes and bytes_rate:
+            return max(self.total_bytes - self.bytes, 0) / bytes_rate
+        if self.queued_files and files_rate:
+            return max(self.queued_files - self.finished_files, 0) / files_rate
+        return None
+
+
+    def snapshot(self) -> dict:
+        bytes_rate, files_rate = self.rates()
+        return {
+            'queued': self.queued_files,
+            'done': self.done,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'aborted': self.aborted,
+            'in_flight': self.in_flight,
+            'deferred': self.deferred,
+            'retries': self.retries,
+            'errors': self.errors,
+            'error_rate': self.error_rate(),
+            'bytes': self.bytes,
+            'total_bytes': self.total_bytes,
+            'bytes_per_second': bytes_rate,
+            'files_per_second': files_rate,
+            'eta': self.eta(),
+            'elapsed': time.monotonic() - self.started_at
+        }
+
+
+    def status(self) -> str:
+        s = self.snapshot()
+        total = f"/{s['queued']}" if s['queued'] else ''
+        eta = format_duration(s['eta']) if s['eta'] is not None else '?'
+        return (
+            f"{s['done'] + s['skipped']}{total} files, {s['failed']} failed, {s['deferred']} put aside, {s['retries']} retries, "
+            f"{s['in_flight']} in flight | {s['bytes'] / 1e6:.1f} MB at {s['bytes_per_second'] / 1e6:.2f} MB/s, "
+            f"{s['files_per_second']:.1f} files/s | ETA {eta}"
+        )
+
+
+    def prometheus(self, prefix:str = PREFIX) -> str:
+        """
+        Renders the metrics in the Prometheus text exposition format.
+        """
+        s = self.snapshot()
+        lines = [
+            f'# HELP {prefix}_files_total Jobs that stopped running, by outcome.',
+            f'# TYPE {prefix}_files_total counter'
+        ]
+        for status in ('done', 'failed', 'skipped', 'aborted'):
+            lines.append(f'{prefix}_files_total{{status="{status}"}} {s[status]}')
+        metrics = (
+            ('files_queued_total', 'counter', 'Jobs submitted to the engine.', s['queued']),
+            ('bytes_total', 'counter', 'Bytes received.', s['bytes']),
+            ('retries_total', 'counter', 'Attempts repeated after a failure.', s['retries']),
+            ('errors_total', 'counter', 'Attempts that failed.', s['errors']),
+            ('in_flight', 'gauge', 'Jobs currently running.', s['in_flight']),
+            ('deferred', 'gauge', 'Failed jobs waiting for a retry pass.', s['deferred']),
+            ('bytes_per_second', 'gauge', 'Receive rate over the sampling window.', s['bytes_per_second']),
+            ('files_per_second', 'gauge', 'Completion rate over the sampling window.', s['files_per_second']),
+        )
+        if s['eta'] is not None:
+            metrics += (('eta_seconds', 'gauge', 'Estimated time left.', s['eta']),)
+        for name, kind, description, value in metrics:
+            lines.append(f'# HELP {prefix}_{name} {description}')
+            lines.append(f'# TYPE {prefix}_{name} {kind}')
+            lines.append(f'{prefix}_{name} {value:g}' if isinstance(value, float) else f'{prefix}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+class Reporter:
+    """
+    Publishes an engine's Metrics while it runs: a status line printed every
+    `interval` seconds, a Prometheus textfile rewritten atomically at the
+    same pace for node_exporter's textfile collector, and/or endpoints
+    served on `port`:
+
+        GET  /metrics      the Prometheus metrics
+        GET  /status       the metrics and the engine's queue depth, jobs
+                           waiting for their host, limits and running
+                           transfers as JSON
+        POST /pause        stops starting and reading downloads
+        POST /resume       carries on after /pause
+        POST /concurrency  takes {"total": n, "per_host": n}, either optional
+
+    The POST endpoints are only served with `control`. An engine given a
+    reporter starts and stops it; one that outlives its engines, like a
+    node's across coordinator connections, is started on its own and the
+    engines come and go through attach() and detach(). Pause and
+    concurrency changes are kept and applied to every engine attached
+    later.
+    """
+
+    def __init__(
+        self,
+        interval:float = REPORT_INTERVAL,
+        status:bool = True,
+        textfile:Optional[str] = None,
+        port:Optional[int] = None,
+        host:str = '127.0.0.1',
+        control:bool = False
+    ):
+        self.interval = interval
+        self.status = status
+        self.textfile = textfile
+        self.port = port
+        self.host = host
+        self.control = control
+        self.metrics = None
+        self.engine = None
+        # Control settings outliving any one engine
+        self.paused = False
+        self.limits = {}
+        self.task = None
+        self.runner = None
+
+
+    def routes(self) -> list:
+        routes = [web.get('/metrics', self.serve_metrics), web.get('/status', self.serve_status)]
+        if self.control:
+            routes += [
+                web.post('/pause', self.pause),
+                web.post('/resume', self.resume),
+                web.post('/concurrency', self.concurrency)
+            ]
+        return routes
+
+
+    async def start(self, metrics:Metrics, engine = None):
+        self.metrics = metrics
+        if engine:
+            await self.attach(engine)
+        if self.port is not None:
+            app = web.Application()
+            app.add_routes(self.routes())
+            self.runner = web.AppRunner(app, access_log=None)
+            await self.runner.setup()
+            await web.TCPSite(self.runner, self.host, self.port).start()
+        self.task = asyncio.create_task(self.run())
+
+
+    async def attach(self, engine):
+        self.engine = engine
+        if self.paused:
+            await engine.pause()
+        if self.limits:
+            await engine.set_concurrency(self.limits.get('total'), self.limits.get('per_host'))
+
+
+    def detach(self):
+        self.engine = None
+
+
+    async def stop(self):
+        self.detach()
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+        self.report()
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
+
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.report()
+
+
+    def report(self):
+        self.metrics.sample()
+        if self.status:
+            print(self.metrics.status())
+        if self.textfile:
+            write_textfile(self.textfile, self.metrics.prometheus())
+
+
+    async def serve_metrics(self, request:web.Request) -> web.Response:
+        return web.Response(text=self.metrics.prometheus(), content_type='text/plain', charset='utf-8')
+
+
+    def snapshot(self) -> dict:
+        status = self.metrics.snapshot()
+        if self.engine:
+            status.update(self.engine.status())
+        else:
+            status.update({
+                'queue_depth': 0,
+                'waiting': 0,
+                'dead_letters': 0,
+                'paused': self.paused,
+                'concurrency': self.limits.get('total'),
+                'per_host': {},
+                'transfers': []
+            })
+        return status
+
+
+    async def serve_status(self, request:web.Request) -> web.Response:
+        return web.json_response(self.snapshot())
+
+
+    async def pause(self, request:web.Request) -> web.Response:
+        self.paused = True
+        if self.engine:
+            await self.engine.pause()
+        print("Paused")
+        return web.json_response(self.snapshot())
+
+
+    async def resume(self, request:web.Request) -> web.Response:
+        self.paused = False
+        if self.engine:
+            await self.engine.resume()
+        print("Resumed")
+        return web.json_response(self.snapshot())
+
+
+    async def concurrency(self, request:web.Request) -> web.Response:
+        try:
+            limits = await request.json()
+            changed = {name: int(limits[name]) for name in ('total', 'per_host') if limits.get(name) is not None}
+        except (ValueError, TypeError, AttributeError) as e:
+            return web.json_response({'error': repr(e)}, status=400)
+        self.limits.update(changed)
+        if self.engine:
+            await self.engine.set_concurrency(changed.get('total'), changed.get('per_host'))
+        print(f"Concurrency changed to {limits}")
+        return web.json_response(self.snapshot())
+
+
+def write_textfile(path:str, text:str):
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+
+def format_duration(seconds:float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
@@ -0,0 +1,59 @@
+from typing import Callable, Iterable
+from scrapy.crawler import Crawler
+from scrapy.utils.defer import deferred_from_coro
+from dlengine.engine import DownloadEngine, DownloadJob
+
+ASYNCIO_REACTOR = 'twisted.internet.asyncioreactor.AsyncioSelectorReactor'
+
+
+class DownloadPipeline:
+    """
+    Item pipeline that hands the jobs of every scraped item to a
+    DownloadEngine running on the crawler's own asyncio loop, so downloads
+    start while the crawl is still going. `DOWNLOAD_JOBS` maps an item to its
+    download jobs and `DOWNLOAD_ENGINE` creates the DownloadEngine. Both are
+    callables because Scrapy deep copies its settings, which a manifest or
+    store holding an sqlite connection cannot survive.
+    When the engine queue is full process_item waits, which throttles the
+    crawl instead of buffering every item in memory.
+    """
+
+    def __init__(self, item_jobs:Callable[[dict], Iterable[DownloadJob]], engine_factory:Callable[[], DownloadEngine]):
+        self.item_jobs = item_jobs
+        self.engine = engine_factory()
+
+
+    @classmethod
+    def from_crawler(cls, crawler: Crawler):
+        return cls(
+            item_jobs=crawler.settings.get("DOWNLOAD_JOBS"),
+            engine_factory=crawler.settings.get("DOWNLOAD_ENGINE")
+        )
+
+
+    def open_spider(self, spider):
+        return deferred_from_coro(self.engine.start())
+
+
+    def close_spider(self, spider):
+        return deferred_from_coro(self.engine.close())
+
+
+    async def process_item(self, item, spider):
+        for job in self.item_jobs(item):
+            await self.engine.submit(job)
+        return item
+
+
+def stream_settings(item_jobs:Callable[[dict], Iterable[DownloadJob]], **engine_kwargs) -> dict:
+    """
+    Crawler settings that stream every item through DownloadPipeline.
+    """
+    return {
+        "TWISTED_REACTOR": ASYNCIO_REACTOR,
+        "ITEM_PIPELINES": {
+            "dlengine.pipeline.DownloadPipeline": 300,
+        },
+        "DOWNLOAD_JOBS": item_jobs,
+        "DOWNLOAD_ENGINE": lambda: DownloadEngine(**engine_kwargs),
+    }
@@ -0,0 +1,267 @@
+import asyncio
+import random
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+from typing import Optional
+import aiohttp
+
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+MAX_RETRY_AFTER = 600.0
+THRESHOLD = 5
+WINDOW = 20
+FAILURE_RATIO = 0.8
+COOLDOWN = 30.0
+MAX_COOLDOWN = 600.0
+PROBE_TIMEOUT = 120.0
+
+# What went wrong with an attempt
+CONNECT = 'connect'
+TIMEOUT = 'timeout'
+SHORT_READ = 'short read'
+CLIENT = 'client error'
+THROTTLED = 'throttled'
+SERVER = 'server error'
+CHECKSUM = 'checksum'
+CHANGED = 'changed'
+DISK = 'disk'
+UNAVAILABLE = 'host unavailable'
+OTHER = 'other'
+
+RETRYABLE = {CONNECT, TIMEOUT, SHORT_READ, THROTTLED, SERVER, CHECKSUM, CHANGED, UNAVAILABLE, OTHER}
+# Failures that say the host is broken rather than the file. A host asking
+# to slow down is left to the backoff and the AIMDController
+HOST_FAILURES = {CONNECT, TIMEOUT, SHORT_READ, SERVER}
+# Failures worth retrying at once rather than after a backoff
+IMMEDIATE = {CHECKSUM, CHANGED}
+
+
+class TransferError(Exception):
+    """
+    A failed attempt, with its kind and the seconds the server asked to
+    wait before the next one, if it did.
+    """
+
+    def __init__(self, kind:str, message:str, retry_after:Optional[float] = None):
+        super().__init__(message)
+        self.kind = kind
+        self.retry_after = retry_after
+
+
+def status_error(response) -> TransferError:
+    status = response.status
+    if status in (429, 503):
+        kind = THROTTLED
+    elif status == 408:
+        kind = TIMEOUT
+    elif 400 <= status < 500:
+        kind = CLIENT
+    elif status >= 500:
+        kind = SERVER
+    else:
+        kind = OTHER
+    return TransferError(kind, f'HTTP {status}', parse_retry_after(response.headers.get('Retry-After')))
+
+
+def classify(error:BaseException) -> str:
+    if isinstance(error, TransferError):
+        return error.kind
+    if isinstance(error, asyncio.TimeoutError):
+        return TIMEOUT
+    if isinstance(error, aiohttp.ClientPayloadError):
+        return SHORT_READ
+    if isinstance(error, (aiohttp.ClientConnectorError, aiohttp.ServerDisconnectedError, aiohttp.ClientOSError)):
+        return CONNECT
+    if isinstance(error, aiohttp.ClientResponseError):
+        return SERVER if error.status >= 500 else CLIENT
+    if isinstance(error, aiohttp.ClientError):
+        return CONNECT
+    if isinstance(error, OSError):
+        return DISK
+    return OTHER
+
+
+def parse_retry_after(value:Optional[str]) -> Optional[float]:
+    """
+    Seconds to wait from a Retry-After header given either as a number of
+    seconds or as an HTTP date.
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Decides whether a failed attempt is worth repeating and how long to
+    wait first: a random delay of up to `base_delay` doubled for every
+    attempt so far, capped at `max_delay` (exponential backoff with full
+    jitter, so retries from many jobs spread out instead of arriving
+    together). A Retry-After sent by the server is honoured up to
+    `max_retry_after`. Client errors are not retried, nor is running out of
+    disk.
+    """
+
+    def __init__(
+        self,
+        base_delay:float = BASE_DELAY,
+        max_delay:float = MAX_DELAY,
+        max_retry_after:float = MAX_RETRY_AFTER,
+        retryable:set = RETRYABLE
+    ):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.retryable = retryable
+
+
+    def should_retry(self, kind:str) -> bool:
+        return kind in self.retryable
+
+
+    def delay(self, attempt:int, kind:str, retry_after:Optional[float] = None) -> float:
+        """
+        Seconds to wait before attempt number `attempt`, counted from 1 for
+        the first retry.
+        """
+        if kind in IMMEDIATE:
+            return 0.0
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_retry_after))
+        return delay
+
+
+class Circuit:
+    """
+    The state of one host in a CircuitBreaker.
+    """
+
+    def __init__(self, cooldown:float, window:int):
+        # True for every recent response, False for every failure
+        self.outcomes = deque(maxlen=window)
+        self.cooldown = cooldown
+        self.open_until = 0.0
+        self.opened = False
+        self.probing = False
+        self.probe_started = 0.0
+
+
+    def open(self, retry_after:Optional[float] = None):
+        self.open_until = time.monotonic() + max(self.cooldown, min(retry_after or 0, MAX_RETRY_AFTER))
+
+
+class CircuitBreaker:
+    """
+    Stops every job from hitting a host that keeps failing. Once at least
+    `threshold` of the last `window` requests to a host failed (connection
+    errors, timeouts, short reads and 5xx other than 503), and they make up
+    `failure_ratio` of them, the circuit of the host opens for `cooldown`
+    seconds, or as long as the server's Retry-After asked, during which
+    requests to it are refused. Then one request is let through as a
+    probe: if it works the circuit closes, if not it opens again for twice
+    as long, up to `max_cooldown`.
+    """
+
+    def __init__(
+        self,
+        threshold:int = THRESHOLD,
+        window:int = WINDOW,
+        failure_ratio:float = FAILURE_RATIO,
+        cooldown:float = COOLDOWN,
+        max_cooldown:float = MAX_COOLDOWN
+    ):
+        self.threshold = threshold
+        self.window = window
+        self.failure_ratio = failure_ratio
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.circuits = {}
+
+
+    def circuit(self, host:str) -> Circuit:
+        circuit = self.circuits.get(host)
+        if circuit is None:
+            circuit = self.circuits[host] = Circuit(self.cooldown, self.window)
+        return circuit
+
+
+    def is_open(self, host:str) -> bool:
+        circuit = self.circuits.get(host)
+        return circuit is not None and circuit.open_until > time.monotonic()
+
+
+    async def ready(self, host:str):
+        """
+        Waits until the circuit of `host`, if open, is due for a probe.
+        """
+        circuit = self.circuit(host)
+        while (wait := circuit.open_until - time.monotonic()) > 0:
+            await asyncio.sleep(wait)
+
+
+    async def wait(self, host:str) -> bool:
+        """
+        Returns whether a request to `host` may go out, waiting first while
+        a probe of the host is out. False means its circuit is open.
+        """
+        circuit = self.circuit(host)
+        while True:
+            now = time.monotonic()
+            if circuit.open_until > now:
+                return False
+            elif circuit.probing and now - circuit.probe_started < PROBE_TIMEOUT:
+                # Someone else's probe is out; one that never reports back
+                # is given up on after PROBE_TIMEOUT
+                await asyncio.sleep(1.0)
+            else:
+                if circuit.opened:
+                    circuit.probing = True
+                    circuit.probe_started = now
+                    print(f"Probing {host} after {circuit.cooldown:.0f}s")
+                return True
+
+
+    def succeeded(self, host:str):
+        """
+        Records a response from `host` that was not an error.
+        """
+        circuit = self.circuit(host)
+        if circuit.probing:
+            print(f"{host} is back, closing its circuit")
+            circuit.outcomes.clear()
+            circuit.opened = False
+            circuit.probing = False
+            circuit.cooldown = self.cooldown
+        circuit.outcomes.append(True)
+
+
+    def failed(self, host:str, kind:str, retry_after:Optional[float] = None):
+        if kind == UNAVAILABLE:
+            # Refused by this breaker, nothing new about the host
+            return
+        if kind not in HOST_FAILURES:
+            # The host answered, so it is up
+            self.succeeded(host)
+            return
+        circuit = self.circuit(host)
+        circuit.outcomes.append(False)
+        failures = circuit.outcomes.count(False)
+        if circuit.probing:
+            circuit.probing = False
+            circuit.cooldown = min(circuit.cooldown * 2, self.max_cooldown)
+            circuit.open(retry_after)
+            print(f"{host} is still failing, pausing it for {circuit.open_until - time.monotonic():.0f}s")
+        elif not circuit.opened and failures >= self.threshold \
+                and failures >= len(circuit.outcomes) * self.failure_ratio:
+            circuit.opened = True
+            circuit.open(retry_after)
+            print(f"{failures} of the last {len(circuit.outcomes)} requests to {host} failed, pausing it for {circuit.open_until - time.monotonic():.0f}s")
@@ -0,0 +1,121 @@
+import fcntl
+import os
+import shutil
+import sqlite3
+from typing import Optional
+
+# ioctl request cloning one file's extents into another (Linux, btrfs/xfs)
+FICLONE = 0x40049409
+
+
+class ContentStore:
+    """
+    Keeps every distinct file once under <root>/objects/ab/<sha1> and exposes
+    it at each logical path through a hardlink, falling back to a reflink or
+    a plain copy where hardlinks are impossible. An index in
+    <root>/index.sqlite maps digests to objects and urls to digests, so
+    content already in the store is never written again and a url fetched in
+    an earlier run does not have to be fetched at all.
+    """
+
+    def __init__(self, root:str):
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(root, 'index.sqlite'))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def create_tables(self):
+        self.connection.executescript(
+            """
+                CREATE TABLE IF NOT EXISTS objects (
+                    sha1 TEXT PRIMARY KEY NOT NULL,
+                    size INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS urls (
+                    url TEXT PRIMARY KEY NOT NULL,
+                    sha1 TEXT NOT NULL
+                );
+            """
+        )
+        self.connection.commit()
+
+
+    def object_path(self, sha1:str) -> str:
+        return os.path.join(self.root, 'objects', sha1[:2], sha1)
+
+
+    def has(self, sha1:str) -> bool:
+        row = self.connection.execute("SELECT 1 FROM objects WHERE sha1 = ?;", (sha1,)).fetchone()
+        return row is not None
+
+
+    def lookup(self, url:str) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT urls.sha1 FROM urls JOIN objects ON objects.sha1 = urls.sha1 WHERE url = ?;",
+            (url,)
+        ).fetchone()
+        return row[0] if row else None
+
+
+    def add(self, temp_path:str, sha1:str, url:str) -> bool:
+        """
+        Moves the finished download at `temp_path` into the store, or drops
+        it when the store already holds the same content. Returns whether
+        the content was new.
+        """
+        new = not self.has(sha1)
+        if new:
+            object_path = self.object_path(sha1)
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            os.replace(temp_path, object_path)
+            self.connection.execute(
+                "INSERT INTO objects (sha1, size) VALUES (?, ?);",
+                (sha1, os.path.getsize(object_path))
+            )
+        else:
+            os.remove(temp_path)
+        self.connection.execute(
+            "INSERT INTO urls (url, sha1) VALUES (?, ?) ON CONFLICT (url) DO UPDATE SET sha1 = excluded.sha1;",
+            (url, sha1)
+        )
+        self.connection.commit()
+        return new
+
+
+    def link(self, sha1:str, path:str):
+        """
+        Exposes the object `sha1` at `path`, replacing whatever is there.
+        """
+        object_path = self.object_path(sha1)
+        temp_path = path + '.link'
+        try:
+            os.link(object_path, temp_path)
+        except OSError:
+            reflink_or_copy(object_path, temp_path)
+        os.replace(temp_path, path)
+
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+
+def reflink_or_copy(source:str, destination:str):
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        try:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return
+        except OSError:
+            pass
+    shutil.copyfile(source, destination)
@@ -0,0 +1,158 @@
+import asyncio
+import errno
+import os
+from typing import Callable, Optional
+
+MIN_BUFFER = 64 * 1024
+MAX_BUFFER = 4 * 1024 * 1024
+SYNC_BYTES = 64 * 1024 * 1024
+
+fdatasync = getattr(os, 'fdatasync', os.fsync)
+
+
+def buffer_size(length:Optional[int]) -> int:
+    """
+    Picks the write size for a body of `length` bytes: about a sixty-fourth
+    of it, as a power of two between MIN_BUFFER and MAX_BUFFER.
+    """
+    size = MIN_BUFFER
+    while size < MAX_BUFFER and size * 64 < (length or 0):
+        size *= 2
+    return size
+
+
+class BufferPool:
+    """
+    Keeps the buffers of finished writes for the next ones, so that a
+    running engine stops allocating them once it has one per worker.
+    """
+
+    def __init__(self):
+        self.free = {}
+
+
+    def take(self, size:int) -> bytearray:
+        free = self.free.get(size)
+        return free.pop() if free else bytearray(size)
+
+
+    def give(self, buffer:bytearray):
+        self.free.setdefault(len(buffer), []).append(buffer)
+
+
+class ChunkWriter:
+    """
+    Gathers the chunks of a response body into a buffer taken from `pool`
+    and writes them to `fd` from `offset` on in blocks the size of the
+    buffer, instead of one write per network read. While the length of the
+    body is unknown the buffer grows with the amount written so far. The
+    blocks are written from a thread, so a slow disk holds up only its own
+    transfer rather than the event loop. This cuts the number of write
+    syscalls, not allocations: aiohttp still hands over every network read
+    as a new bytes object, which is copied into the buffer.
+
+    `on_flush(offset, block)` is called with every block once it is on disk,
+    to hash it or record progress; `block` is a view of the buffer that is
+    only valid during the call. Every `sync_bytes` the file is fdatasync'd
+    in a thread so dirty pages go out in batches rather than piling up, and
+    files big enough to have been synced on the way are synced once more on
+    close. Smaller ones are left to the OS, where a sync each would cost
+    more than the transfer.
+    """
+
+    def __init__(
+        self,
+        fd:int,
+        pool:BufferPool,
+        offset:int = 0,
+        length:Optional[int] = None,
+        on_flush:Optional[Callable[[int, memoryview], None]] = None,
+        sync_bytes:int = SYNC_BYTES
+    ):
+        self.fd = fd
+        self.pool = pool
+        self.offset = offset
+        self.length = length
+        self.on_flush = on_flush
+        self.sync_bytes = sync_bytes
+        self.written = 0
+        self.unsynced = 0
+        self.synced = False
+        self.buffer = pool.take(buffer_size(length))
+        self.view = memoryview(self.buffer)
+        self.filled = 0
+
+
+    async def write(self, data:bytes):
+        data = memoryview(data)
+        if not self.filled and len(data) >= len(self.buffer):
+            await self.write_block(data)
+            return
+        while data:
+            size = min(len(data), len(self.buffer) - self.filled)
+            self.view[self.filled:self.filled + size] = data[:size]
+            self.filled += size
+            data = data[size:]
+            if self.filled == len(self.buffer):
+                await self.flush()
+
+
+    async def flush(self):
+        if self.filled:
+            filled, self.filled = self.filled, 0
+            await self.write_block(self.view[:filled])
+        if self.length is None and buffer_size(self.written) > len(self.buffer):
+            self.view.release()
+            self.pool.give(self.buffer)
+            self.buffer = self.pool.take(buffer_size(self.written))
+            self.view = memoryview(self.buffer)
+
+
+    async def write_block(self, block:memoryview):
+        await asyncio.to_thread(write_all, self.fd, block, self.offset)
+        if self.on_flush:
+            self.on_flush(self.offset, block)
+        self.offset += len(block)
+        self.written += len(block)
+        self.unsynced += len(block)
+        if self.sync_bytes and self.unsynced >= self.sync_bytes:
+            await asyncio.to_thread(fdatasync, self.fd)
+            self.unsynced = 0
+            self.synced = True
+
+
+    async def close(self):
+        """
+        Writes out what is still buffered and hands the buffer back.
+        """
+        try:
+            await self.flush()
+            if self.synced and self.unsynced:
+                await asyncio.to_thread(fdatasync, self.fd)
+                self.unsynced = 0
+        finally:
+            self.view.release()
+            self.pool.give(self.buffer)
+
+
+def write_all(fd:int, data:memoryview, offset:int):
+    while data:
+        written = os.pwrite(fd, data, offset)
+        data = data[written:]
+        offset += written
+
+
+def preallocate(fd:int, length:int):
+    """
+    Reserves `length` bytes for the file behind `fd`, in as few extents as
+    the filesystem manages, so that large files do not fragment as they
+    grow. Falls back to a sparse truncate where fallocate is unsupported.
+    """
+    if hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, length)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.EINVAL, errno.ENOSYS):
+                raise
+    os.ftruncate(fd, length)
@@ -0,0 +1,93 @@
+import scrapy
+import os
+import re
+import sys
+from urllib.parse import quote
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine.listing import listing_rows
+
+SIZE_UNITS = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+CHECKSUMS = ('md5', 'sha1', 'crc32')
+
+
+class fileItem(scrapy.Item):
+    name = scrapy.Field()
+    url = scrapy.Field()
+    directory = scrapy.Field()
+    size = scrapy.Field()
+    checksums = scrapy.Field()
+
+
+class archiveDLSpider(scrapy.Spider):
+    name = 'archiveDL'
+    allowed_domains = ['archive.org']
+    start_urls = ['https://archive.org/download/RedumpSegaDreamcast20160613', 'https://archive.org/download/redump.psp', 'https://archive.org/download/redump.psp.p2', 'https://archive.org/download/GameboyClassicRomCollectionByGhostware', 'https://archive.org/download/GameboyColorRomCollectionByGhostware', 'https://archive.org/download/GameboyAdvanceRomCollectionByGhostware']
+    reg = re.compile('.+\.zip')
+
+    def start_requests(self):
+        # Every item publishes <identifier>_files.xml with exact sizes and
+        # checksums; the html listing is only used when that is unavailable.
+        for url in self.start_urls:
+            identifier = url.rsplit('/')[-1]
+            yield scrapy.Request(
+                url=url + "/" + identifier + "_files.xml",
+                callback=self.parse_files_xml,
+                errback=self.listing_fallback,
+                cb_kwargs={'url': url}
+            )
+
+    def listing_fallback(self, failure):
+        yield scrapy.Request(url=failure.request.cb_kwargs['url'], callback=self.parse)
+
+    def parse_files_xml(self, response, url):
+        # The <file> elements are read straight off the lxml tree, each in a
+        # single pass over its children
+        files = response.selector.root.iter('file')
+        found = False
+        for f in files:
+            found = True
+            name = f.get('name', '')
+            if self.reg.match(name):
+                fields = {child.tag: child.text for child in f}
+                item = fileItem()
+                item['name'] = name
+                item['url'] = url + "/" + quote(name)
+                item['directory'] = url.rsplit('/')[-1]
+                item['size'] = int(fields.get('size') or 0)
+                item['checksums'] = {name: fields[name] for name in CHECKSUMS if fields.get(name)}
+                yield item
+        if not found:
+            yield scrapy.Request(url=url, callback=self.parse)
+
+    def parse(self,response):
+        for _, cells in listing_rows(response, '//table[@class="directory-listing-table"]/tbody'):
+            if not cells:
+                continue
+            name = cells[0].text
+            if name and cells[0].href and self.reg.match(name):
+                item = fileItem()
+                item['name'] = name
+                item['url'] = response.url + "/" + cells[0].href
+                item['directory'] = response.url.rsplit('/')[-1]
+                item['size'] = parse_size(cells[-1].text)
+                yield item
+
+
+def parse_size(value) -> int:
+    """
+    Converts the human readable size column of a directory listing, e.g.
+    '4.3G' or '692.5M', to an approximate number of bytes.
+    """
+    match = re.match(r'\s*([\d.]+)\s*([KMGT]?)', value or '')
+    if not match:
+        return 0
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def largest_first(jobs:list) -> list:
+    """
+    Orders jobs by descending size so the longest transfers start first and
+    the small ones fill in the gaps at the end of a run.
+    """
+    return sorted(jobs, key=lambda job: job.get('size') or 0, reverse=True)
@@ -0,0 +1,300 @@
+import asyncio
+import os
+import statistics
+import sys
+import time
+from collections import deque
+from typing import Callable, Optional
+from protocol import PORT, SILENCE_TIMEOUT, Connection
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine.limits import RELOAD_INTERVAL, LimitsFile, divide_limits
+
+LEASE_BYTES = 32 * 1024 * 1024 * 1024
+RECONNECT_RETRY = 6
+RECONNECT_DELAY = 10.0
+# Times a job that failed on a node is queued again, for another node if any
+REQUEUE = 2
+# A job is copied to an idle node once it has run this many times as long
+# as its size takes at the median rate of the finished jobs, and for at
+# least SPECULATE_AFTER seconds
+STRAGGLER_FACTOR = 3.0
+SPECULATE_AFTER = 60.0
+# Finished jobs whose rates make up that median
+RATE_SAMPLES = 100
+
+
+class Coordinator:
+    """
+    Hands jobs to dl-server nodes as they ask for them instead of dividing
+    the collection up front, so fast or idle nodes end up doing more of the
+    work. Once the queue is empty an idle node is given a copy of a
+    straggler running elsewhere: a job a node reported as started, rather
+    than merely queued, at least `speculate_after` seconds ago and that has
+    taken `straggler_factor` times as long as its size should at the median
+    rate of the jobs finished so far. Whichever copy finishes first wins
+    and the other is cancelled. Jobs leased to a node that disconnects, or goes
+    `silence_timeout` seconds without a message or heartbeat, go back to the
+    front of the queue, and the node is reconnected to `reconnect_retry`
+    times, `reconnect_delay` seconds apart. A node is never leased more
+    than `lease_bytes` at once (but always at least one job), so whichever
+    node connects first cannot hoard the largest files of a collection
+    ordered largest first.
+    A job a node failed is queued again up to `requeue` times and given to
+    a node it has not failed on yet while there is one, since the nodes
+    leave retrying a job beyond its own attempts to the cluster.
+    Cluster wide rate limits read from `limits`, a LimitsFile, are split
+    evenly between the nodes holding jobs and sent to every node again
+    whenever that split or the file changes. Every outcome the nodes report,
+    with the size and SHA-1 of the file, is written to `registry`.
+    """
+
+    def __init__(
+        self,
+        jobs:list,
+        port:int = PORT,
+        speculate:bool = True,
+        straggler_factor:float = STRAGGLER_FACTOR,
+        speculate_after:float = SPECULATE_AFTER,
+        lease_bytes:int = LEASE_BYTES,
+        limits:Optional[LimitsFile] = None,
+        registry = None,
+        silence_timeout:float = SILENCE_TIMEOUT,
+        reconnect_retry:int = RECONNECT_RETRY,
+        reconnect_delay:float = RECONNECT_DELAY,
+        requeue:int = REQUEUE,
+        on_complete:Optional[Callable[[dict, bool], None]] = None
+    ):
+        self.jobs = {job['id']: job for job in jobs}
+        self.pending = deque(jobs)
+        self.port = port
+        self.speculate = speculate
+        self.straggler_factor = straggler_factor
+        self.speculate_after = speculate_after
+        # Bytes/s of recently finished jobs, from start to done
+        self.rates = deque(maxlen=RATE_SAMPLES)
+        self.lease_bytes = lease_bytes
+        self.limits = limits
+        self.registry = registry
+        self.silence_timeout = silence_timeout
+        self.reconnect_retry = reconnect_retry
+        self.reconnect_delay = reconnect_delay
+        self.requeue = requeue
+        # The nodes every job failed on so far, and how often it failed
+        self.failed_on = {}
+        self.failures = {}
+        self.shares = {}
+        self.on_complete = on_complete
+        self.leases = {}
+        self.started_at = {}
+        self.held = {}
+        self.held_bytes = {}
+        self.wants = {}
+        self.nodes = {}
+        self.results = {}
+        self.finished = False
+
+
+    async def run(self, hosts:list):
+        watcher = asyncio.create_task(self.watch_limits()) if self.limits else None
+        results = await asyncio.gather(*(self.run_node(host) for host in hosts), return_exceptions=True)
+        if watcher:
+            watcher.cancel()
+            await asyncio.gather(watcher, return_exceptions=True)
+        for host, result in zip(hosts, results):
+            if isinstance(result, BaseException):
+                print(host + ": " + repr(result))
+        if not self.finished:
+            print(f"{len(self.jobs) - len(self.results)} jobs were not completed")
+
+
+    async def run_node(self, host:str):
+        connection = await Connection.open(host, self.port)
+        while True:
+            await self.serve_node(host, connection)
+            if self.finished:
+                return
+            print(f"Lost {host}, reconnecting")
+            connection = await Connection.open(host, self.port, self.reconnect_retry, self.reconnect_delay)
+            if self.finished:
+                await connection.send({'op': 'end'})
+                await connection.close()
+                return
+
+
+    async def serve_node(self, host:str, connection:Connection):
+        self.nodes[host] = connection
+        self.held[host] = set()
+        self.held_bytes[host] = 0
+        self.wants[host] = 0
+        # So that the node notices if this side goes away silently
+        heartbeat = asyncio.create_task(connection.heartbeat())
+        try:
+            await self.share_limits()
+            await self.dispatch()
+            while (msg := await connection.receive(self.silence_timeout)) is not None:
+                if msg['op'] == 'pull':
+                    self.wants[host] += msg['n']
+                elif msg['op'] == 'started':
+                    if host in self.leases.get(msg['id'], ()):
+                        self.started_at.setdefault(msg['id'], time.monotonic())
+                elif msg['op'] == 'done':
+                    await self.complete(host, msg)
+                elif msg['op'] == 'heartbeat':
+                    # Nothing to record, but time passing may have made a
+                    # straggler worth copying to an idle node
+                    pass
+                await self.dispatch()
+                await self.share_limits()
+        except asyncio.TimeoutError:
+            print(f"Nothing from {host} for {self.silence_timeout:.0f}s, reassigning its {len(self.held[host])} jobs")
+        except (OSError, ValueError) as e:
+            print(f"{host}: {e!r}")
+        finally:
+            heartbeat.cancel()
+            self.release(host)
+            await connection.close()
+            await self.share_limits()
+            await self.dispatch()
+
+
+    async def watch_limits(self):
+        while True:
+            await asyncio.sleep(RELOAD_INTERVAL)
+            if self.limits.changed():
+                print(f"Reloaded rate limits from {self.limits.path}")
+                self.shares = {}
+                await self.share_limits()
+
+
+    async def share_limits(self):
+        if not self.limits or not self.nodes:
+            return
+        busy = sum(1 for host in self.nodes if self.held[host]) or len(self.nodes)
+        share = divide_limits(self.limits.limits, busy)
+        for host, connection in list(self.nodes.items()):
+            if self.shares.get(host) != share:
+                self.shares[host] = share
+                await connection.send({'op': 'limits', 'limits': share})
+
+
+    def take(self, host:str, count:int) -> list:
+        jobs = []
+        skipped = []
+        leased = self.held_bytes[host]
+        while self.pending and len(jobs) < count:
+            job = self.pending[0]
+            size = job.get('size') or 0
+            if (self.held[host] or jobs) and leased + size > self.lease_bytes:
+                break
+            self.pending.popleft()
+            if job['id'] in self.results:
+                continue
+            if self.avoids(host, job['id']):
+                skipped.append(job)
+                continue
+            jobs.append(job)
+            leased += size
+        self.pending.extendleft(reversed(skipped))
+        if not jobs and count and self.speculate and not self.held[host]:
+            if job_id := self.straggler(host):
+                print(f"Speculatively re-issuing {self.jobs[job_id]['name']} to {host}")
+                jobs.append(self.jobs[job_id])
+        for job in jobs:
+            self.leases.setdefault(job['id'], set()).add(host)
+            self.held[host].add(job['id'])
+            self.held_bytes[host] += job.get('size') or 0
+        return jobs
+
+
+    def straggler(self, host:str) -> Optional[str]:
+        """
+        Returns the job running on a single node other than `host` that is
+        furthest behind what the median rate of finished jobs predicts, if
+        any is far enough behind to be worth copying.
+        """
+        if not self.rates:
+            return None
+        rate = statistics.median(self.rates)
+        now = time.monotonic()
+        overdue = []
+        for job_id, started_at in self.started_at.items():
+            if len(self.leases[job_id]) != 1 or host in self.leases[job_id]:
+                continue
+            elapsed = now - started_at
+            expected = (self.jobs[job_id].get('size') or 0) / rate
+            if elapsed >= self.speculate_after and elapsed >= expected * self.straggler_factor:
+                overdue.append((elapsed - expected, job_id))
+        return max(overdue)[1] if overdue else None
+
+
+    def avoids(self, host:str, job_id:str) -> bool:
+        """
+        Whether `job_id` failed on `host` and is better left to another
+        connected node it has not failed on.
+        """
+        failed = self.failed_on.get(job_id)
+        return bool(failed) and host in failed and any(other not in failed for other in self.nodes)
+
+
+    async def dispatch(self):
+        for host, connection in list(self.nodes.items()):
+            jobs = self.take(host, self.wants[host])
+            if jobs:
+                self.wants[host] -= len(jobs)
+                await connection.send({'op': 'jobs', 'jobs': jobs})
+        if not self.finished and not self.pending and not self.leases:
+            self.finished = True
+            for connection in list(self.nodes.values()):
+                await connection.send({'op': 'end'})
+
+
+    async def complete(self, host:str, msg:dict):
+        job_id = msg['id']
+        ok = msg['ok']
+        hosts = self.leases.get(job_id)
+        if hosts is None or host not in hosts:
+            return
+        hosts.discard(host)
+        self.unhold(host, job_id)
+        if not ok and hosts:
+            return
+        del self.leases[job_id]
+        started_at = self.started_at.pop(job_id, None)
+        size = self.jobs[job_id].get('size')
+        if ok and started_at is not None and size:
+            self.rates.append(size / max(time.monotonic() - started_at, 1e-3))
+        if not ok:
+            self.failed_on.setdefault(job_id, set()).add(host)
+            self.failures[job_id] = self.failures.get(job_id, 0) + 1
+            if self.failures[job_id] <= self.requeue:
+                print(f"{self.jobs[job_id]['name']} failed on {host}: {msg.get('error')}, queueing it again")
+                self.pending.append(self.jobs[job_id])
+                return
+        self.results[job_id] = ok
+        if self.registry:
+            self.registry.record(host, self.jobs[job_id], ok, msg.get('bytes'), msg.get('sha1'), msg.get('error'))
+        for other in hosts:
+            self.unhold(other, job_id)
+            await self.nodes[other].send({'op': 'cancel', 'id': job_id})
+        if self.on_complete:
+            self.on_complete(self.jobs[job_id], ok)
+
+
+    def unhold(self, host:str, job_id:str):
+        self.held[host].discard(job_id)
+        self.held_bytes[host] -= self.jobs[job_id].get('size') or 0
+
+
+    def release(self, host:str):
+        for job_id in self.held.pop(host, ()):
+            hosts = self.leases[job_id]
+            hosts.discard(host)
+            if not hosts:
+                del self.leases[job_id]
+                self.started_at.pop(job_id, None)
+                self.pending.appendleft(self.jobs[job_id])
+        self.held_bytes.pop(host, None)
+        self.shares.pop(host, None)
+        self.nodes.pop(host, None)
+        self.wants.pop(host, None)
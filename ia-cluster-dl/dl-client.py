@@ -6,17 +6,18 @@ import sys
 import string
 import urllib
 import re
-import socket
-import json
+import asyncio
+import progressbar
+from argparse import ArgumentParser
+from archive import archiveDLSpider, largest_first
+from coordinator import Coordinator
+from registry import Registry
+from status import query, summarise
+from dlengine.limits import LimitsFile
 
 items = []
+REGISTRY = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'registry.sqlite')
 dlservers = ['192.168.1.1', '192.168.1.2', '192.168.1.3', '192.168.1.4', '192.168.1.5', '192.168.1.6', '192.168.1.7']
-port = 42069
-
-class fileItem(scrapy.Item):
-    name = scrapy.Field()
-    url = scrapy.Field()
-    directory = scrapy.Field()
 
 class ItemCollectorPipeline(object):
     def __init__(self):
@@ -25,59 +26,60 @@ class ItemCollectorPipeline(object):
     def process_item(self, item, spider):
         items.append(item)
 
-class archiveDLSpider(scrapy.Spider):
-    name = 'archiveDL'
-    allowed_domains = ['archive.org']
-    start_urls = ['https://archive.org/download/RedumpSegaDreamcast20160613', 'https://archive.org/download/redump.psp', 'https://archive.org/download/redump.psp.p2', 'https://archive.org/download/GameboyClassicRomCollectionByGhostware', 'https://archive.org/download/GameboyColorRomCollectionByGhostware', 'https://archive.org/download/GameboyAdvanceRomCollectionByGhostware']
-    reg = re.compile('.+\.zip')
-    def parse(self,response):
-        files = response.xpath('//table[@class="directory-listing-table"]/tbody/tr/td/a')
-        if files:
-            for f in files:
-                name = f.xpath('text()').extract_first()
-                if self.reg.match(name):
-                    item = fileItem()
-                    item['name'] = name
-                    item['url'] = response.url + "/" + f.xpath('@href').extract_first()
-                    item['directory'] = response.url.rsplit('/')[-1]
-                    yield item
-
-def sendToServer(host, msg, retry=3):
-    tries = 0
-    while tries < retry:
-        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        try:
-            #print("Sending to " + host + " try #" + str(tries) + ": " + msg)
-            s.connect((host, port))
-            s.send(msg.encode())
-            data = s.recv(1024).decode()
-            if data == 'OK':
-                break
-            else:
-                tries += 1
-                continue
-        except:
-            print(sys.exc_info()[0])
-            tries += 1
-            continue
-
 def main():
+    parser = ArgumentParser(prog='dl-client', description='Crawls the archive.org collections and hands the files to the dl-server nodes')
+    parser.add_argument('--limits', help='A JSON file of bytes/s and requests/s limits for the whole cluster, overall and per host, split evenly between the nodes. It is re-read when it changes, so the limits can be adjusted while downloading')
+    parser.add_argument('--registry', default=REGISTRY, help=f'SQLite file recording what the nodes have downloaded, so only new and changed files are sent out again. If omitted will default to {REGISTRY}')
+    parser.add_argument('--status', action='store_true', help='Show the queue, downloads waiting for their host, running downloads, throughput and error rate of every node and the whole cluster instead of crawling')
+    parser.add_argument('--watch', type=float, help='With --status, refresh it every WATCH seconds')
+    parser.add_argument('--transfers', action='store_true', help='With --status, list the running downloads of every node')
+    parser.add_argument('--pause', action='store_true', help='Pause the nodes instead of crawling')
+    parser.add_argument('--resume', action='store_true', help='Resume paused nodes instead of crawling')
+    parser.add_argument('--concurrency', type=int, help='Change how many downloads the nodes run at once instead of crawling')
+    parser.add_argument('--per-host', type=int, help='Change how many downloads the nodes run against one host at once instead of crawling')
+    parser.add_argument('--node', action='append', help='Only show or control this node. May be given more than once. If omitted will default to every node')
+    args = parser.parse_args()
+    if args.status or args.pause or args.resume or args.concurrency or args.per_host:
+        asyncio.run(control(args, args.node or dlservers))
+        return
+    limits = LimitsFile(args.limits) if args.limits else None
+    if limits:
+        limits.changed()
     process = CrawlerProcess({
     'USER_AGENT': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)',
     'ITEM_PIPELINES': { '__main__.ItemCollectorPipeline': 100 }})
     process.crawl(archiveDLSpider)
     process.start()
     print("Distributing files to be downloaded now...")
-    index = 0
-    for item in items:
-        item['directory'] = os.path.join(os.path.dirname(os.path.realpath(__file__)), item['directory'])
-        if not os.path.exists(os.path.join(item['directory'], item['name'])):
-            msg = json.dumps({'name': item['name'], 'directory': item['directory'], 'url': item['url']})
-            sendToServer(dlservers[index], msg)
-            index += 1
-            if index >= len(dlservers): index = 0
-    for server in dlservers:
-        sendToServer(server, 'END')
+    with Registry(args.registry) as registry:
+        jobs = []
+        for item in items:
+            item['directory'] = os.path.join(os.path.dirname(os.path.realpath(__file__)), item['directory'])
+            checksums = item.get('checksums') or {}
+            # Sizes are only exact when they came with checksums from files.xml
+            if not registry.completed(item['url'], item['size'] if checksums else None, checksums.get('sha1')):
+                jobs.append({'id': str(len(jobs)), 'name': item['name'], 'directory': item['directory'], 'url': item['url'], 'size': item['size'], 'checksums': item.get('checksums')})
+        print(f"{len(items) - len(jobs)} of {len(items)} files are already on the nodes")
+        asyncio.run(distribute(jobs, limits, registry))
+
+async def control(args, nodes):
+    if args.pause or args.resume:
+        statuses = await query(nodes, '/pause' if args.pause else '/resume', {})
+    elif args.concurrency or args.per_host:
+        statuses = await query(nodes, '/concurrency', {'total': args.concurrency, 'per_host': args.per_host})
+    else:
+        statuses = await query(nodes)
+    print(summarise(statuses, args.transfers))
+    while args.watch:
+        await asyncio.sleep(args.watch)
+        print()
+        print(summarise(await query(nodes), args.transfers))
+
+async def distribute(jobs, limits=None, registry=None):
+    progress = progressbar.bar.ProgressBar(max_value=len(jobs)).start()
+    coordinator = Coordinator(largest_first(jobs), limits=limits, registry=registry, on_complete=lambda job, ok: progress.increment())
+    await coordinator.run(dlservers)
+    progress.finish()
 
 if __name__ == '__main__':
     main()
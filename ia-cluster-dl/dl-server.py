@@ -1,79 +1,172 @@
-import requests
 import os
-import json
-import socket
-import multiprocessing
-import progressbar
-import time
+import asyncio
 import sys
+from argparse import ArgumentParser
+
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine import AIMDController, DownloadEngine, DownloadJob, Manifest, Metrics, RateLimiter, Reporter
+from dlengine.engine import remove_validators
+import protocol
+
+SEGMENTS = 8
+SEGMENT_THRESHOLD = 64 * 1024 * 1024
+SLOTS = 64
+PER_HOST = 16
+# Jobs held beyond the ones that can run, so a node never waits on the
+# coordinator between two downloads
+PREFETCH = 4
+# How often a node checks whether its limits grew enough to take more jobs
+PULL_INTERVAL = 1.0
+MANIFEST = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'manifest.sqlite')
 
 
 def main():
-    port = 42069
-    ip = '192.168.1.1'
-    pool = multiprocessing.get_context("spawn").Pool(4)
-    processes = []
-    serversocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    serversocket.bind((ip, port))
-    serversocket.listen(5)
-    end = False
-    while not end:
-        clientsocket, address = serversocket.accept()
-        msg = clientsocket.recv(1024).decode()
-        if msg == 'END':
-            end = True
-            clientsocket.send('OK'.encode())
-            continue
-        item = json.loads(msg)
-        #print(item)
-        os.makedirs(item['directory'], exist_ok=True)
-        processes.append(pool.apply_async(download, args = (item['url'], os.path.join(item['directory'], item['name']))))
-        clientsocket.send('OK'.encode())
-    serversocket.close()
-    pool.close()
-    progress = progressbar.bar.ProgressBar(max_value=len(processes)).start()
-    completed = 0
-    while completed < len(processes):
-        completed = 0
-        for p in processes:
-            if p.ready(): completed += 1
-        progress.update(completed)
-        time.sleep(1)
-    progress.finish()
-    pool.join()
-
-
-def download(url, path, rename=False, retry=3):
-    if os.path.exists(path) and not rename:
-        print(path + " already exists! Skipping!")
-    else:
-        if os.path.exists(path) and rename:
-            filename, ext = os.path.basename(path).rsplit('.', maxsplit=1)
-            newPath = path
-            count = 1
-            while os.path.exists(newPath):
-                newPath = os.path.join(os.path.dirname(path), filename + "[" + count + "]" + "." + ext)
-                count = count + 1
-            path = newPath
-        print("Downloading: " + url + " to " + path)
-        attempts = 0
-        while attempts < retry:
+    parser = ArgumentParser(prog='dl-server', description='Downloads the files a dl-client coordinator hands to this node')
+    parser.add_argument('--fixed-concurrency', action='store_true', help='Always keep the maximum number of downloads per host running instead of adapting it to the throughput and errors of each host')
+    parser.add_argument('--metrics-textfile', help='Rewrite this file with Prometheus metrics while downloading, for the node_exporter textfile collector')
+    parser.add_argument('--metrics-port', default=protocol.STATUS_PORT, type=int, help=f'Serve Prometheus metrics at http://<ip>:<port>/metrics, and the status and control endpoints dl-client --status talks to, while downloading. If omitted will default to {protocol.STATUS_PORT}')
+    args = parser.parse_args()
+    asyncio.run(serve(metrics_textfile=args.metrics_textfile, metrics_port=args.metrics_port, adaptive=not args.fixed_concurrency))
+
+
+def capacity(engine:DownloadEngine) -> int:
+    """
+    The jobs worth holding: as many as the engine lets run against its
+    busiest host right now, plus PREFETCH. Nearly everything comes from
+    archive.org, so anything beyond that would only sit in the queue where
+    no other node can get at it.
+    """
+    controller = engine.controller
+    limit = max(controller.limits().values(), default=controller.initial) if controller else engine.per_host
+    return min(limit, engine.limit) + PREFETCH
+
+
+def discard_partial(job:DownloadJob):
+    """
+    Removes what a cancelled job left of its download, for a file another
+    node finished.
+    """
+    temp_path = str(job.path) + '.part'
+    try:
+        os.remove(temp_path)
+    except FileNotFoundError:
+        pass
+    remove_validators(temp_path)
+
+
+async def serve(ip='192.168.1.1', port=protocol.PORT, manifest_path=MANIFEST, metrics_textfile=None, metrics_port=None, adaptive=True):
+    end = asyncio.Event()
+    # A coordinator that reconnects waits for the jobs of its lost
+    # connection to wind down first
+    busy = asyncio.Lock()
+    manifest = Manifest(manifest_path)
+    # Kept across connections, so the node can be watched and controlled
+    # while idle or between coordinators, and its settings stick
+    metrics = Metrics()
+    reporter = Reporter(textfile=metrics_textfile, port=metrics_port, host=ip, control=True)
+    await reporter.start(metrics)
+
+    async def handle(connection):
+        async with busy:
+            if await run(connection):
+                end.set()
+
+    async def run(connection) -> bool:
+        jobs = {}
+        ids = {}
+        limiter = RateLimiter()
+        ended = False
+        # Jobs asked for and not received yet
+        asked = 0
+        # Jobs another node finished first
+        lost = set()
+
+        def pull():
+            nonlocal asked
+            wanted = capacity(engine) - len(jobs) - asked
+            if wanted > 0:
+                asked += wanted
+                connection.post({'op': 'pull', 'n': wanted})
+
+        async def keep_pulling():
+            while True:
+                await asyncio.sleep(PULL_INTERVAL)
+                pull()
+
+        def on_start(job):
+            connection.post({'op': 'started', 'id': ids[job]})
+
+        def on_done(job, ok):
+            job_id = ids.pop(job)
+            del jobs[job_id]
+            if job_id in lost:
+                lost.discard(job_id)
+                if not ok:
+                    discard_partial(job)
+            connection.post({'op': 'done', 'id': job_id, 'ok': ok, 'bytes': job.size, 'sha1': job.sha1, 'error': job.error})
+            pull()
+
+        async with DownloadEngine(
+            concurrency=SLOTS,
+            per_host=PER_HOST,
+            queue_size=SLOTS,
+            segments=SEGMENTS,
+            segment_threshold=SEGMENT_THRESHOLD,
+            manifest=manifest,
+            limiter=limiter,
+            controller=AIMDController(maximum=PER_HOST) if adaptive else None,
+            # Failures are reported to the coordinator, which queues them
+            # again for another node, rather than waiting for a pass of
+            # our own
+            dead_letter_passes=0,
+            metrics=metrics,
+            on_start=on_start,
+            on_done=on_done
+        ) as engine:
+            await reporter.attach(engine)
+            heartbeat = asyncio.create_task(connection.heartbeat())
+            pulling = asyncio.create_task(keep_pulling())
             try:
-                r = requests.get(url, allow_redirects=True, timeout=5, stream=True)
-                if r.status_code == 200:
-                    size = int(r.headers.get('Content-Length'))
-                    with open(path+".part", 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=1024):
-                            f.write(chunk)
-                    os.rename(path+".part", path)
-                    print("Downloaded: " + path)
-                    break
-                else: attempts += 1
-            except:
-                attempts += 1
-                print(sys.exc_info()[0])
-            if attempts == retry - 1:
-                print("Could not download: " + url)
+                pull()
+                while (msg := await connection.receive(protocol.SILENCE_TIMEOUT)) is not None:
+                    if msg['op'] == 'jobs':
+                        asked = max(asked - len(msg['jobs']), 0)
+                        for item in msg['jobs']:
+                            #print(item)
+                            job = DownloadJob(item['url'], os.path.join(item['directory'], item['name']), item.get('checksums'))
+                            jobs[item['id']] = job
+                            ids[job] = item['id']
+                            await engine.submit(job)
+                    elif msg['op'] == 'cancel':
+                        if msg['id'] in jobs:
+                            lost.add(msg['id'])
+                            engine.cancel(jobs[msg['id']])
+                    elif msg['op'] == 'limits':
+                        limiter.update(msg['limits'])
+                    elif msg['op'] == 'end':
+                        ended = True
+                        break
+            except asyncio.TimeoutError:
+                print(f"Nothing from the coordinator for {protocol.SILENCE_TIMEOUT:.0f}s, dropping its jobs")
+            except (OSError, ValueError) as e:
+                print(f"Lost the coordinator: {e!r}")
+            finally:
+                heartbeat.cancel()
+                pulling.cancel()
+                if not ended:
+                    # The coordinator is gone and hands these jobs to other
+                    # nodes; partial files are kept for when they come back
+                    for job in list(jobs.values()):
+                        engine.cancel(job)
+        reporter.detach()
+        return ended
+
+    server = await protocol.serve(handle, ip, port)
+    await end.wait()
+    server.close()
+    await server.wait_closed()
+    await reporter.stop()
+    manifest.close()
 
 
 if __name__ == '__main__':
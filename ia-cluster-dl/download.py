@@ -1,19 +1,20 @@
 import scrapy
 from scrapy.crawler import CrawlerProcess
 import sys
-import requests
 import os
 import string
-import multiprocessing
 import urllib
 import re
-import time
-import progressbar
+from argparse import ArgumentParser
 
-class fileItem(scrapy.Item):
-    name = scrapy.Field()
-    url = scrapy.Field()
-    directory = scrapy.Field()
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine import AIMDController, DownloadJob, Manifest, Metrics, RateLimiter, Reporter, run_jobs
+from archive import archiveDLSpider, largest_first
+
+SEGMENTS = 8
+SEGMENT_THRESHOLD = 64 * 1024 * 1024
+PER_HOST = 16
+MANIFEST = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'manifest.sqlite')
 
 class ItemCollectorPipeline(object):
     def __init__(self):
@@ -22,83 +23,43 @@ class ItemCollectorPipeline(object):
     def process_item(self, item, spider):
         items.append(item)
 
-class archiveDLSpider(scrapy.Spider):
-    name = 'archiveDL'
-    allowed_domains = ['archive.org']
-    start_urls = ['https://archive.org/download/RedumpSegaDreamcast20160613', 'https://archive.org/download/redump.psp', 'https://archive.org/download/redump.psp.p2', 'https://archive.org/download/GameboyClassicRomCollectionByGhostware', 'https://archive.org/download/GameboyColorRomCollectionByGhostware', 'https://archive.org/download/GameboyAdvanceRomCollectionByGhostware']
-    reg = re.compile('.+\.zip')
-    def parse(self,response):
-        files = response.xpath('//table[@class="directory-listing-table"]/tbody/tr/td/a')
-        if files:
-            for f in files:
-                name = f.xpath('text()').extract_first()
-                if self.reg.match(name):
-                    item = fileItem()
-                    item['name'] = name
-                    item['url'] = response.url + "/" + f.xpath('@href').extract_first()
-                    item['directory'] = response.url.rsplit('/')[-1]
-                    yield item
-
-def download(url, path, rename=False, retry=3):
-    if os.path.exists(path) and not rename:
-        print(path + " already exists! Skipping!")
-    else:
-        if os.path.exists(path) and rename:
-            filename, ext = os.path.basename(path).rsplit('.', maxsplit=1)
-            newPath = path
-            count = 1
-            while os.path.exists(newPath):
-                newPath = os.path.join(os.path.dirname(path), filename + "[" + count + "]" + "." + ext)
-                count = count + 1
-            path = newPath
-        print("Downloading: " + url + " to " + path)
-        attempts = 0
-        while attempts < retry:
-            try:
-                r = requests.get(url, allow_redirects=True, timeout=5, stream=True)
-                if r.status_code == 200:
-                    size = int(r.headers.get('Content-Length'))
-                    with open(path+".part", 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=1024):
-                            f.write(chunk)
-                    os.rename(path+".part", path)
-                    print("Downloaded: " + path)
-                    break
-                else: attempts += 1
-            except:
-                attempts += 1
-                print(sys.exc_info()[0])
-            if attempts == retry - 1:
-                print("Could not download: " + url)
-
 def main():
+    parser = ArgumentParser(prog='archiveDL', description='Crawls the archive.org collections and downloads every zip')
+    parser.add_argument('-r', '--retry-failed', action='store_true', help='Only retry the files the manifest records as failed instead of crawling again')
+    parser.add_argument('--fixed-concurrency', action='store_true', help='Always keep the maximum number of downloads per host running instead of adapting it to the throughput and errors of each host')
+    parser.add_argument('--limits', help='A JSON file of bytes/s and requests/s limits, overall and per host. It is re-read when it changes, so the limits can be adjusted while downloading')
+    parser.add_argument('--metrics-textfile', help='Rewrite this file with Prometheus metrics while downloading, for the node_exporter textfile collector')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics at http://localhost:<port>/metrics while downloading')
+    args = parser.parse_args()
     try:
-        process = CrawlerProcess({
-        'USER_AGENT': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)',
-        'ITEM_PIPELINES': { '__main__.ItemCollectorPipeline': 100 }})
-        process.crawl(archiveDLSpider)
-        process.start()
-        print("Downloading files now...")
-        pool = multiprocessing.get_context("spawn").Pool(4)
-        processes = []
-        for item in items:
-            dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), item['directory'])
-            os.makedirs(dir, exist_ok=True)
-            processes.append(pool.apply_async(download, args = (item['url'], os.path.join(dir, item['name']))))
-        pool.close()
-        completed = 0
-        progress = progressbar.bar.ProgressBar(max_value=len(processes)).start()
-        while completed < len(processes):
-            completed = 0
-            for p in processes:
-                if p.ready(): completed += 1
-            progress.update(completed)
-            time.sleep(1)
-        progress.finish()
-        pool.join()
+        with Manifest(MANIFEST) as manifest:
+            total_bytes = 0
+            if args.retry_failed:
+                jobs = manifest.failed()
+            else:
+                process = CrawlerProcess({
+                'USER_AGENT': 'Mozilla/4.0 (compatible; MSIE 7.0; Windows NT 5.1)',
+                'ITEM_PIPELINES': { '__main__.ItemCollectorPipeline': 100 }})
+                process.crawl(archiveDLSpider)
+                process.start()
+                root = os.path.dirname(os.path.realpath(__file__))
+                jobs = [DownloadJob(item['url'], os.path.join(root, item['directory'], item['name']), item.get('checksums')) for item in largest_first(items)]
+                total_bytes = sum(item['size'] or 0 for item in items)
+            print("Downloading files now...")
+            run_jobs(
+                jobs,
+                segments=SEGMENTS,
+                segment_threshold=SEGMENT_THRESHOLD,
+                per_host=PER_HOST,
+                controller=None if args.fixed_concurrency else AIMDController(maximum=PER_HOST),
+                manifest=manifest,
+                metrics=Metrics(total_bytes=total_bytes),
+                limiter=RateLimiter(path=args.limits) if args.limits else None,
+                reporter=Reporter(textfile=args.metrics_textfile, port=args.metrics_port)
+            )
         print("Finished!")
     except KeyboardInterrupt:
-        pool.terminate()
+        pass
 
 if __name__ == '__main__':
     items = []
@@ -0,0 +1,109 @@
+import asyncio
+import json
+from typing import Optional
+
+PORT = 42069
+# Where dl-server serves its metrics and the status and control endpoints
+STATUS_PORT = 42070
+LINE_LIMIT = 16 * 1024 * 1024
+HEARTBEAT_INTERVAL = 5.0
+# A side that hears nothing for this long, not even a heartbeat, takes the
+# other one for gone
+SILENCE_TIMEOUT = 6 * HEARTBEAT_INTERVAL
+
+
+class Connection:
+    """
+    One long lived dl-client <-> dl-server connection carrying newline
+    delimited JSON messages. Every message is a dict with an 'op' key.
+
+    dl-server -> dl-client:
+    {'op': 'pull', 'n': count}        asks for up to `count` more jobs
+    {'op': 'started', 'id': id}       the job's body started coming in
+    {'op': 'done', 'id': id, 'ok': ok, 'bytes': size, 'sha1': sha1, 'error': error}
+                                      reports a finished job
+    {'op': 'heartbeat'}               sent every HEARTBEAT_INTERVAL seconds
+
+    dl-client -> dl-server:
+    {'op': 'jobs', 'jobs': [{'id', 'name', 'directory', 'url'}, ...]}
+    {'op': 'cancel', 'id': id}        another node finished the job first
+    {'op': 'limits', 'limits': {...}} this node's share of the rate limits
+    {'op': 'end'}                     there is no more work
+    {'op': 'heartbeat'}               sent every HEARTBEAT_INTERVAL seconds
+    """
+
+    def __init__(self, reader:asyncio.StreamReader, writer:asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+
+    @classmethod
+    async def open(cls, host:str, port:int = PORT, retry:int = 3, delay:float = 1):
+        for attempt in range(retry):
+            try:
+                reader, writer = await asyncio.open_connection(host, port, limit=LINE_LIMIT)
+                return cls(reader, writer)
+            except OSError as e:
+                print(f"Could not connect to {host} try #{attempt}: {e!r}")
+                if attempt == retry - 1:
+                    raise
+                await asyncio.sleep(delay)
+
+
+    def post(self, msg:dict):
+        """
+        Queues `msg` without waiting for the socket buffer to drain, for use
+        from synchronous callbacks. Messages posted after the connection was
+        lost are dropped.
+        """
+        if self.writer.is_closing():
+            return
+        self.writer.write(json.dumps(msg).encode() + b'\n')
+
+
+    async def send(self, msg:dict):
+        self.post(msg)
+        await self.writer.drain()
+
+
+    async def heartbeat(self, interval:float = HEARTBEAT_INTERVAL):
+        """
+        Tells the other side this one is alive every `interval` seconds,
+        until cancelled.
+        """
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.send({'op': 'heartbeat'})
+            except OSError:
+                return
+
+
+    async def receive(self, timeout:Optional[float] = None) -> Optional[dict]:
+        """
+        Returns the next message, or None once the other side closed the
+        connection. Raises asyncio.TimeoutError when nothing arrived for
+        `timeout` seconds.
+        """
+        line = await asyncio.wait_for(self.reader.readline(), timeout)
+        if not line:
+            return None
+        return json.loads(line)
+
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+
+async def serve(handler, host:str, port:int = PORT) -> asyncio.Server:
+    async def handle(reader, writer):
+        connection = Connection(reader, writer)
+        try:
+            await handler(connection)
+        finally:
+            await connection.close()
+    return await asyncio.start_server(handle, host, port, limit=LINE_LIMIT)
@@ -0,0 +1,108 @@
+import os
+import sqlite3
+import time
+from typing import Optional
+
+COMMIT_INTERVAL = 100
+
+
+class Registry:
+    """
+    SQLite record kept by the coordinator of every file the cluster has
+    downloaded, keyed by url: which node holds it, where, its size and
+    SHA-1 as that node reported them. Files land on whichever node got the
+    job, so this rather than the coordinator's own disk says what a repeat
+    run still has to dispatch.
+    """
+
+    def __init__(self, path:str, commit_interval:int = COMMIT_INTERVAL):
+        self.path = path
+        self.commit_interval = commit_interval
+        self.uncommitted = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.create_table()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+    def create_table(self):
+        self.connection.executescript(
+            """
+                CREATE TABLE IF NOT EXISTS completions (
+                    url TEXT PRIMARY KEY NOT NULL,
+                    node TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    bytes INTEGER,
+                    sha1 TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    updated REAL NOT NULL
+                );
+            """
+        )
+        self.connection.commit()
+
+
+    def completed(self, url:str, size:Optional[int] = None, sha1:Optional[str] = None) -> bool:
+        """
+        Whether a node holds `url`, and with the given `size` and `sha1`
+        when those are known, so a file that changed since is fetched again.
+        """
+        row = self.connection.execute(
+            "SELECT bytes, sha1 FROM completions WHERE url = ? AND status = 'done';",
+            (url,)
+        ).fetchone()
+        if row is None:
+            return False
+        return (not size or row[0] is None or row[0] == size) \
+            and (not sha1 or row[1] is None or row[1] == sha1)
+
+
+    def record(self, node:str, job:dict, ok:bool, size:Optional[int] = None, sha1:Optional[str] = None, error:Optional[str] = None):
+        self.connection.execute(
+            """
+                INSERT INTO completions (url, node, path, status, bytes, sha1, error, attempts, updated)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
+                ON CONFLICT (url) DO UPDATE SET
+                    node = excluded.node,
+                    path = excluded.path,
+                    status = excluded.status,
+                    bytes = COALESCE(excluded.bytes, bytes),
+                    sha1 = COALESCE(excluded.sha1, sha1),
+                    error = excluded.error,
+                    attempts = attempts + 1,
+                    updated = excluded.updated;
+            """,
+            (
+                job['url'],
+                node,
+                os.path.join(job['directory'], job['name']),
+                'done' if ok else 'failed',
+                size,
+                sha1,
+                None if ok else error,
+                time.time()
+            )
+        )
+        self.uncommitted += 1
+        if self.uncommitted >= self.commit_interval:
+            self.commit()
+
+
+    def commit(self):
+        self.connection.commit()
+        self.uncommitted = 0
+
+
+    def close(self):
+        self.commit()
+        self.connection.close()
@@ -0,0 +1,65 @@
+import asyncio
+import statistics
+from typing import Optional
+import aiohttp
+from protocol import STATUS_PORT
+
+TIMEOUT = 5.0
+# Nodes moving less than this share of the median node's bytes/s are flagged
+SLOW_FACTOR = 0.5
+
+
+async def query(hosts:list, path:str = '/status', body:Optional[dict] = None, port:int = STATUS_PORT) -> dict:
+    """
+    Sends a GET, or a POST of `body` when given, to `path` on every node's
+    status endpoint at once. Returns the JSON answers by host, with an
+    exception instead for the nodes that did not answer.
+    """
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=TIMEOUT)) as session:
+
+        async def ask(host:str):
+            url = f'http://{host}:{port}{path}'
+            request = session.get(url) if body is None else session.post(url, json=body)
+            async with request as response:
+                response.raise_for_status()
+                return await response.json()
+
+        answers = await asyncio.gather(*(ask(host) for host in hosts), return_exceptions=True)
+    return dict(zip(hosts, answers))
+
+
+def summarise(statuses:dict, transfers:bool = False) -> str:
+    """
+    Renders one line per node and a line of cluster totals, flagging nodes
+    much slower than the others. With `transfers`, every node's running
+    downloads are listed under it.
+    """
+    lines = [f"{'node':16} {'state':7} {'queue':>6} {'waiting':>7} {'running':>7} {'done':>7} {'failed':>6} {'MB/s':>8} {'files/s':>7} {'errors':>6}"]
+    answered = {host: status for host, status in statuses.items() if isinstance(status, dict)}
+    busy = [status['bytes_per_second'] for status in answered.values() if status['transfers']]
+    median = statistics.median(busy) if busy else 0
+    for host, status in statuses.items():
+        if not isinstance(status, dict):
+            lines.append(f"{host:16} {'down':7} {status!r}")
+            continue
+        state = 'paused' if status['paused'] else 'idle' if not status['transfers'] and not status['waiting'] else 'running'
+        slow = '  slow' if status['transfers'] and len(busy) > 1 and status['bytes_per_second'] < median * SLOW_FACTOR else ''
+        lines.append(
+            f"{host:16} {state:7} {status['queue_depth']:6} {status['waiting']:7} {len(status['transfers']):7} {status['done'] + status['skipped']:7} "
+            f"{status['failed']:6} {status['bytes_per_second'] / 1e6:8.2f} {status['files_per_second']:7.2f} {status['error_rate']:6.1%}{slow}"
+        )
+        if transfers:
+            for transfer in status['transfers']:
+                length = f"{transfer['length'] / 1e6:.1f}" if transfer['length'] else '?'
+                lines.append(f"    {transfer['bytes'] / 1e6:10.1f} of {length} MB  {transfer['url']}")
+    lines.append(
+        f"{'cluster':16} {f'{len(answered)}/{len(statuses)} up':7} "
+        f"{sum(status['queue_depth'] for status in answered.values()):6} "
+        f"{sum(status['waiting'] for status in answered.values()):7} "
+        f"{sum(len(status['transfers']) for status in answered.values()):7} "
+        f"{sum(status['done'] + status['skipped'] for status in answered.values()):7} "
+        f"{sum(status['failed'] for status in answered.values()):6} "
+        f"{sum(status['bytes_per_second'] for status in answered.values()) / 1e6:8.2f} "
+        f"{sum(status['files_per_second'] for status in answered.values()):7.2f}"
+    )
+    return '\n'.join(lines)
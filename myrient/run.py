@@ -3,28 +3,53 @@
 import scrapy
 from scrapy.crawler import CrawlerProcess
 import json
+import os
+import sys
 from pathlib import Path
-import requests
-from multiprocessing.pool import Pool
 from argparse import ArgumentParser
 import logging
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine import AIMDController, DownloadJob, Manifest, RateLimiter, Reporter, run_jobs
+from dlengine.listing import href_joiner, listing_rows
+from dlengine.pipeline import stream_settings
+
 DEFAULT_JSON = 'images.json'
 DL_DIR = 'download'
-DL_INSTANCES = 4
+DL_INSTANCES = 32
+MANIFEST = 'manifest.sqlite'
 
 def main():
     logging.getLogger("urllib3").setLevel(logging.WARNING)
     args = parse_args()
-    crawl(
-        url=args.url,
-        json_export=args.json,
-    )
-    download_images(
-        url_json=args.json,
-        dl_dir=args.output,
-        dl_instances=args.instances
-    )
+    reporter = Reporter(textfile=args.metrics_textfile, port=args.metrics_port)
+    limiter = RateLimiter(path=args.limits) if args.limits else None
+    controller = None if args.fixed_concurrency else AIMDController(maximum=args.instances)
+    with Manifest(args.manifest) as manifest:
+        if args.retry_failed:
+            print('Retrying the failed images now...')
+            run_jobs(manifest.failed(), concurrency=args.instances, per_host=args.instances, skip_existing=False, manifest=manifest, reporter=reporter, limiter=limiter, controller=controller)
+            return
+        crawl(
+            url=args.url,
+            json_export=args.json,
+            dl_dir=args.output if args.stream else None,
+            dl_instances=args.instances,
+            manifest=manifest,
+            reporter=reporter,
+            limiter=limiter,
+            controller=controller
+        )
+        if not args.stream:
+            download_images(
+                url_json=args.json,
+                dl_dir=args.output,
+                dl_instances=args.instances,
+                manifest=manifest,
+                reporter=reporter,
+                limiter=limiter,
+                controller=controller
+            )
 
 def parse_args():
     parser = ArgumentParser(
@@ -33,6 +58,7 @@ def parse_args():
     )
     parser.add_argument(
         'url',
+        nargs='?',
         help='The full url for the page on myrient.erista.me you want to parse'
     )
     parser.add_argument(
@@ -48,9 +74,46 @@ def parse_args():
     parser.add_argument(
         '-i', '--instances',
         default=DL_INSTANCES,
-        help=f'The number of instances you wish to use for the multiprocessing pool that will download the images. If omitted will default to {DL_INSTANCES}'
+        type=int,
+        help=f'The maximum number of concurrent downloads used to fetch the images. If omitted will default to {DL_INSTANCES}'
+    )
+    parser.add_argument(
+        '-s', '--stream',
+        action='store_true',
+        help='Download every image as soon as it is crawled instead of after the crawl has finished. The json file is still written'
+    )
+    parser.add_argument(
+        '-m', '--manifest',
+        default=MANIFEST,
+        help=f'The sqlite manifest recording which images have been downloaded. If omitted will default to {MANIFEST}'
+    )
+    parser.add_argument(
+        '-r', '--retry-failed',
+        action='store_true',
+        help='Only retry the images the manifest records as failed instead of crawling again'
+    )
+    parser.add_argument(
+        '--fixed-concurrency',
+        action='store_true',
+        help='Always keep the maximum number of downloads per host running instead of adapting it to the throughput and errors of each host'
+    )
+    parser.add_argument(
+        '--limits',
+        help='A JSON file of bytes/s and requests/s limits, overall and per host. It is re-read when it changes, so the limits can be adjusted while downloading'
+    )
+    parser.add_argument(
+        '--metrics-textfile',
+        help='Rewrite this file with Prometheus metrics while downloading, for the node_exporter textfile collector'
     )
-    return parser.parse_args()
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        help='Serve Prometheus metrics at http://localhost:<port>/metrics while downloading'
+    )
+    args = parser.parse_args()
+    if not args.url and not args.retry_failed:
+        parser.error('a url is required unless --retry-failed is given')
+    return args
 
 class myrientScraper(scrapy.Spider):
 
@@ -62,33 +125,44 @@ class myrientScraper(scrapy.Spider):
         super().__init__(*args, **kwargs)
 
     def parse(self, response):
-        links = response.xpath('//table[@id="list"]/tbody/tr/td[contains(@class, "link")]/a')
-        for link in links:
-            name = link.xpath('text()').get()
-            url = link.xpath('@href').get()
-            if url != '../':
-                yield {
-                    'name': name,
-                    'url': response.urljoin(url)
-                }
-
-def crawl(url:str, json_export:str):
+        join = href_joiner(response)
+        for _, cells in listing_rows(response, '//table[@id="list"]/tbody'):
+            for cell in cells:
+                if 'link' in cell.cls and cell.href and cell.href != '../':
+                    yield {
+                        'name': cell.text,
+                        'url': join(cell.href)
+                    }
+
+def crawl(url:str, json_export:str, dl_dir:str=None, dl_instances:int=DL_INSTANCES, manifest:Manifest=None, reporter:Reporter=None, limiter:RateLimiter=None, controller:AIMDController=None):
     json_export = Path(json_export)
     if json_export.exists():
         json_export.unlink()
-    process = CrawlerProcess(
-        settings={
-            "FEEDS": {
-                json_export: {"format": "json"},
-            },
-        }
-    )
+    settings = {
+        "FEEDS": {
+            json_export: {"format": "json"},
+        },
+    }
+    if dl_dir:
+        dl_dir = Path(dl_dir)
+        dl_dir.mkdir(exist_ok=True)
+        settings.update(stream_settings(
+            lambda image: [image_job(image, dl_dir)],
+            concurrency=dl_instances,
+            per_host=dl_instances,
+            skip_existing=False,
+            manifest=manifest,
+            reporter=reporter,
+            limiter=limiter,
+            controller=controller
+        ))
+    process = CrawlerProcess(settings=settings)
     process.crawl(myrientScraper, start_urls=[url])
     process.start()
     process.join()
 
 
-def download_images(url_json:str, dl_dir:str, dl_instances:int):
+def download_images(url_json:str, dl_dir:str, dl_instances:int, manifest:Manifest=None, reporter:Reporter=None, limiter:RateLimiter=None, controller:AIMDController=None):
 
     print('Starting to download the images now...')
 
@@ -99,43 +173,13 @@ def download_images(url_json:str, dl_dir:str, dl_instances:int):
     with open(url_json, 'rb') as infile:
         url_dict = json.load(infile)
 
-    pool = Pool(dl_instances)
-
-    for image in url_dict:
-        path = dl_dir.joinpath(image['name'])
-        pool.apply_async(download_file, (image['url'], path))
-                
-    pool.close()
-    pool.join()
+    jobs = (image_job(image, dl_dir) for image in url_dict)
+    run_jobs(jobs, concurrency=dl_instances, per_host=dl_instances, skip_existing=False, manifest=manifest, reporter=reporter, limiter=limiter, controller=controller)
 
     print('All images have been downloaded!')
 
-def download_file(url: str, path: Path, retry:int=3):
-
-    print("Downloading: " + path.__str__())
-
-    attempts = 0
-    while attempts < retry:
-
-        try:
-            response = requests.get(url, allow_redirects=True, timeout=5, stream=True)
-            if response.status_code == 200:
-                size = int(response.headers.get('Content-Length'))
-                temp_path = path.parent.joinpath(path.stem + '.part')
-                with open(temp_path, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=1024):
-                        f.write(chunk)
-                temp_path.rename(path)
-                print("Downloaded: " + path.__str__())
-                break
-            else: attempts += 1
-
-        except Exception as e:
-            attempts += 1
-            print(e)
-
-        if attempts == retry - 1:
-            print("Could not download: " + url)
+def image_job(image:dict, dl_dir:Path) -> DownloadJob:
+    return DownloadJob(image['url'], str(dl_dir.joinpath(image['name'])))
 
 if __name__ == '__main__':
     main()
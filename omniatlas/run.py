@@ -4,13 +4,28 @@ from spider import AtlasSpider
 from dotenv import load_dotenv
 import os
 import argparse
-from pathlib import Path
+
+CONCURRENCY = 16
 
 
 def main():
+    parser = argparse.ArgumentParser(prog='omniatlas', description='Crawls the omniatlas map frames of every region into MySQL')
+    parser.add_argument('-f', '--full', action='store_true', help='Walk every region from its first frame instead of resuming from its latest stored one. Stored frames are still skipped')
+    parser.add_argument('-d', '--discover', action='store_true', help='Schedule every frame found in the sitemap and in each page\'s timeline at once instead of following the next link of each region')
+    parser.add_argument('-c', '--concurrency', default=CONCURRENCY, type=int, help=f'The number of requests, pages and images alike, in flight at once. If omitted will default to {CONCURRENCY}')
+    parser.add_argument('--fixed-concurrency', action='store_true', help='Always keep --concurrency image downloads running instead of adapting it to the throughput and errors of the image host')
+    parser.add_argument('--limits', help='A JSON file of bytes/s and requests/s limits for the image downloads, overall and per host. It is re-read when it changes, so the limits can be adjusted while downloading')
+    parser.add_argument('--metrics-textfile', help='Rewrite this file with Prometheus metrics of the image downloads, for the node_exporter textfile collector')
+    parser.add_argument('--metrics-port', type=int, help='Serve Prometheus metrics of the image downloads at http://localhost:<port>/metrics')
+    args = parser.parse_args()
     logging.getLogger("urllib3").setLevel(logging.WARNING)
     load_dotenv()
     settings = {
+        "RESUME": not args.full,
+        "DISCOVER": args.discover,
+        "CONCURRENT_REQUESTS": args.concurrency,
+        "CONCURRENT_REQUESTS_PER_DOMAIN": args.concurrency,
+        "TWISTED_REACTOR": "twisted.internet.asyncioreactor.AsyncioSelectorReactor",
         "ITEM_PIPELINES": {
             "spider.AtlasFramePipeline": 300,
         },
@@ -19,7 +34,14 @@ def main():
         "MYSQL_USER": os.getenv("MYSQL_USER"),
         "MYSQL_PASS": os.getenv("MYSQL_PASS"),
         "MYSQL_DB": os.getenv("MYSQL_DB"),
-        "IMAGE_DIR": os.getenv("IMAGE_DIR", 'imagesmysqlpip')
+        "MYSQL_BATCH_SIZE": os.getenv("MYSQL_BATCH_SIZE", 500),
+        "MYSQL_BATCH_WINDOW": os.getenv("MYSQL_BATCH_WINDOW", 1.0),
+        "MYSQL_QUEUE_SIZE": os.getenv("MYSQL_QUEUE_SIZE", 10000),
+        "IMAGE_DIR": os.getenv("IMAGE_DIR", 'imagesmysqlpip'),
+        "ADAPTIVE_CONCURRENCY": not args.fixed_concurrency,
+        "RATE_LIMITS": args.limits,
+        "METRICS_TEXTFILE": args.metrics_textfile,
+        "METRICS_PORT": args.metrics_port
     }
     process = CrawlerProcess(
         settings=settings
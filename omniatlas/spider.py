@@ -1,22 +1,103 @@
-from scrapy import Spider
+from scrapy import Spider, Request
 from scrapy.crawler import Crawler
 from scrapy.item import Item, Field
 from scrapy.loader import ItemLoader
 from scrapy.exceptions import DropItem
 from itemadapter.adapter import ItemAdapter
 from itemloaders.processors import TakeFirst, Join, Compose
+from scrapy.utils.defer import deferred_from_coro
+from scrapy.utils.sitemap import Sitemap
 import mysql.connector
-import requests
+import asyncio
+import os
+import re
+import sys
 from urllib.parse import urlparse
 from datetime import date
 from uuid import uuid4
 from pathlib import Path
 from util import slugify
+from writer import BatchWriter, BATCH_SIZE, BATCH_WINDOW, QUEUE_SIZE
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine import AIMDController, DownloadEngine, DownloadJob, RateLimiter, Reporter
 
-class AtlasFramePipeline:
+INSERT_FRAME = """
+    INSERT INTO atlas_frame (
+        id,
+        region,
+        date,
+        title,
+        description,
+        url,
+        path
+    )
+    VALUES (%s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE url = url;
+"""
+FRAME_PATH = re.compile(r'^/maps/[^/]+/\d+/?$')
+
+
+class FrameIndex:
+    """
+    In-memory record of the frames already stored: every frame url, and the
+    url of the latest frame of each region keyed by the region slug in the
+    url path.
+    """
+
+    def __init__(self):
+        self.urls = set()
+        self.latest_frames = {}
+
+
+    def __contains__(self, url:str) -> bool:
+        return url in self.urls
+
+
+    @staticmethod
+    def region_key(url:str) -> str:
+        return urlparse(url).path.split('/')[2]
+
+
+    def add(self, url:str, frame_date:date):
+        self.urls.add(url)
+        key = self.region_key(url)
+        if key not in self.latest_frames or frame_date > self.latest_frames[key][0]:
+            self.latest_frames[key] = (frame_date, url)
 
-    def __init__(self, host:str, user:str, password:str, database:str, image_dir:str, port:int = 3306):
+
+    def latest(self, url:str):
+        """
+        Returns the url of the latest stored frame in the region of `url`.
+        """
+        frame = self.latest_frames.get(self.region_key(url))
+        return frame[1] if frame else None
+
+
+    def load(self, connection):
+        cursor = connection.cursor()
+        cursor.execute("SELECT url, date FROM atlas_frame;")
+        for url, frame_date in cursor:
+            self.add(url, frame_date)
+        cursor.close()
+
+
+class AtlasFramePipeline:
+    """
+    Streams the image of every frame to disk through a DownloadEngine on the
+    crawler's asyncio loop, then hands the frame's row to a BatchWriter that
+    inserts it in MySQL from a background thread. Image fetches are queued
+    to the engine's workers and connection pool, which take their limits
+    from the crawl's CONCURRENT_REQUESTS and CONCURRENT_REQUESTS_PER_DOMAIN
+    but count separately from Scrapy's own requests, so up to twice those
+    numbers can be in flight. Neither the fetches nor the inserts block the
+    reactor. The urls of the frames
+    already stored are loaded into a FrameIndex at open_spider, which drops
+    repeated frames before their image is fetched and tells the spider where
+    each region stopped.
+    """
+
+    def __init__(self, host:str, user:str, password:str, database:str, image_dir:str, port:int = 3306, engine_kwargs:dict = None, writer_kwargs:dict = None):
         self.host = host
         self.port = port
         self.user = user
@@ -24,6 +105,16 @@ class AtlasFramePipeline:
         self.database = database
         self.image_dir = Path(image_dir)
         self.image_dir.mkdir(parents=False, exist_ok=True)
+        # An item waits on its image, so a failure is reported at once
+        # rather than after a dead letter pass at the end of the crawl
+        self.engine = DownloadEngine(dead_letter_passes=0, on_done=self.on_done, **(engine_kwargs or {}))
+        # Futures of the items waiting on their image, by job
+        self.waiting = {}
+        self.writer = BatchWriter(self.connect, INSERT_FRAME, **(writer_kwargs or {}))
+        self.index = FrameIndex()
+        # Frames whose image is being fetched, so a repeat arriving
+        # meanwhile is dropped without touching the index
+        self.fetching = set()
 
 
     @classmethod
@@ -34,7 +125,24 @@ class AtlasFramePipeline:
             user=crawler.settings.get("MYSQL_USER"),
             password=crawler.settings.get("MYSQL_PASS"),
             database=crawler.settings.get("MYSQL_DB"),
-            image_dir=crawler.settings.get("IMAGE_DIR")
+            image_dir=crawler.settings.get("IMAGE_DIR"),
+            engine_kwargs={
+                "concurrency": crawler.settings.getint("CONCURRENT_REQUESTS"),
+                "per_host": crawler.settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN"),
+                "timeout": crawler.settings.getfloat("DOWNLOAD_TIMEOUT"),
+                "headers": {"User-Agent": crawler.settings.get("USER_AGENT")},
+                "reporter": Reporter(
+                    textfile=crawler.settings.get("METRICS_TEXTFILE"),
+                    port=crawler.settings.getint("METRICS_PORT") or None
+                ),
+                "controller": AIMDController(maximum=crawler.settings.getint("CONCURRENT_REQUESTS_PER_DOMAIN")) if crawler.settings.getbool("ADAPTIVE_CONCURRENCY", True) else None,
+                "limiter": RateLimiter(path=crawler.settings.get("RATE_LIMITS")) if crawler.settings.get("RATE_LIMITS") else None
+            },
+            writer_kwargs={
+                "batch_size": crawler.settings.getint("MYSQL_BATCH_SIZE", BATCH_SIZE),
+                "batch_window": crawler.settings.getfloat("MYSQL_BATCH_WINDOW", BATCH_WINDOW),
+                "queue_size": crawler.settings.getint("MYSQL_QUEUE_SIZE", QUEUE_SIZE)
+            }
         )
 
 
@@ -49,7 +157,8 @@ class AtlasFramePipeline:
                     title VARCHAR(255) NOT NULL,
                     description TEXT NOT NULL,
                     url VARCHAR(255) NOT NULL,
-                    path VARCHAR(255) NOT NULL
+                    path VARCHAR(255) NOT NULL,
+                    UNIQUE KEY atlas_frame_url (url)
                 );
             """
         )
@@ -57,29 +166,71 @@ class AtlasFramePipeline:
         self.connection.commit()
 
 
-    def open_spider(self, spider):
-        self.connection = mysql.connector.connect(
+    def create_url_index(self):
+        """
+        Adds the unique url index to tables created before it existed,
+        keeping one row of each set of duplicates.
+        """
+        cursor = self.connection.cursor()
+        cursor.execute("SHOW INDEX FROM atlas_frame WHERE Key_name = 'atlas_frame_url';")
+        if not cursor.fetchall():
+            cursor.execute("DELETE f FROM atlas_frame f JOIN atlas_frame g ON f.url = g.url AND f.id > g.id;")
+            print(f"Removed {cursor.rowcount} duplicate frames")
+            cursor.execute("CREATE UNIQUE INDEX atlas_frame_url ON atlas_frame (url);")
+        cursor.close()
+        self.connection.commit()
+
+
+    def connect(self):
+        return mysql.connector.connect(
             host=self.host,
             port=self.port,
             user=self.user,
             password=self.password,
             database=self.database
         )
+
+
+    def open_spider(self, spider):
+        self.connection = self.connect()
         self.create_table()
+        self.create_url_index()
+        self.index.load(self.connection)
+        self.connection.close()
+        print(f"{len(self.index.urls)} frames already stored")
+        spider.index = self.index
+        self.writer.start()
+        return deferred_from_coro(self.engine.start())
 
 
     def close_spider(self, spider):
-        self.connection.close()
+        return deferred_from_coro(self.close())
+
+
+    async def close(self):
+        await self.engine.close()
+        await asyncio.to_thread(self.writer.close)
+        print(f"Wrote {self.writer.written} frames, {self.writer.failed} failed")
+
+
+    def on_done(self, job:DownloadJob, ok:bool):
+        done = self.waiting.pop(job, None)
+        if done and not done.done():
+            done.set_result(ok)
 
 
-    def process_item(self, item, spider):
+    async def process_item(self, item, spider):
 
         adapter = ItemAdapter(item)
 
         image = adapter.get('image')
         if not image:
             raise DropItem("Missing image")
-        
+
+        url = adapter.get('url')
+        if url in self.index or url in self.fetching:
+            raise DropItem(f"Already stored {url}")
+
         image_id = uuid4().hex
 
         region = adapter.get('region')
@@ -90,38 +241,33 @@ class AtlasFramePipeline:
         image_name = image.split("/")[-1]
         image_path = image_region_path.joinpath(image_name)
 
-        with open(image_path, 'wb') as f:
-            f.write(requests.get(image).content)
-        
+        job = DownloadJob(image, str(image_path))
+        self.waiting[job] = done = asyncio.get_running_loop().create_future()
+        self.fetching.add(url)
+        try:
+            await self.engine.submit(job)
+            ok = await done
+        finally:
+            self.fetching.discard(url)
+            self.waiting.pop(job, None)
+        if not ok:
+            raise DropItem(f"Could not download {image}")
+        self.index.add(url, adapter.get('date'))
+
         frame_date = adapter.get('date')
         frame_date = f"{frame_date.year:04d}-{frame_date.month:02d}-{frame_date.day:02d}"
 
-        cursor = self.connection.cursor()
-        cursor.execute(
-            f"""
-                INSERT INTO atlas_frame (
-                    id,
-                    region,
-                    date,
-                    title,
-                    description,
-                    url,
-                    path
-                )
-                VALUES (%s, %s, %s, %s, %s, %s, %s);
-            """,
+        await self.writer.submit(
             (
                 image_id,
                 region,
                 frame_date,
                 adapter.get('title'),
                 adapter.get('description'),
-                adapter.get('url'),
+                url,
                 str(image_path.relative_to(self.image_dir))
             )
         )
-        self.connection.commit()
-        cursor.close()
         return item
 
 
@@ -165,6 +311,9 @@ class AtlasSpider(Spider):
         "https://omniatlas.com/maps/australasia/17880126/",
         "https://omniatlas.com/maps/eastern-mediterranean/61123/"
     ]
+    sitemap_urls = [
+        "https://omniatlas.com/sitemap.xml"
+    ]
 
 
     @staticmethod
@@ -180,8 +329,51 @@ class AtlasSpider(Spider):
         return loader.load_item()
 
 
+    async def start(self):
+        # AtlasFramePipeline attaches its FrameIndex at open_spider; when
+        # resuming, each region continues from its latest stored frame.
+        index = getattr(self, 'index', None)
+        if self.settings.getbool("DISCOVER"):
+            for url in self.sitemap_urls:
+                yield Request(url, callback=self.parse_sitemap)
+        for url in self.start_urls:
+            if index and self.settings.getbool("RESUME", True):
+                url = index.latest(url) or url
+            yield Request(url, callback=self.parse)
+
+
+    def parse_sitemap(self, response):
+        sitemap = Sitemap(response.body)
+        if sitemap.type == 'sitemapindex':
+            for entry in sitemap:
+                yield Request(entry['loc'], callback=self.parse_sitemap)
+        else:
+            yield from self.follow_frames(response, [entry['loc'] for entry in sitemap])
+
+
+    def follow_frames(self, response, links):
+        """
+        Requests every link in `links` that is a frame of one of the regions
+        in start_urls and is not stored yet. Repeats are left to the
+        scheduler's duplicate filter.
+        """
+        index = getattr(self, 'index', None)
+        regions = {(urlparse(url).netloc, FrameIndex.region_key(url)) for url in self.start_urls}
+        for link in links:
+            url = response.urljoin(link)
+            parsed = urlparse(url)
+            if FRAME_PATH.match(parsed.path) and (parsed.netloc, FrameIndex.region_key(url)) in regions \
+                    and not (index and url in index):
+                yield Request(url, callback=self.parse)
+
+
     def parse(self, response, **kwargs):
         yield self.parse_frame(response)
+        if self.settings.getbool("DISCOVER"):
+            # Every frame linked from the page, the timeline included, is
+            # scheduled at once instead of one next link at a time.
+            yield from self.follow_frames(response, response.xpath('//a/@href').getall())
+            return
         next_page = response.css('a.btn:nth-child(4)').xpath('@href').get()
         if next_page:
             yield response.follow(next_page, callback=self.parse)
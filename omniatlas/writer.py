@@ -0,0 +1,154 @@
+import asyncio
+import queue
+import threading
+import time
+from typing import Callable
+
+BATCH_SIZE = 500
+BATCH_WINDOW = 1.0
+QUEUE_SIZE = 10000
+STOP = object()
+
+
+class BatchWriter:
+    """
+    Inserts rows from a bounded queue on a background thread with its own
+    connection, one executemany and commit per batch. A batch is flushed once
+    it holds `batch_size` rows or its first row has waited `batch_window`
+    seconds. When the queue is full submit waits, which pushes back on
+    whatever produces the rows. A batch that fails is tried once more on a
+    new connection, so a connection dropped mid-run does not fail every
+    batch after it. If the thread cannot connect at all, rows are dropped
+    as failed and the error is raised from the next put, submit or close.
+    """
+
+    def __init__(
+        self,
+        connect:Callable,
+        statement:str,
+        batch_size:int = BATCH_SIZE,
+        batch_window:float = BATCH_WINDOW,
+        queue_size:int = QUEUE_SIZE
+    ):
+        self.connect = connect
+        self.statement = statement
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.queue = queue.Queue(queue_size)
+        self.thread = threading.Thread(target=self.run, name='BatchWriter', daemon=True)
+        self.written = 0
+        self.failed = 0
+        self.error = None
+
+
+    def start(self):
+        self.thread.start()
+
+
+    def put(self, row:tuple):
+        self.check()
+        self.queue.put(row)
+
+
+    async def submit(self, row:tuple):
+        """
+        Queues `row` without blocking the event loop, waiting on a worker
+        thread while the queue is full.
+        """
+        self.check()
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            await asyncio.to_thread(self.queue.put, row)
+
+
+    def close(self):
+        """
+        Flushes every queued row and stops the thread.
+        """
+        self.queue.put(STOP)
+        self.thread.join()
+        self.check()
+
+
+    def check(self):
+        if self.error:
+            raise self.error
+
+
+    def run(self):
+        try:
+            connection = self.connect()
+        except Exception as e:
+            print(f"Could not connect to write rows: {e}")
+            self.error = e
+            self.discard()
+            return
+        try:
+            stopping = False
+            while not stopping:
+                row = self.queue.get()
+                if row is STOP:
+                    break
+                batch = [row]
+                deadline = time.monotonic() + self.batch_window
+                while len(batch) < self.batch_size:
+                    try:
+                        row = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                    if row is STOP:
+                        stopping = True
+                        break
+                    batch.append(row)
+                connection = self.flush(connection, batch)
+        finally:
+            close_quietly(connection)
+
+
+    def discard(self):
+        """
+        Takes rows off the queue until close, so that nothing waiting to
+        put one is left blocked.
+        """
+        while self.queue.get() is not STOP:
+            self.failed += 1
+
+
+    def flush(self, connection, batch:list):
+        """
+        Inserts `batch`, reconnecting and trying once more if that fails.
+        Returns the connection to carry on with, None if there is none.
+        """
+        for attempt in range(2):
+            try:
+                if connection is None:
+                    connection = self.connect()
+                self.insert(connection, batch)
+                self.written += len(batch)
+                return connection
+            except Exception as e:
+                print(f"Could not write {len(batch)} rows: {e}" + ("" if attempt else ", reconnecting"))
+                # Closing drops the uncommitted transaction along with it
+                close_quietly(connection)
+                connection = None
+        self.failed += len(batch)
+        return None
+
+
+    def insert(self, connection, batch:list):
+        cursor = connection.cursor()
+        try:
+            cursor.executemany(self.statement, batch)
+            connection.commit()
+        finally:
+            cursor.close()
+
+
+def close_quietly(connection):
+    if connection is None:
+        return
+    try:
+        connection.close()
+    except Exception:
+        pass
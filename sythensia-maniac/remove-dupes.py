@@ -1,43 +1,155 @@
 #!/usr/bin/env python3
 
 import os
+from argparse import ArgumentParser
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from hashlib import md5
 
 CHECKER_INSTANCES = 4
 MIDI_ROOT_DIR = os.path.abspath('/mnt/media/Music/goonMidi')
+MIDI_EXTENSIONS = ('.mid',)
+PARTIAL_SIZE = 8 * 1024
+READ_SIZE = 1024 * 1024
+CHUNKSIZE = 256
 
 def main():
-    hashes = map_hashes(MIDI_ROOT_DIR)
-    for file in os.listdir(MIDI_ROOT_DIR):
-        full_path = os.path.abspath(os.path.join(MIDI_ROOT_DIR, file))
-        if os.path.isfile(full_path) and os.path.splitext(file)[1].lower() == '.mid':
-            with open(full_path, 'rb') as infile:
-                md5sum = md5(infile.read()).hexdigest()
-            if md5sum in hashes:
-                print(f'Removing {full_path}')
-                os.remove(full_path)
-
-def map_hashes(root_dir=MIDI_ROOT_DIR):
-    hashes=[]
-    subdirs = []
-    for file in os.listdir(root_dir):
-        full_path = os.path.abspath(os.path.join(root_dir, file))
-        if os.path.isdir(full_path):
-            subdirs.append(full_path)
-    
-    def recurse_subdir(subdir):
-        for file in os.listdir(subdir):
-            full_path = os.path.abspath(os.path.join(root_dir, file))
-            if os.path.isdir(full_path):
-                recurse_subdir(full_path)
-            elif os.path.isfile(full_path) and os.path.splitext(file)[1].lower() == '.mid':
-                with open(full_path, 'rb') as infile:
-                    hashes.append(md5(infile.read()).hexdigest())
-    
-    for subdir in subdirs:
-        recurse_subdir(subdir)
-
-    return hashes
+    args = parse_args()
+    duplicates = find_duplicates(args.root, args.instances)
+    root = os.path.abspath(args.root)
+    for group in duplicates:
+        keep, *copies = group
+        if args.action == 'report':
+            print(keep)
+            for copy in copies:
+                print(f'  {copy}')
+        elif args.action == 'delete':
+            # Only strays at the root with a copy in a subdirectory, unless
+            # told to remove duplicates everywhere
+            if not args.everywhere and os.path.dirname(os.path.abspath(keep)) == root:
+                continue
+            for copy in copies:
+                if not args.everywhere and os.path.dirname(os.path.abspath(copy)) != root:
+                    continue
+                print(f'Removing {copy}')
+                os.remove(copy)
+        elif args.action == 'hardlink':
+            for copy in copies:
+                print(f'Linking {copy} to {keep}')
+                try:
+                    hardlink(keep, copy)
+                except OSError as e:
+                    print(e)
+    print(f'{sum(len(group) - 1 for group in duplicates)} duplicates in {len(duplicates)} groups')
+
+def parse_args():
+    parser = ArgumentParser(
+        prog='removeDupes',
+        description='Finds MIDIs with identical content under a directory tree and reports, deletes or hardlinks the extra copies',
+    )
+    parser.add_argument(
+        'root',
+        nargs='?',
+        default=MIDI_ROOT_DIR,
+        help=f'The directory to search. If omitted will default to {MIDI_ROOT_DIR}'
+    )
+    parser.add_argument(
+        '-a', '--action',
+        choices=('report', 'delete', 'hardlink'),
+        default='report',
+        help='What to do with every copy but the one kept. If omitted will default to report'
+    )
+    parser.add_argument(
+        '-e', '--everywhere',
+        action='store_true',
+        help='With delete, remove every copy but the deepest one anywhere in the tree instead of only the copies at the root that also exist in a subdirectory'
+    )
+    parser.add_argument(
+        '-i', '--instances',
+        default=CHECKER_INSTANCES,
+        type=int,
+        help=f'The number of processes used for hashing. If omitted will default to {CHECKER_INSTANCES}'
+    )
+    return parser.parse_args()
+
+def scan(root_dir=MIDI_ROOT_DIR):
+    """
+    Yields (path, size, inode) for every MIDI under `root_dir` without
+    following symlinks.
+    """
+    stack = [root_dir]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file(follow_symlinks=False) and os.path.splitext(entry.name)[1].lower() in MIDI_EXTENSIONS:
+                    stat = entry.stat(follow_symlinks=False)
+                    yield entry.path, stat.st_size, (stat.st_dev, stat.st_ino)
+
+def find_duplicates(root_dir=MIDI_ROOT_DIR, instances=CHECKER_INSTANCES):
+    """
+    Returns groups of paths with identical content, the copy to keep first.
+    Files are grouped by size, then by a hash of their first PARTIAL_SIZE
+    bytes, and only files still colliding after that are hashed in full.
+    Paths that are already hardlinks of each other count as one file, and
+    files that cannot be read are skipped.
+    """
+    by_size = defaultdict(dict)
+    for path, size, inode in scan(root_dir):
+        by_size[size].setdefault(inode, path)
+    candidates = [(size, path) for size, inodes in by_size.items() if len(inodes) > 1 for path in inodes.values()]
+    with ProcessPoolExecutor(instances) as pool:
+        by_partial = defaultdict(list)
+        paths = [path for size, path in candidates]
+        for (size, path), digest in zip(candidates, pool.map(partial_hash, paths, chunksize=CHUNKSIZE)):
+            if digest is not None:
+                by_partial[(size, digest)].append(path)
+        groups = []
+        needs_full = []
+        for (size, digest), paths in by_partial.items():
+            if len(paths) < 2:
+                continue
+            if size <= PARTIAL_SIZE:
+                groups.append(paths)
+            else:
+                needs_full.extend((size, path) for path in paths)
+        by_full = defaultdict(list)
+        paths = [path for size, path in needs_full]
+        for (size, path), digest in zip(needs_full, pool.map(full_hash, paths, chunksize=CHUNKSIZE)):
+            if digest is not None:
+                by_full[(size, digest)].append(path)
+        groups.extend(paths for paths in by_full.values() if len(paths) > 1)
+    return [sorted(paths, key=keep_order) for paths in groups]
+
+def keep_order(path):
+    # The deepest copy is kept, so a file sorted into a subdirectory wins
+    # over a stray copy left at the root.
+    return (-path.count(os.sep), path)
+
+def partial_hash(path):
+    try:
+        with open(path, 'rb') as infile:
+            return md5(infile.read(PARTIAL_SIZE)).hexdigest()
+    except OSError as e:
+        print(f'Skipping {path}: {e}')
+        return None
+
+def full_hash(path):
+    digest = md5()
+    try:
+        with open(path, 'rb') as infile:
+            while chunk := infile.read(READ_SIZE):
+                digest.update(chunk)
+    except OSError as e:
+        print(f'Skipping {path}: {e}')
+        return None
+    return digest.hexdigest()
+
+def hardlink(keep, copy):
+    temp_path = copy + '.link'
+    os.link(keep, temp_path)
+    os.replace(temp_path, copy)
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -4,19 +4,119 @@ import scrapy
 from scrapy.crawler import CrawlerProcess
 import json
 import os
-import requests
-from multiprocessing.pool import Pool
+import sys
+from argparse import ArgumentParser
 from math import floor
 from functools import partial
 
+sys.path.append(os.path.join(os.path.dirname(os.path.realpath(__file__)), '..'))
+from dlengine import AIMDController, ContentStore, DownloadJob, Manifest, RateLimiter, Reporter, run_jobs
+from dlengine.listing import listing_rows
+from dlengine.pipeline import stream_settings
+
 SITEMAP = 'http://www.vgmusic.com/information/sitemap.php'
 MIDI_URL_JSON = os.path.join(os.getcwd(), 'midi_urls.json')
 DL_DIR = os.path.join(os.getcwd(), 'midis')
-DL_INSTANCES = 4
+DL_INSTANCES = 16
+DL_PER_HOST = 4
+MANIFEST = os.path.join(os.getcwd(), 'manifest.sqlite')
 
 def main():
-    fetch_midi_urls()
-    download_midis()
+    args = parse_args()
+    store = ContentStore(args.store) if args.store else None
+    with Manifest(args.manifest) as manifest:
+        engine_kwargs = {
+            'concurrency': args.instances,
+            'per_host': args.per_host,
+            'manifest': manifest,
+            'store': store,
+            'reporter': Reporter(textfile=args.metrics_textfile, port=args.metrics_port),
+            'limiter': RateLimiter(path=args.limits) if args.limits else None,
+            'controller': None if args.fixed_concurrency else AIMDController(maximum=args.per_host)
+        }
+        if args.retry_failed:
+            print('Retrying the failed MIDIs now...')
+            run_jobs(manifest.failed(), **engine_kwargs)
+        else:
+            fetch_midi_urls(
+                export_name=args.json,
+                dl_dir=args.output if args.stream else None,
+                **engine_kwargs
+            )
+            if not args.stream:
+                download_midis(
+                    midi_url_json=args.json,
+                    dl_dir=args.output,
+                    **engine_kwargs
+                )
+    if store:
+        store.close()
+
+def parse_args():
+    parser = ArgumentParser(
+        prog='vgmusicDL',
+        description='Crawls the vgmusic.com sitemap for MIDIs and subsequently downloads all of them',
+    )
+    parser.add_argument(
+        '-j', '--json',
+        default=MIDI_URL_JSON,
+        help=f'The json file where the MIDI urls are stored. If omitted will default to {MIDI_URL_JSON}'
+    )
+    parser.add_argument(
+        '-o', '--output',
+        default=DL_DIR,
+        help=f'The directory where you wish to store the downloaded MIDIs. If omitted will default to {DL_DIR}'
+    )
+    parser.add_argument(
+        '-i', '--instances',
+        default=DL_INSTANCES,
+        type=int,
+        help=f'The number of concurrent downloads. If omitted will default to {DL_INSTANCES}'
+    )
+    parser.add_argument(
+        '-p', '--per-host',
+        default=DL_PER_HOST,
+        type=int,
+        help=f'The maximum number of concurrent downloads from a single host. If omitted will default to {DL_PER_HOST}'
+    )
+    parser.add_argument(
+        '-s', '--stream',
+        action='store_true',
+        help='Download every MIDI as soon as it is crawled instead of after the crawl has finished. The json file is still written'
+    )
+    parser.add_argument(
+        '-m', '--manifest',
+        default=MANIFEST,
+        help=f'The sqlite manifest recording which MIDIs have been downloaded. If omitted will default to {MANIFEST}'
+    )
+    parser.add_argument(
+        '-r', '--retry-failed',
+        action='store_true',
+        help='Only retry the MIDIs the manifest records as failed instead of crawling again'
+    )
+    parser.add_argument(
+        '--store',
+        help='Keep every distinct MIDI once in this content addressed store and hardlink it into the output directory'
+    )
+    parser.add_argument(
+        '--fixed-concurrency',
+        action='store_true',
+        help='Always keep the maximum number of downloads per host running instead of adapting it to the throughput and errors of each host'
+    )
+    parser.add_argument(
+        '--limits',
+        help='A JSON file of bytes/s and requests/s limits, overall and per host. It is re-read when it changes, so the limits can be adjusted while downloading'
+    )
+    parser.add_argument(
+        '--metrics-textfile',
+        help='Rewrite this file with Prometheus metrics while downloading, for the node_exporter textfile collector'
+    )
+    parser.add_argument(
+        '--metrics-port',
+        type=int,
+        help='Serve Prometheus metrics at http://localhost:<port>/metrics while downloading'
+    )
+    return parser.parse_args()
 
 class vgmusicDL(scrapy.Spider):
 
@@ -68,40 +168,46 @@ class vgmusicDL(scrapy.Spider):
             data['system'] = system
         if manufacturer:
             data['manufacturer'] = manufacturer
-        rows = response.xpath('//table/tr')
         game = ''
-        i = 0
-        while i < len(rows):
-            if 'class' in rows[i].attrib and rows[i].attrib['class'] == 'header':
-                game = rows[i].xpath('td/a/text()').get()
+        for row_class, cells in listing_rows(response, '//table'):
+            if row_class == 'header':
+                game = cells[0].text if cells else None
                 if game:
                     data['games'][game] = {}
-            elif rows[i].xpath('td/a').get():
-                title = rows[i].xpath('td/a/text()').get()
-                link = response.url + rows[i].xpath('td/a/@href').get()
-                data['games'][game][title] = link
-            i+=1
+                continue
+            link = next((cell for cell in cells if cell.href), None)
+            if link:
+                data['games'][game][link.text] = response.url + link.href
         return data
 
-def fetch_midi_urls(export_name=MIDI_URL_JSON):
+def fetch_midi_urls(export_name=MIDI_URL_JSON, dl_dir=None, concurrency=DL_INSTANCES, per_host=DL_PER_HOST, **engine_kwargs):
     if os.path.isfile(export_name):
         os.remove(export_name)
-    process = CrawlerProcess(
-        settings={
-            "FEEDS": {
-                export_name: {"format": "json"},
-            },
-        }
-    )
+    settings = {
+        "FEEDS": {
+            export_name: {"format": "json"},
+        },
+    }
+    if dl_dir:
+        settings.update(stream_settings(
+            lambda item: midi_jobs([item], dl_dir),
+            concurrency=concurrency,
+            per_host=per_host,
+            **engine_kwargs
+        ))
+    process = CrawlerProcess(settings=settings)
     process.crawl(vgmusicDL)
     process.start()
     process.join()
 
-def download_midis(midi_url_json=MIDI_URL_JSON, dl_dir=DL_DIR, dl_instances=DL_INSTANCES):
+def download_midis(midi_url_json=MIDI_URL_JSON, dl_dir=DL_DIR, concurrency=DL_INSTANCES, per_host=DL_PER_HOST, **engine_kwargs):
     print('Starting to download the MIDIs now...')
-    downloader_pool = Pool(dl_instances)
     with open(midi_url_json, 'rb') as infile:
         midi_url_map = json.load(infile)
+    run_jobs(midi_jobs(midi_url_map, dl_dir), concurrency=concurrency, per_host=per_host, **engine_kwargs)
+    print('All MIDIs have been downloaded!')
+
+def midi_jobs(midi_url_map, dl_dir=DL_DIR):
     for system in midi_url_map:
         for game_title in system['games']:
             path = os.path.join(dl_dir, system['genre'])
@@ -110,35 +216,9 @@ def download_midis(midi_url_json=MIDI_URL_JSON, dl_dir=DL_DIR, dl_instances=DL_I
             if 'system' in system:
                 path = os.path.join(path, system['system'])
             path = os.path.join(path, game_title)
-            os.makedirs(path, exist_ok = True)
             game = system['games'][game_title]
             for midi in game:
-                downloader_pool.apply(download_file, (game[midi], midi, path))
-    downloader_pool.close()
-    downloader_pool.join()
-    print('All MIDIs have been downloaded!')
-
-def download_file(url, name, path, retry=3):
-    path = os.path.join(path, name+'.mid')
-    print("Downloading: " + url + " to " + path)
-    attempts = 0
-    while attempts < retry:
-        try:
-            r = requests.get(url, allow_redirects=True, timeout=5, stream=True)
-            if r.status_code == 200:
-                size = int(r.headers.get('Content-Length'))
-                with open(path+".part", 'wb') as f:
-                    for chunk in r.iter_content(chunk_size=1024):
-                        f.write(chunk)
-                os.rename(path+".part", path)
-                print("Downloaded: " + path)
-                break
-            else: attempts += 1
-        except Exception as e:
-            attempts += 1
-            print(e)
-        if attempts == retry - 1:
-            print("Could not download: " + url)
+                yield DownloadJob(game[midi], os.path.join(path, midi+'.mid'))
 
 
 if __name__ == '__main__':